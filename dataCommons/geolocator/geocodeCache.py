@@ -0,0 +1,268 @@
+""" dataCommons.geolocator.geocodeCache
+
+    This module implements a cache of reverse geocoding results, so that
+    postings which share the same (or nearly the same) coordinate don't have
+    to be geocoded again.
+
+    The cache is keyed by the coordinate, rounded to GEOCODE_CACHE_PRECISION
+    decimal places, along with the coordinate's bounds and accuracy.  The
+    results are held in a bounded in-memory LRU cache within each process,
+    and, if the GEOCODE_CACHE_USE_REDIS setting is True, in the data cache so
+    they can be shared between processes.
+
+    The cached results are discarded whenever the location data changes.  The
+    "import_polygons" and "calc_location_bounds" management commands call
+    invalidate() to do this; each process notices the change within
+    VERSION_CHECK_INTERVAL seconds.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from dataCommons.shared.models       import Location
+from dataCommons.shared.lib          import dataCache, referenceRegistry
+from dataCommons.shared.lib.lruCache import LRUCache
+
+#############################################################################
+
+# The number of seconds between checks of the reference data version number:
+
+VERSION_CHECK_INTERVAL = 60
+
+# The number of seconds to keep a geocoding result in the data cache:
+
+REDIS_TTL = 24 * 3600
+
+#############################################################################
+
+logger = logging.getLogger(__name__)
+
+#############################################################################
+
+def make_key(latitude, longitude, bounds=None, accuracy=None):
+    """ Return the cache key to use for the given coordinate.
+
+        The parameters are the same as for reverseGeocoder.calc_locations().
+        We return a string which identifies the given coordinate, rounded to
+        the configured precision, along with its bounds and accuracy.
+    """
+    precision = settings.GEOCODE_CACHE_PRECISION
+
+    if bounds != None:
+        bounds = ",".join([repr(float(n)) for n in bounds])
+
+    return "%.*f,%.*f|%s|%s" % (precision, latitude, precision, longitude,
+                                bounds, accuracy)
+
+#############################################################################
+
+def get_many(keys):
+    """ Return the cached geocoding results for the given keys.
+
+        'keys' is a list of cache keys, as returned by make_key().  We return a
+        dictionary mapping each key with a cached result to that result, where
+        each result is a dictionary mapping level names to Location objects,
+        as returned by calc_locations().  Note that the returned dictionaries
+        are shared, and must not be modified.
+    """
+    local_cache = _get_local_cache()
+
+    results = {}
+    missing = []
+    for key in keys:
+        result = local_cache.get(key)
+        if result == None:
+            missing.append(key)
+        else:
+            results[key] = result
+
+    num_local_hits = len(results)
+    num_redis_hits = 0
+
+    if len(missing) > 0 and settings.GEOCODE_CACHE_USE_REDIS:
+        try:
+            cached = dataCache.get_many([_redis_key(key) for key in missing])
+        except:
+            logger.exception("Unable to read cached geocoding results")
+            cached = {}
+
+        # Each cached result maps level names to Location record IDs.  Load
+        # all the Location objects we need with a single query.
+
+        location_ids = set()
+        for location_ids_by_level in cached.values():
+            location_ids.update(location_ids_by_level.values())
+        location_objs = Location.objects.in_bulk(list(location_ids))
+
+        for key in missing:
+            location_ids_by_level = cached.get(_redis_key(key))
+            if location_ids_by_level == None:
+                continue
+            result = {}
+            for level,location_id in location_ids_by_level.items():
+                if location_id in location_objs:
+                    result[level] = location_objs[location_id]
+            results[key] = result
+            local_cache.set(key, result)
+            num_redis_hits = num_redis_hits + 1
+
+    _record_stats(num_local_hits, num_redis_hits,
+                  len(keys) - num_local_hits - num_redis_hits)
+
+    return results
+
+#############################################################################
+
+def set_many(results):
+    """ Add the given geocoding results to the cache.
+
+        'results' is a dictionary mapping cache keys, as returned by
+        make_key(), to the geocoding result for that key, as returned by
+        calc_locations().
+    """
+    local_cache = _get_local_cache()
+    for key,result in results.items():
+        local_cache.set(key, result)
+
+    if len(results) > 0 and settings.GEOCODE_CACHE_USE_REDIS:
+        values = {}
+        for key,result in results.items():
+            location_ids_by_level = {}
+            for level,location in result.items():
+                location_ids_by_level[level] = location.id
+            values[_redis_key(key)] = location_ids_by_level
+        try:
+            dataCache.set_many(values, ttl=REDIS_TTL)
+        except:
+            logger.exception("Unable to cache geocoding results")
+
+#############################################################################
+
+def invalidate():
+    """ Discard all cached geocoding results.
+
+        This should be called whenever the location outlines or bounds have
+        been changed.  Note that this bumps the version number of the
+        reference data, so every process will discard its cached results and
+        reload its other location data.
+    """
+    global _checked_at
+
+    referenceRegistry.bump_version()
+
+    with _lock:
+        if _local_cache != None:
+            _local_cache.clear()
+        _checked_at = 0 # Pick up the new version number when next used.
+
+#############################################################################
+
+def get_stats():
+    """ Return statistics about the use of the geocode cache.
+
+        We return a dictionary with the following entries:
+
+            'local_hits'
+
+                The number of results found in the in-memory cache.
+
+            'redis_hits'
+
+                The number of results found in the data cache.
+
+            'misses'
+
+                The number of coordinates which had to be geocoded.
+
+            'hit_rate'
+
+                The fraction of lookups which were found in either cache, as
+                a floating-point number between 0 and 1.
+
+        Note that these statistics are for the current process only.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+
+    total = stats['local_hits'] + stats['redis_hits'] + stats['misses']
+    if total > 0:
+        stats['hit_rate'] = float(total - stats['misses']) / total
+    else:
+        stats['hit_rate'] = 0.0
+    return stats
+
+#############################################################################
+
+def reset_stats():
+    """ Reset the statistics returned by get_stats() back to zero.
+    """
+    with _stats_lock:
+        for key in _stats.keys():
+            _stats[key] = 0
+
+#############################################################################
+#                                                                           #
+#                    P R I V A T E   D E F I N I T I O N S                  #
+#                                                                           #
+#############################################################################
+
+def _get_local_cache():
+    """ Return the LRUCache object holding our in-memory geocoding results.
+
+        The cache is created the first time it is needed.  If the reference
+        data version has changed since the cache was last checked, we clear
+        the cache before returning it.
+    """
+    global _local_cache, _version, _checked_at
+
+    with _lock:
+        if _local_cache == None:
+            _local_cache = LRUCache(settings.GEOCODE_CACHE_SIZE)
+
+        if time.time() - _checked_at >= VERSION_CHECK_INTERVAL:
+            try:
+                version = referenceRegistry.get_version()
+            except:
+                logger.exception("Unable to read the reference data version")
+                version = _version
+
+            if version != _version:
+                _local_cache.clear()
+                _version = version
+            _checked_at = time.time()
+
+        return _local_cache
+
+#############################################################################
+
+def _redis_key(key):
+    """ Return the data cache key to use for the given cache key.
+
+        Note that we include the reference data version in the data cache
+        key, so that results cached before the location data was changed will
+        never be used.
+    """
+    return "geocode.%s.%s" % (_version, key)
+
+#############################################################################
+
+def _record_stats(num_local_hits, num_redis_hits, num_misses):
+    """ Update our cache statistics.
+    """
+    with _stats_lock:
+        _stats['local_hits'] = _stats['local_hits'] + num_local_hits
+        _stats['redis_hits'] = _stats['redis_hits'] + num_redis_hits
+        _stats['misses']     = _stats['misses']     + num_misses
+
+#############################################################################
+
+_local_cache = None
+_version     = None
+_checked_at  = 0
+_lock        = threading.Lock()
+
+_stats       = {'local_hits' : 0, 'redis_hits' : 0, 'misses' : 0}
+_stats_lock  = threading.Lock()
+
@@ -10,6 +10,7 @@ from django.core.management.base import BaseCommand, CommandError
 from django.contrib.gis.geos import *
 
 from dataCommons.shared.models import Location
+from dataCommons.geolocator    import geocodeCache
 
 #############################################################################
 
@@ -57,3 +58,8 @@ class Command(BaseCommand):
 
             self.stdout.write("done\n")
 
+        # Tell the running processes that the location data has changed, and
+        # discard any cached geocoding results.
+
+        geocodeCache.invalidate()
+
@@ -3,16 +3,27 @@
     This module defines the "import_polygons" management command used by the
     Data Commons system.  This imports the polygons from a given import file
     into the geolocator's database.
+
+    By default, the polygons are imported one at a time.  If the --stream
+    option is used, the import file is read a chunk of locations at a time,
+    the polygons in each chunk are split into location matches using a pool
+    of worker processes, and the location matches for each chunk are written
+    using bulk inserts within a single transaction.  This is much faster when
+    importing a large number of polygons.
 """
 import math
+import multiprocessing
+import time
 from optparse import make_option
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db                   import connection, transaction
 
 from django.contrib.gis.geos import *
 
 from dataCommons.geolocator.models import *
 from dataCommons.shared.models     import Location
+from dataCommons.geolocator        import geocodeCache
 
 #############################################################################
 
@@ -24,6 +35,8 @@ DEFAULT_NUM_CELLS_HIGH = 10
 MIN_CELL_HEIGHT        = 0.01
 MAX_CELL_HEIGHT        = 1.00
 
+DEFAULT_CHUNK_SIZE     = 100
+
 #############################################################################
 
 class Command(BaseCommand):
@@ -37,20 +50,60 @@ class Command(BaseCommand):
                     dest="nosplit",
                     default=False,
                     help="Store polygon unchanged rather than splitting it."),
+        make_option("--stream",
+                    action="store_true",
+                    dest="stream",
+                    default=False,
+                    help="Import polygons in parallel, a chunk at a time."),
+        make_option("--processes",
+                    type="int",
+                    dest="processes",
+                    default=None,
+                    help="Number of processes to use when streaming. " +
+                         "Defaults to the number of CPUs."),
+        make_option("--chunk-size",
+                    type="int",
+                    dest="chunk_size",
+                    default=DEFAULT_CHUNK_SIZE,
+                    help="Number of locations to import in each chunk when " +
+                         "streaming.  Default: %d." % DEFAULT_CHUNK_SIZE),
     )
 
     def handle(self, *args, **options):
         """ Run the "import_polygons" management command.
         """
-        no_split = options.get("nosplit", False)
+        no_split   = options.get("nosplit", False)
+        stream     = options.get("stream", False)
+        processes  = options.get("processes")
+        chunk_size = options.get("chunk_size") or DEFAULT_CHUNK_SIZE
 
         if len(args) == 0:
             raise CommandError("This command takes one parameter.")
         if len(args) > 1:
             raise CommandError("This command takes only one parameter.")
 
+        if chunk_size < 1:
+            raise CommandError("The chunk size must be at least 1.")
+        if processes != None and processes < 1:
+            raise CommandError("The number of processes must be at least 1.")
+
         f = file(args[0], "r")
-        for line in f.readlines():
+        if stream:
+            self.import_streaming(f, no_split, processes, chunk_size)
+        else:
+            self.import_serial(f, no_split)
+        f.close()
+
+        # Tell the running processes that the location data has changed, and
+        # discard any cached geocoding results.
+
+        geocodeCache.invalidate()
+
+
+    def import_serial(self, f, no_split):
+        """ Import the polygons in the given file one at a time.
+        """
+        for line in f:
             loc_code,wkt = line.rstrip().split("\t", 1)
             self.stdout.write("Processing " + loc_code + "...\n")
 
@@ -66,171 +119,317 @@ class Command(BaseCommand):
 
             LocationMatch.objects.filter(location=location).delete()
 
-            # Parse the WKT to get the location's outline.
+            # Split the location's outline into location matches, and save
+            # them.
 
-            outline = GEOSGeometry(wkt)
-
-            if no_split:
-                # We simply store the location's outline as a single matching
-                # polygon in the database, rather than trying to split it into
-                # smaller pieces.
+            for outline,interior in split_polygon(wkt, no_split, self.stdout):
                 match = LocationMatch()
                 match.location = location
-                match.outline  = make_multiPolygon(outline)
+                match.outline  = outline
+                match.interior = interior
                 match.save()
-                continue
-
-            # Get the outline's bounds.
-
-            min_long,min_lat,max_long,max_lat = outline.extent
-            outline_width  = max_long - min_long
-            outline_height = max_lat  - min_lat
-
-            # Divide the outline into "cells" of a certain width and height.
-            # We initially try to divide the outline into a given number of
-            # cells, but adjust the cell size up or down to ensure it remains
-            # reasonable.
-
-            cell_width = float(outline_width) / float(DEFAULT_NUM_CELLS_WIDE)
-            if cell_width < MIN_CELL_WIDTH: cell_width = MIN_CELL_WIDTH
-            if cell_width > MAX_CELL_WIDTH: cell_width = MAX_CELL_WIDTH
 
-            cell_height = float(outline_height) / float(DEFAULT_NUM_CELLS_HIGH)
-            if cell_height < MIN_CELL_HEIGHT: cell_height = MIN_CELL_HEIGHT
-            if cell_height > MAX_CELL_HEIGHT: cell_height = MAX_CELL_HEIGHT
 
-            num_cells_wide = int(float(outline_width)/float(cell_width))+1
-            num_cells_high = int(float(outline_height)/float(cell_height))+1
+    def import_streaming(self, f, no_split, processes, chunk_size):
+        """ Import the polygons in the given file a chunk at a time.
 
-            self.stdout.write("  dividing location into %d by %d cells\n" %
-                              (num_cells_wide, num_cells_high))
-            self.stdout.write("  %d cells in total\n" %
-                              (num_cells_wide * num_cells_high))
-
-            # Calculate the "origin" on which to base our cells.  We shift the
-            # lower-left corner cell down and to the left by half a cell, to
-            # give us a buffer around the location's outline.
-
-            origin_x = min_long - cell_width / 2.0
-            origin_y = min_lat  - cell_height / 2.0
+            The file is read one line at a time, and the polygons are split
+            into location matches by a pool of worker processes.  While the
+            workers are splitting one chunk of polygons, we save the location
+            matches for the previous chunk, replacing the matches for each
+            location in that chunk within a single transaction.
+        """
+        # Close our database connection so that it isn't shared with the
+        # worker processes.
+
+        connection.close()
+
+        pool = multiprocessing.Pool(processes)
+
+        self.start_time    = time.time()
+        self.num_locations = 0
+        self.num_matches   = 0
+        self.num_unknown   = 0
+        self.num_failed    = 0
+
+        try:
+            pending = None # AsyncResult for the chunk being split.
+            for chunk in _read_chunks(f, chunk_size):
+                tasks = []
+                for loc_code,wkt in chunk:
+                    tasks.append((loc_code, wkt, no_split))
+                result = pool.map_async(_split_polygon_task, tasks)
+
+                if pending != None:
+                    self.save_chunk(pending.get())
+                pending = result
+
+            if pending != None:
+                self.save_chunk(pending.get())
+        finally:
+            pool.terminate()
+            pool.join()
+
+        time_taken = time.time() - self.start_time
+        if time_taken > 0:
+            rate = self.num_locations / time_taken
+        else:
+            rate = 0.0
+
+        self.stdout.write("Imported %d locations (%d location matches) " %
+                          (self.num_locations, self.num_matches) +
+                          "in %0.1f seconds, %0.1f locations/second.\n" %
+                          (time_taken, rate))
+        if self.num_unknown > 0:
+            self.stdout.write("%d unknown locations skipped.\n" %
+                              self.num_unknown)
+        if self.num_failed > 0:
+            self.stdout.write("%d polygons could not be split.\n" %
+                              self.num_failed)
+
+
+    def save_chunk(self, results):
+        """ Save the location matches for a chunk of split polygons.
+
+            'results' is a list of (loc_code, matches, error) tuples, as
+            returned by _split_polygon_task().  We replace the existing
+            location matches for the locations in this chunk with the new
+            matches, using a single transaction.
+        """
+        location_ids = dict(Location.objects.filter(
+                                code__in=[r[0] for r in results])
+                                            .values_list("code", "id"))
+
+        matches    = []
+        to_replace = []
+        for loc_code,split_matches,error in results:
+            if error != None:
+                self.stdout.write("  %s: unable to split polygon: %s\n" %
+                                  (loc_code, error))
+                self.num_failed = self.num_failed + 1
+                continue
 
-            # Process each cell in turn, building lists of partially and fully
-            # enclosed cells.
+            location_id = location_ids.get(loc_code)
+            if location_id == None:
+                self.stdout.write("  %s: unknown location!\n" % loc_code)
+                self.num_unknown = self.num_unknown + 1
+                continue
 
-            partly_enclosed_cells = []
-            fully_enclosed_cells  = []
+            to_replace.append(location_id)
+            for outline,interior in split_matches:
+                matches.append(LocationMatch(location_id=location_id,
+                                             outline=outline,
+                                             interior=interior))
 
-            self.stdout.write("  processing cells")
-            self.stdout.flush()
+        with transaction.commit_on_success():
+            LocationMatch.objects.filter(location__in=to_replace).delete()
+            LocationMatch.objects.bulk_create(matches)
 
-            n = 0
-            for cell_y in range(num_cells_high):
-                for cell_x in range(num_cells_wide):
-                    n = n + 1
-                    if n % 100 == 0:
-                        self.stdout.write(".")
-                        self.stdout.flush()
+        self.num_locations = self.num_locations + len(to_replace)
+        self.num_matches   = self.num_matches   + len(matches)
 
-                    # Calculate the lat/long bounds for this cell.
+        time_taken = time.time() - self.start_time
+        if time_taken > 0:
+            rate = self.num_locations / time_taken
+        else:
+            rate = 0.0
 
-                    cell_left   = origin_x + (cell_x * cell_width)
-                    cell_right  = cell_left + cell_width
-                    cell_bottom = origin_y + (cell_y * cell_height)
-                    cell_top    = cell_bottom + cell_height
+        self.stdout.write("%d locations imported, %0.1f locations/second\n" %
+                          (self.num_locations, rate))
+        self.stdout.flush()
 
-                    cell_bounds = Polygon(((cell_left,  cell_bottom),
-                                           (cell_left,  cell_top),
-                                           (cell_right, cell_top),
-                                           (cell_right, cell_bottom),
-                                           (cell_left,  cell_bottom)))
+#############################################################################
 
-                    # If the cell bounds fits partly or entirely in the
-                    # location's outline, remember this cell.
+def split_polygon(wkt, no_split=False, stdout=None):
+    """ Split a location's outline into location matches.
 
-                    if outline.contains(cell_bounds):
-                        fully_enclosed_cells.append((cell_x, cell_y))
-                    elif outline.intersects(cell_bounds):
-                        partly_enclosed_cells.append((cell_x, cell_y))
+        The parameters are as follows:
 
-            self.stdout.write("\n")
-            self.stdout.write("  %d cells found with full matches\n" %
-                              len(fully_enclosed_cells))
-            self.stdout.write("  %d cells found with part matches\n" %
-                              len(partly_enclosed_cells))
+            'wkt'
 
-            # Merge the fully-enclosed cells into the smallest possible number
-            # of contiguous rectangles, and store each rectangle as a location
-            # match.
+                The location's outline, in WKT format.
 
-            num_matches = 0
+            'no_split'
 
-            for merged_cell in merge_cells(fully_enclosed_cells,
-                                           num_cells_wide, num_cells_high):
-                left,bottom,width,height = merged_cell
+                If True, the outline is used as a single location match rather
+                than being split into smaller pieces.
 
-                rect_left   = origin_x + left * cell_width
-                rect_right  = rect_left + width * cell_width
-                rect_bottom = origin_y + bottom * cell_height
-                rect_top    = rect_bottom + height * cell_height
+            'stdout'
 
-                rect_bounds = Polygon(((rect_left,  rect_bottom),
-                                       (rect_left,  rect_top),
-                                       (rect_right, rect_top),
-                                       (rect_right, rect_bottom),
-                                       (rect_left,  rect_bottom)))
+                If supplied, a file-like object to write our progress to.
 
-                match = LocationMatch()
-                match.location = location
-                match.outline  = make_multiPolygon(rect_bounds)
-                match.save()
+        We divide the outline into a grid of cells, and merge the fully- and
+        partly-enclosed cells into rectangles.  Upon completion, we return a
+        list of (outline, interior) tuples, one for each location match, where
+        'outline' is a MultiPolygon and 'interior' is True if the location
+        match is a rectangle lying entirely within the location.
+    """
+    matches = []
 
-                num_matches = num_matches + 1
+    # Parse the WKT to get the location's outline.
+
+    outline = GEOSGeometry(wkt)
 
-            self.stdout.write("  %d fully-enclosed rectangles saved\n" %
-                              num_matches)
+    if no_split:
+        # We simply use the location's outline as a single matching polygon,
+        # rather than trying to split it into smaller pieces.
+        match_outline = make_multiPolygon(outline)
+        matches.append((match_outline,
+                        match_outline.equals(match_outline.envelope)))
+        return matches
+
+    # Get the outline's bounds.
+
+    min_long,min_lat,max_long,max_lat = outline.extent
+    outline_width  = max_long - min_long
+    outline_height = max_lat  - min_lat
 
-            # Now do the same for the partly-enclosed cells.  The only
-            # difference is that this time we intersect the rectangle bounds
-            # with the location's outline to get the portion of the outline
-            # that fits inside the desired rectangle.
+    # Divide the outline into "cells" of a certain width and height.  We
+    # initially try to divide the outline into a given number of cells, but
+    # adjust the cell size up or down to ensure it remains reasonable.
 
-            num_matches = 0
+    cell_width = float(outline_width) / float(DEFAULT_NUM_CELLS_WIDE)
+    if cell_width < MIN_CELL_WIDTH: cell_width = MIN_CELL_WIDTH
+    if cell_width > MAX_CELL_WIDTH: cell_width = MAX_CELL_WIDTH
 
-            for merged_cell in merge_cells(partly_enclosed_cells,
-                                           num_cells_wide, num_cells_high):
-                left,bottom,width,height = merged_cell
+    cell_height = float(outline_height) / float(DEFAULT_NUM_CELLS_HIGH)
+    if cell_height < MIN_CELL_HEIGHT: cell_height = MIN_CELL_HEIGHT
+    if cell_height > MAX_CELL_HEIGHT: cell_height = MAX_CELL_HEIGHT
 
-                rect_left   = origin_x + left * cell_width
-                rect_right  = rect_left + width * cell_width
-                rect_bottom = origin_y + bottom * cell_height
-                rect_top    = rect_bottom + height * cell_height
+    num_cells_wide = int(float(outline_width)/float(cell_width))+1
+    num_cells_high = int(float(outline_height)/float(cell_height))+1
 
-                rect_bounds = Polygon(((rect_left,  rect_bottom),
-                                       (rect_left,  rect_top),
-                                       (rect_right, rect_top),
-                                       (rect_right, rect_bottom),
-                                       (rect_left,  rect_bottom)))
+    if stdout != None:
+        stdout.write("  dividing location into %d by %d cells\n" %
+                     (num_cells_wide, num_cells_high))
+        stdout.write("  %d cells in total\n" %
+                     (num_cells_wide * num_cells_high))
 
-                try:
-                    intersection = outline.intersection(rect_bounds)
-                except GEOSException:
-                    intersection = None
+    # Calculate the "origin" on which to base our cells.  We shift the
+    # lower-left corner cell down and to the left by half a cell, to give us a
+    # buffer around the location's outline.
 
-                if intersection != None:
-                    if intersection.area > 0:
-                        match = LocationMatch()
-                        match.location = location
-                        match.outline  = make_multiPolygon(intersection)
-                        match.save()
+    origin_x = min_long - cell_width / 2.0
+    origin_y = min_lat  - cell_height / 2.0
+
+    # Process each cell in turn, building lists of partially and fully
+    # enclosed cells.
 
-                        num_matches = num_matches + 1
+    partly_enclosed_cells = []
+    fully_enclosed_cells  = []
+
+    if stdout != None:
+        stdout.write("  processing cells")
+        stdout.flush()
+
+    n = 0
+    for cell_y in range(num_cells_high):
+        for cell_x in range(num_cells_wide):
+            n = n + 1
+            if n % 100 == 0 and stdout != None:
+                stdout.write(".")
+                stdout.flush()
+
+            # Calculate the lat/long bounds for this cell.
+
+            cell_left   = origin_x + (cell_x * cell_width)
+            cell_right  = cell_left + cell_width
+            cell_bottom = origin_y + (cell_y * cell_height)
+            cell_top    = cell_bottom + cell_height
+
+            cell_bounds = Polygon(((cell_left,  cell_bottom),
+                                   (cell_left,  cell_top),
+                                   (cell_right, cell_top),
+                                   (cell_right, cell_bottom),
+                                   (cell_left,  cell_bottom)))
+
+            # If the cell bounds fits partly or entirely in the location's
+            # outline, remember this cell.
+
+            if outline.contains(cell_bounds):
+                fully_enclosed_cells.append((cell_x, cell_y))
+            elif outline.intersects(cell_bounds):
+                partly_enclosed_cells.append((cell_x, cell_y))
+
+    if stdout != None:
+        stdout.write("\n")
+        stdout.write("  %d cells found with full matches\n" %
+                     len(fully_enclosed_cells))
+        stdout.write("  %d cells found with part matches\n" %
+                     len(partly_enclosed_cells))
+
+    # Merge the fully-enclosed cells into the smallest possible number of
+    # contiguous rectangles, and use each rectangle as an interior location
+    # match.  Coordinates within an interior match can be found with a simple
+    # bounding box test rather than an exact point-in-polygon test.
+
+    num_matches = 0
+
+    for merged_cell in merge_cells(fully_enclosed_cells,
+                                   num_cells_wide, num_cells_high):
+        left,bottom,width,height = merged_cell
+
+        rect_left   = origin_x + left * cell_width
+        rect_right  = rect_left + width * cell_width
+        rect_bottom = origin_y + bottom * cell_height
+        rect_top    = rect_bottom + height * cell_height
+
+        rect_bounds = Polygon(((rect_left,  rect_bottom),
+                               (rect_left,  rect_top),
+                               (rect_right, rect_top),
+                               (rect_right, rect_bottom),
+                               (rect_left,  rect_bottom)))
+
+        matches.append((make_multiPolygon(rect_bounds), True))
+
+        num_matches = num_matches + 1
+
+    if stdout != None:
+        stdout.write("  %d fully-enclosed rectangles saved\n" % num_matches)
+
+    # Now do the same for the partly-enclosed cells.  The only difference is
+    # that this time we intersect the rectangle bounds with the location's
+    # outline to get the portion of the outline that fits inside the desired
+    # rectangle.
+
+    num_matches = 0
+
+    for merged_cell in merge_cells(partly_enclosed_cells,
+                                   num_cells_wide, num_cells_high):
+        left,bottom,width,height = merged_cell
+
+        rect_left   = origin_x + left * cell_width
+        rect_right  = rect_left + width * cell_width
+        rect_bottom = origin_y + bottom * cell_height
+        rect_top    = rect_bottom + height * cell_height
+
+        rect_bounds = Polygon(((rect_left,  rect_bottom),
+                               (rect_left,  rect_top),
+                               (rect_right, rect_top),
+                               (rect_right, rect_bottom),
+                               (rect_left,  rect_bottom)))
+
+        try:
+            intersection = outline.intersection(rect_bounds)
+        except GEOSException:
+            intersection = None
+
+        if intersection != None:
+            if intersection.area > 0:
+                # Note that if the intersection is a plain rectangle, it lies
+                # entirely within the location and can be treated as an
+                # interior match.
+
+                match_outline = make_multiPolygon(intersection)
+                matches.append((match_outline,
+                                match_outline.equals(match_outline.envelope)))
 
-            self.stdout.write("  %d partly-enclosed rectangles saved\n" %
-                              num_matches)
+                num_matches = num_matches + 1
 
-        # That's all, folks!
+    if stdout != None:
+        stdout.write("  %d partly-enclosed rectangles saved\n" % num_matches)
 
-        f.close()
+    return matches
 
 #############################################################################
 
@@ -593,3 +792,44 @@ class CellRect:
         else:
             self.restore(state_2)
 
+
+#############################################################################
+#                                                                           #
+#                    P R I V A T E   D E F I N I T I O N S                  #
+#                                                                           #
+#############################################################################
+
+def _read_chunks(f, chunk_size):
+    """ Read the given import file a chunk at a time.
+
+        We yield a list of up to 'chunk_size' (loc_code, wkt) tuples at a
+        time, reading the file one line at a time so that the entire file
+        doesn't have to be held in memory.
+    """
+    chunk = []
+    for line in f:
+        line = line.rstrip()
+        if line == "": continue
+        chunk.append(tuple(line.split("\t", 1)))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    if len(chunk) > 0:
+        yield chunk
+
+#############################################################################
+
+def _split_polygon_task(task):
+    """ Split a single polygon within a worker process.
+
+        'task' is a (loc_code, wkt, no_split) tuple.  We return a (loc_code,
+        matches, error) tuple, where 'matches' is the list of location matches
+        returned by split_polygon(), and 'error' is None if the polygon was
+        split successfully, or a string describing what went wrong.
+    """
+    loc_code,wkt,no_split = task
+    try:
+        return (loc_code, split_polygon(wkt, no_split), None)
+    except Exception,e:
+        return (loc_code, [], str(e))
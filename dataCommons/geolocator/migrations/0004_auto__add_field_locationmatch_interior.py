@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'LocationMatch.interior'
+        db.add_column('geolocator_locationmatch', 'interior',
+                      self.gf('django.db.models.fields.BooleanField')(default=False),
+                      keep_default=False)
+
+        # Flag the existing matches whose outline is a plain rectangle.  Every
+        # such match is either a fully-enclosed rectangle, or a partly-enclosed
+        # rectangle which turned out to lie entirely within the location.
+        if not db.dry_run:
+            db.execute("UPDATE geolocator_locationmatch " +
+                       "SET interior = ST_Equals(outline, ST_Envelope(outline))")
+
+
+    def backwards(self, orm):
+        # Deleting field 'LocationMatch.interior'
+        db.delete_column('geolocator_locationmatch', 'interior')
+
+
+    models = {
+        'geolocator.locationmatch': {
+            'Meta': {'object_name': 'LocationMatch'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'interior': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'location': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['shared.Location']"}),
+            'outline': ('django.contrib.gis.db.models.fields.MultiPolygonField', [], {})
+        },
+        'shared.location': {
+            'Meta': {'object_name': 'Location'},
+            'bounds_max_latitude': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '7', 'decimal_places': '5'}),
+            'bounds_max_longitude': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '8', 'decimal_places': '5'}),
+            'bounds_min_latitude': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '7', 'decimal_places': '5'}),
+            'bounds_min_longitude': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '8', 'decimal_places': '5'}),
+            'code': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '12', 'db_index': 'True'}),
+            'full_name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'level': ('django.db.models.fields.IntegerField', [], {}),
+            'short_name': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        }
+    }
+
+    complete_apps = ['geolocator']
\ No newline at end of file
@@ -13,9 +13,15 @@ class LocationMatch(models.Model):
         or part of the location.  Note that the location outline is split into
         rectangular sections and each section treated as a separate match to
         improve performance.
+
+        If 'interior' is True, the outline is a plain rectangle lying entirely
+        within the location, so a coordinate falls within this match if it is
+        inside the outline's bounding box.  Only the other matches need an
+        exact point-in-polygon test.
     """
     location = models.ForeignKey("shared.Location")
     outline  = models.MultiPolygonField(srid=4326)
+    interior = models.BooleanField(default=False)
 
     # Define a custom GeoManager to handle spatial queries against this table:
 
@@ -3,6 +3,12 @@
     This module implements a reverse geocoder, converting an arbitrary lat/long
     coordinate (along with an accuracy or size indicator) into a list of
     matching 3taps location codes.
+
+    The locations containing a coordinate are found using the in-memory
+    spatial index defined in the spatialIndex module, falling back to a
+    PostGIS query if the spatial index is unavailable or finds no matches.
+    The results are cached by the geocodeCache module, so that coordinates
+    which have already been geocoded don't have to be looked up again.
 """
 from decimal import Decimal
 import math
@@ -10,9 +16,11 @@ import random
 import time
 
 from django.contrib.gis.geos import *
+from django.db               import connection
 
 from dataCommons.shared.models     import *
 from dataCommons.geolocator.models import *
+from dataCommons.geolocator        import spatialIndex, geocodeCache
 
 #############################################################################
 
@@ -79,6 +87,206 @@ def calc_locations(latitude, longitude, bounds=None, accuracy=None):
 
         Each entry will be a Location object identifying the matching location
         at that level.
+
+        Note that the results are cached, keyed by the coordinate rounded to
+        the GEOCODE_CACHE_PRECISION setting.
+    """
+    key    = geocodeCache.make_key(latitude, longitude, bounds, accuracy)
+    cached = geocodeCache.get_many([key])
+    if key in cached:
+        return dict(cached[key])
+
+    locations = _find_locations(latitude, longitude)
+    results   = _select_locations(locations, bounds, accuracy)
+
+    geocodeCache.set_many({key : results})
+    return dict(results)
+
+#############################################################################
+
+def calc_locations_batch(points):
+    """ Calculate the matching locations for a batch of lat/long coordinates.
+
+        'points' should be a list of (latitude, longitude, bounds, accuracy)
+        tuples, where each tuple holds the parameters which would be passed to
+        calc_locations(), above.
+
+        We return a list of dictionaries, one for each point, where each
+        dictionary maps level names to Location objects as described in
+        calc_locations().
+
+        Note that the points are first looked up in the geocode cache, and
+        then in the in-memory spatial index where possible.  All the remaining
+        points are looked up using a single PostGIS query, and their Location
+        objects are loaded using one more query, so the number of queries
+        doesn't depend on the number of points.
+    """
+    keys = []
+    for latitude,longitude,bounds,accuracy in points:
+        keys.append(geocodeCache.make_key(latitude, longitude,
+                                          bounds, accuracy))
+    cached = geocodeCache.get_many(keys)
+
+    to_find   = [] # List of indexes into 'points' for uncached points.
+    locations = {} # Maps index into 'points' to list of Location objects.
+    misses    = [] # List of indexes into 'points' for the points to look up.
+
+    for i,(latitude,longitude,bounds,accuracy) in enumerate(points):
+        if keys[i] in cached: continue
+        to_find.append(i)
+        found = spatialIndex.find_locations(latitude, longitude)
+        if not found:
+            misses.append(i)
+        locations[i] = found or []
+
+    if len(misses) > 0:
+        for i,found in zip(misses, _find_locations_in_db(
+                                    [points[i][:2] for i in misses])):
+            locations[i] = found
+
+    to_cache = {}
+    for i in to_find:
+        latitude,longitude,bounds,accuracy = points[i]
+        to_cache[keys[i]] = _select_locations(locations[i], bounds, accuracy)
+    geocodeCache.set_many(to_cache)
+
+    results = []
+    for key in keys:
+        if key in to_cache:
+            results.append(dict(to_cache[key]))
+        else:
+            results.append(dict(cached[key]))
+    return results
+
+#############################################################################
+
+def test(latitude, longitude, bounds=None, accuracy=None, show_results=True):
+    """ Test wrapper to make it easier to see how the geolocator works.
+
+        We call calc_locations() with the supplied parameters, and then (if
+        show_results is True), print a list of the matching locations and their
+        associated levels.
+    """
+    matching_locs = calc_locations(latitude, longitude, bounds, accuracy)
+    if show_results:
+        for level in LEVEL_NAMES:
+            if level in matching_locs:
+                loc = matching_locs[level]
+                print "  %s = %s (%s)" % (level, loc.full_name, loc.code)
+
+#############################################################################
+
+def test_random(bounds=None, accuracy=None, show_results=True):
+    """ Generate a random lat/long and geolocate it.
+
+        If 'bounds' is specified, we calculate a random lat/long within it.
+        Otherwise, we calculate a random lat/long coordinate within the
+        bounding box of California.
+
+        If 'show_results' is True, we print the coordinate and the found
+        locations.
+    """
+    if bounds != None:
+        latitude  = random.uniform(bounds[0], bounds[1])
+        longitude = random.uniform(bounds[2], bounds[3])
+    else:
+        latitude  = random.uniform(32.710890, 41.965481)
+        longitude = random.uniform(-123.980715, -114.609375)
+
+    if show_results:
+        print "lat = %0.4f, long = %0.4f" % (latitude, longitude)
+
+    test(latitude=latitude,
+         longitude=longitude,
+         bounds=bounds,
+         accuracy=accuracy,
+         show_results=show_results)
+
+#############################################################################
+
+def test_multi(num_tests, bounds=None, accuracy=None, show_results=True):
+    """ Call test_random() a number of times, and see how long it takes.
+    """
+    start_time = time.time()
+
+    for test in range(num_tests):
+        test_random(bounds=bounds,
+                    accuracy=accuracy,
+                    show_results=show_results)
+
+    end_time = time.time()
+    time_taken = end_time - start_time
+    print "%d tests took %0.4f seconds" % (num_tests, time_taken)
+
+#############################################################################
+#                                                                           #
+#                    P R I V A T E   D E F I N I T I O N S                  #
+#                                                                           #
+#############################################################################
+
+def _find_locations(latitude, longitude):
+    """ Return the locations which contain the given lat/long coordinate.
+
+        We return a list of Location objects, one for each location match
+        which contains the given coordinate.  We use the in-memory spatial
+        index if we can, and fall back to a PostGIS query if the spatial index
+        isn't available or doesn't have any matches for this coordinate.
+    """
+    locations = spatialIndex.find_locations(latitude, longitude)
+    if locations:
+        return locations
+
+    return _find_locations_in_db([(latitude, longitude)])[0]
+
+#############################################################################
+
+def _find_locations_in_db(coordinates):
+    """ Find the locations containing each of the given coordinates.
+
+        'coordinates' is a list of (latitude, longitude) tuples.  We return a
+        list with one entry for each coordinate, where each entry is a list of
+        the Location objects which contain that coordinate.
+
+        We find the matching locations for every coordinate with a single
+        PostGIS query, joining a list of points against the location matches,
+        and then load all the matched Location objects using a single query.
+        Note that interior location matches only need a bounding box test, so
+        the exact point-in-polygon test is only done for the other matches.
+    """
+    values = []
+    params = []
+    for i,(latitude,longitude) in enumerate(coordinates):
+        values.append("(%s, ST_SetSRID(ST_MakePoint(%s, %s), 4326))")
+        params.extend([i, longitude, latitude])
+
+    cursor = connection.cursor()
+    cursor.execute("SELECT p.i, m.location_id " +
+                   "FROM (VALUES " + ", ".join(values) + ") AS p(i, point) " +
+                   "JOIN " + LocationMatch._meta.db_table + " m " +
+                   "ON m.outline && p.point " +
+                   "AND (m.interior OR ST_Contains(m.outline, p.point))",
+                   params)
+    rows = cursor.fetchall()
+
+    location_objs = Location.objects.in_bulk(list(set([row[1]
+                                                       for row in rows])))
+
+    locations = [[] for coordinate in coordinates]
+    for i,location_id in rows:
+        locations[i].append(location_objs[location_id])
+    return locations
+
+#############################################################################
+
+def _select_locations(locations, bounds, accuracy):
+    """ Select the matching locations to use for a coordinate.
+
+        'locations' is a list of the Location objects whose outline contains
+        the coordinate, and 'bounds' and 'accuracy' are the bounds and accuracy
+        for the coordinate, as passed to calc_locations().
+
+        We return a dictionary mapping level names to the Location object to
+        use at that level, as described in calc_locations(), above.
     """
     # The following helper function converts from a Location.level value to a
     # level name.
@@ -89,16 +297,12 @@ def calc_locations(latitude, longitude, bounds=None, accuracy=None):
                 return name
         return None
 
-    # Start by finding all LocationMatch objects that contain the desired
-    # coordinate.  These give us the locations that match the desired
-    # coordinate, which we organise by level.
+    # Organise the matching locations by level.
 
     matched_locations = {} # Maps level name to a dictionary mapping the 3taps
                            # location code to its associated Location object.
 
-    coordinate = Point(longitude, latitude)
-    for match in LocationMatch.objects.filter(outline__contains=coordinate):
-        location = match.location
+    for location in locations:
         level_name = calc_level_name(location.level)
         if level_name not in matched_locations:
             matched_locations[level_name] = {}
@@ -233,70 +437,6 @@ def calc_locations(latitude, longitude, bounds=None, accuracy=None):
 
 #############################################################################
 
-def test(latitude, longitude, bounds=None, accuracy=None, show_results=True):
-    """ Test wrapper to make it easier to see how the geolocator works.
-
-        We call calc_locations() with the supplied parameters, and then (if
-        show_results is True), print a list of the matching locations and their
-        associated levels.
-    """
-    matching_locs = calc_locations(latitude, longitude, bounds, accuracy)
-    if show_results:
-        for level in LEVEL_NAMES:
-            if level in matching_locs:
-                loc = matching_locs[level]
-                print "  %s = %s (%s)" % (level, loc.full_name, loc.code)
-
-#############################################################################
-
-def test_random(bounds=None, accuracy=None, show_results=True):
-    """ Generate a random lat/long and geolocate it.
-
-        If 'bounds' is specified, we calculate a random lat/long within it.
-        Otherwise, we calculate a random lat/long coordinate within the
-        bounding box of California.
-
-        If 'show_results' is True, we print the coordinate and the found
-        locations.
-    """
-    if bounds != None:
-        latitude  = random.uniform(bounds[0], bounds[1])
-        longitude = random.uniform(bounds[2], bounds[3])
-    else:
-        latitude  = random.uniform(32.710890, 41.965481)
-        longitude = random.uniform(-123.980715, -114.609375)
-
-    if show_results:
-        print "lat = %0.4f, long = %0.4f" % (latitude, longitude)
-
-    test(latitude=latitude,
-         longitude=longitude,
-         bounds=bounds,
-         accuracy=accuracy,
-         show_results=show_results)
-
-#############################################################################
-
-def test_multi(num_tests, bounds=None, accuracy=None, show_results=True):
-    """ Call test_random() a number of times, and see how long it takes.
-    """
-    start_time = time.time()
-
-    for test in range(num_tests):
-        test_random(bounds=bounds,
-                    accuracy=accuracy,
-                    show_results=show_results)
-
-    end_time = time.time()
-    time_taken = end_time - start_time
-    print "%d tests took %0.4f seconds" % (num_tests, time_taken)
-
-#############################################################################
-#                                                                           #
-#                    P R I V A T E   D E F I N I T I O N S                  #
-#                                                                           #
-#############################################################################
-
 def _rect_in_rect(left1, bottom1, right1, top1,
                   left2, bottom2, right2, top2):
     """ Return True iff rectangle 1 is inside rectangle 2.
@@ -0,0 +1,220 @@
+""" dataCommons.geolocator.spatialIndex
+
+    This module implements an in-memory spatial index of the location matches,
+    so that the reverse geocoder can find the locations containing a given
+    coordinate without making a PostGIS query for every posting.
+
+    The location matches are loaded into a uniform grid of GRID_CELL_SIZE
+    degree cells, where each grid cell holds the location matches whose
+    bounding box overlaps that cell.  To find the location matches containing
+    a given coordinate, we look up the grid cell for that coordinate and
+    discard the location matches whose bounding box doesn't contain the
+    coordinate.  Interior matches are plain rectangles, so the bounding box
+    test is all they need; the remaining location matches are tested using
+    prepared geometries.
+
+    The index is loaded the first time it is used, and is rebuilt whenever the
+    version number of the reference data changes (for example, because the
+    "import_polygons" management command has been run).  To avoid going to
+    Redis for every coordinate, the version number is checked at most once
+    every VERSION_CHECK_INTERVAL seconds.
+"""
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+
+from dataCommons.shared.models     import Location
+from dataCommons.shared.lib        import referenceRegistry
+from dataCommons.geolocator.models import LocationMatch
+
+#############################################################################
+
+# The width and height of each grid cell, in degrees:
+
+GRID_CELL_SIZE = 0.5
+
+# The number of seconds between checks of the reference data version number:
+
+VERSION_CHECK_INTERVAL = 60
+
+#############################################################################
+
+logger = logging.getLogger(__name__)
+
+#############################################################################
+
+def find_locations(latitude, longitude):
+    """ Return the locations which contain the given coordinate.
+
+        'latitude' and 'longitude' are the coordinate to look up, as
+        floating-point numbers.
+
+        We return a list of Location objects for the location matches which
+        contain the given coordinate, or None if the spatial index isn't
+        available.  Note that the returned Location objects are shared, and
+        must not be modified.
+    """
+    index = _get_index()
+    if index == None:
+        return None
+
+    coordinate = None # Created as required.
+    locations  = []
+    for entry in index.grid.get(_grid_cell(longitude, latitude), []):
+        min_long,min_lat,max_long,max_lat,prepared,location_id = entry
+        if longitude < min_long or longitude > max_long: continue
+        if latitude  < min_lat  or latitude  > max_lat:  continue
+
+        if prepared != None:
+            if coordinate == None:
+                coordinate = Point(longitude, latitude)
+            if not prepared.contains(coordinate):
+                continue
+
+        locations.append(index.locations[location_id])
+
+    return locations
+
+#############################################################################
+
+def clear():
+    """ Discard the spatial index, so that it is rebuilt when next used.
+    """
+    global _index
+
+    with _index_lock:
+        _index = None
+
+#############################################################################
+#                                                                           #
+#                    P R I V A T E   D E F I N I T I O N S                  #
+#                                                                           #
+#############################################################################
+
+class _SpatialIndex:
+    """ The spatial index for the current process.
+
+        The spatial index has the following attributes:
+
+            'version'
+
+                The version number of the reference data the index was built
+                from.
+
+            'checked_at'
+
+                The time at which the version number was last checked.
+
+            'grid'
+
+                A dictionary mapping (x, y) grid cell coordinates to a list of
+                (min_long, min_lat, max_long, max_lat, prepared, location_id)
+                tuples, one for each location match which overlaps that grid
+                cell.  'prepared' is None for interior location matches,
+                which don't need an exact point-in-polygon test.
+
+            'locations'
+
+                A dictionary mapping each location ID to its Location object.
+    """
+    def __init__(self, version):
+        """ Standard initialiser.
+        """
+        self.version    = version
+        self.checked_at = time.time()
+        self.grid       = {}
+        self.locations  = {}
+
+#############################################################################
+
+def _get_index():
+    """ Return the _SpatialIndex object for the current process.
+
+        The index is built when it is first needed, and rebuilt whenever the
+        reference data changes.  We return None if the spatial index has been
+        disabled, or can't be built.
+    """
+    global _index
+
+    if not settings.ENABLE_SPATIAL_INDEX:
+        return None
+
+    with _index_lock:
+        if _index != None and \
+           time.time() - _index.checked_at < VERSION_CHECK_INTERVAL:
+            return _index
+
+        try:
+            version = referenceRegistry.get_version()
+        except:
+            logger.exception("Unable to read the reference data version")
+            if _index != None:
+                _index.checked_at = time.time()
+            return _index
+
+        if _index != None and _index.version == version:
+            _index.checked_at = time.time()
+            return _index
+
+        try:
+            _index = _build_index(version)
+        except:
+            logger.exception("Unable to build the spatial index")
+            _index = None
+
+        return _index
+
+#############################################################################
+
+def _build_index(version):
+    """ Build a new spatial index from the location matches in the database.
+
+        We return a new _SpatialIndex object.
+    """
+    start_time = time.time()
+
+    index = _SpatialIndex(version)
+
+    location_ids = set()
+    for location_id,outline,interior in \
+            LocationMatch.objects.values_list("location", "outline",
+                                              "interior"):
+        min_long,min_lat,max_long,max_lat = outline.extent
+        if interior:
+            prepared = None
+        else:
+            prepared = outline.prepared
+        entry = (min_long, min_lat, max_long, max_lat, prepared, location_id)
+
+        min_x,min_y = _grid_cell(min_long, min_lat)
+        max_x,max_y = _grid_cell(max_long, max_lat)
+        for x in range(min_x, max_x+1):
+            for y in range(min_y, max_y+1):
+                index.grid.setdefault((x, y), []).append(entry)
+
+        location_ids.add(location_id)
+
+    index.locations = Location.objects.in_bulk(list(location_ids))
+
+    logger.info("Built spatial index with %d grid cells in %0.2f seconds"
+                % (len(index.grid), time.time() - start_time))
+
+    return index
+
+#############################################################################
+
+def _grid_cell(longitude, latitude):
+    """ Return the (x, y) coordinates of the grid cell containing a point.
+    """
+    return (int(math.floor(longitude / GRID_CELL_SIZE)),
+            int(math.floor(latitude  / GRID_CELL_SIZE)))
+
+#############################################################################
+
+_index      = None
+_index_lock = threading.Lock()
+
@@ -0,0 +1,137 @@
+""" dataCommons.monitoringAPI.event_buffer
+
+    This module implements the in-memory event buffer used when the
+    EVENT_RECORDING_MODE setting is "buffered".
+
+    Rather than writing each event to the database as it is recorded, the
+    events are added to a buffer within the current process.  A background
+    thread writes the buffered events to the database using a single bulk
+    INSERT statement, either once the buffer holds EVENT_BUFFER_SIZE events, or
+    every EVENT_FLUSH_INTERVAL seconds, whichever comes first.  Any remaining
+    events are written out when the process exits.
+
+    Note that buffered events may be lost if the process is killed before the
+    buffer has been flushed.  Also note that postingQueue.reconcile() can only
+    see the events which have been written to the database, so it will
+    undercount the posting queue while there are buffered POSTINGS_QUEUED
+    events which haven't been written out yet.
+"""
+import atexit
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+from dataCommons.monitoringAPI import event_recorder
+
+#############################################################################
+
+logger = logging.getLogger(__name__)
+
+#############################################################################
+
+def add(event):
+    """ Add an event to the buffer.
+
+        'event' should be a (timestamp, source, type, primary_value,
+        secondary_value, text) tuple, which has already been checked using
+        event_recorder.check_event().
+    """
+    buffer = _get_buffer()
+
+    with buffer.lock:
+        buffer.events.append(event)
+        is_full = len(buffer.events) >= settings.EVENT_BUFFER_SIZE
+
+    if is_full:
+        buffer.wakeup.set()
+
+#############################################################################
+
+def flush():
+    """ Write all the buffered events out to the database.
+
+        This is called automatically by the background thread, but can also be
+        called directly if the buffered events need to be written out straight
+        away.
+    """
+    buffer = _get_buffer()
+
+    with buffer.lock:
+        events = buffer.events
+        buffer.events = []
+
+    if len(events) > 0:
+        try:
+            event_recorder.record_many(events)
+        except:
+            logger.exception("Unable to write %d buffered events"
+                             % len(events))
+
+#############################################################################
+#                                                                           #
+#                    P R I V A T E   D E F I N I T I O N S                  #
+#                                                                           #
+#############################################################################
+
+class _EventBuffer:
+    """ The event buffer for the current process.
+    """
+    def __init__(self):
+        """ Standard initialiser.
+        """
+        self.pid    = os.getpid()
+        self.events = []
+        self.lock   = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=_flush_periodically)
+        self.thread.daemon = True
+
+#############################################################################
+
+def _get_buffer():
+    """ Return the _EventBuffer object for the current process.
+
+        The buffer and its background thread are created the first time they
+        are needed.  If the process has been forked since the buffer was
+        created (for example, by a Celery worker), the child process starts
+        again with its own empty buffer and background thread.
+    """
+    global _buffer
+
+    with _buffer_lock:
+        if _buffer == None or _buffer.pid != os.getpid():
+            _buffer = _EventBuffer()
+            _buffer.thread.start()
+        return _buffer
+
+#############################################################################
+
+def _flush_periodically():
+    """ The main loop for our background thread.
+
+        We flush the buffer whenever it fills up, or after the flush interval
+        has elapsed.
+    """
+    while True:
+        buffer = _get_buffer()
+        buffer.wakeup.wait(settings.EVENT_FLUSH_INTERVAL)
+        buffer.wakeup.clear()
+        flush()
+
+#############################################################################
+
+def _flush_at_exit():
+    """ Write any remaining buffered events out when the process exits.
+    """
+    if _buffer != None and _buffer.pid == os.getpid():
+        flush()
+
+#############################################################################
+
+_buffer      = None
+_buffer_lock = threading.Lock()
+
+atexit.register(_flush_at_exit)
+
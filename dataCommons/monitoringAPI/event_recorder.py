@@ -4,10 +4,15 @@
 """
 import datetime
 import logging
+import threading
+
+from django.conf import settings
+from django.db   import transaction
 
 from dataCommons.shared.lib import dateHelpers
 
 from dataCommons.monitoringAPI.models import *
+from dataCommons.monitoringAPI        import postingQueue
 
 #############################################################################
 
@@ -40,12 +45,64 @@ def record(source, type, primary_value=None, secondary_value=None, text=None):
 
                 Some optional text to associate with this event, if any.
 
-        We create a new event with the given values and add it to the database.
-        Upon completion, we return None if the event was successfully added, or
-        an appropriate error message if something went wrong.
+        We check the event, and then either add it to the database directly or
+        add it to the event buffer to be written out later, depending on the
+        EVENT_RECORDING_MODE setting.  Upon completion, we return None if the
+        event was successfully recorded, or an appropriate error message if
+        something went wrong.
     """
-    # Check that the parameters are correct.
+    err_msg = check_event(source, type, primary_value, secondary_value, text)
+    if err_msg != None:
+        return err_msg
+
+    event = (dateHelpers.datetime_in_utc(),
+             source, type, primary_value, secondary_value, text)
+
+    mode = settings.EVENT_RECORDING_MODE
+    if mode == "sync":
+        record_many([event])
+    elif mode == "buffered":
+        from dataCommons.monitoringAPI import event_buffer
+        event_buffer.add(event)
+    else:
+        return "Unknown event recording mode: " + repr(mode)
+
+    # If this event changes the size of the posting queue, update our posting
+    # queue counter.  Buffered events are counted straight away, as they are
+    # written out regardless of what happens to the caller's transaction.
+    # Events written as part of a transaction are only counted once the
+    # caller tells us that the transaction has been committed.
 
+    if type == "POSTINGS_QUEUED":
+        num_postings = primary_value
+    elif type == "POSTINGS_DEQUEUED":
+        num_postings = -primary_value
+    else:
+        num_postings = 0
+
+    if num_postings != 0:
+        if mode == "sync" and transaction.is_managed():
+            postingQueue.adjust_after_commit(num_postings)
+        else:
+            postingQueue.adjust(num_postings)
+
+    # That's all, folks!
+
+    logger.debug("Received event %s from %s, values = %s"
+                 % (type, source, str([primary_value, secondary_value, text])))
+
+    return None
+
+#############################################################################
+
+def check_event(source, type, primary_value=None, secondary_value=None,
+                text=None):
+    """ Check that the given event is valid.
+
+        The parameters are the same as for record(), above.  We return None if
+        the event is valid, or an appropriate error message if the event
+        should be rejected.
+    """
     if source not in ["POSTING_API",
                       "SEARCH_API",
                       # "POLLING_API",
@@ -95,27 +152,162 @@ def record(source, type, primary_value=None, secondary_value=None, text=None):
     else:
         return "Unknown event type: " + type
 
-    # Translate our event source and type into EventSource and EventType
-    # objects, creating new records as required.
+    return None
 
-    event_source,created = EventSource.objects.get_or_create(source=source)
-    event_type,created   = EventType.objects.get_or_create(type=type)
+#############################################################################
 
-    # Create the new Event object.
+def record_many(events):
+    """ Add a number of events to the database at once.
 
-    event = Event()
-    event.timestamp       = dateHelpers.datetime_in_utc()
-    event.source          = event_source
-    event.type            = event_type
-    event.primary_value   = primary_value
-    event.secondary_value = secondary_value
-    event.text            = text
-    event.save()
+        'events' should be a list of (timestamp, source, type, primary_value,
+        secondary_value, text) tuples, where each event has already been
+        checked using check_event().  We add all the events using a single
+        bulk INSERT statement.
+    """
+    if len(events) == 0:
+        return
 
-    # That's all, folks!
+    records = []
+    for timestamp,source,type,primary_value,secondary_value,text in events:
+        event = Event()
+        event.timestamp       = timestamp
+        event.source_id       = _get_source_id(source)
+        event.type_id         = _get_type_id(type)
+        event.primary_value   = primary_value
+        event.secondary_value = secondary_value
+        event.text            = text
+        records.append(event)
 
-    logger.debug("Received event %s from %s, values = %s"
-                 % (type, source, str([primary_value, secondary_value, text])))
+    Event.objects.bulk_create(records)
 
-    return None
+#############################################################################
+
+def transaction_committed():
+    """ Tell the event recorder that the caller's transaction was committed.
+
+        Any changes which were held until the events recorded within the
+        transaction were committed are now applied.
+    """
+    postingQueue.apply_pending_adjustments()
+    _get_uncommitted().clear()
+
+#############################################################################
+
+def transaction_rolled_back():
+    """ Tell the event recorder that the caller's transaction was rolled back.
+
+        Any changes which were held until the events recorded within the
+        transaction were committed are thrown away.
+    """
+    postingQueue.discard_pending_adjustments()
+    _get_uncommitted().clear()
+
+#############################################################################
+
+def clear_cache():
+    """ Forget the EventSource and EventType record IDs we have cached.
+
+        This should be called whenever the EventSource and EventType records
+        are deleted.  Note that this only affects the current process.
+    """
+    _source_ids.clear()
+    _type_ids.clear()
+    _get_uncommitted().clear()
+
+#############################################################################
+#                                                                           #
+#                    P R I V A T E   D E F I N I T I O N S                  #
+#                                                                           #
+#############################################################################
+
+# The EventSource and EventType record IDs we have cached for this process.
+# These map the source or type string to the associated record ID.  Only the
+# IDs of records which are known to have been committed are cached.
+
+_source_ids = {}
+_type_ids   = {}
+
+# The EventSource and EventType records which the current thread has created
+# within a transaction that hasn't been committed yet.
+
+_local = threading.local()
+
+#############################################################################
+
+def _get_source_id(source):
+    """ Return the EventSource record ID for the given source string.
+
+        We create a new EventSource record if necessary.
+    """
+    try:
+        return _source_ids[source]
+    except KeyError:
+        event_source,created = EventSource.objects.get_or_create(source=source)
+        _remember_id(_source_ids, "source", source, event_source.id, created)
+        return event_source.id
+
+#############################################################################
+
+def _get_type_id(type):
+    """ Return the EventType record ID for the given type string.
+
+        We create a new EventType record if necessary.
+    """
+    try:
+        return _type_ids[type]
+    except KeyError:
+        event_type,created = EventType.objects.get_or_create(type=type)
+        _remember_id(_type_ids, "type", type, event_type.id, created)
+        return event_type.id
+
+#############################################################################
+
+def _remember_id(ids, kind, value, record_id, created):
+    """ Add a record ID to our cache, if the record is known to be committed.
+
+        The parameters are as follows:
+
+            'ids'
+
+                The dictionary to add the record ID to.
+
+            'kind'
+
+                Either "source" or "type", identifying the kind of record.
+
+            'value'
+
+                The source or type string.
+
+            'record_id'
+
+                The record ID returned by get_or_create().
+
+            'created'
+
+                True if the record was created by get_or_create().
+
+        A record created within a managed transaction isn't cached, as it will
+        vanish if that transaction is rolled back.  Nor is the record cached if
+        it is found again before the transaction ends, as it may be the same
+        uncommitted record.  Once the caller tells us that the transaction has
+        ended, the next lookup will find the committed record and cache it.
+    """
+    uncommitted = _get_uncommitted()
+
+    if created and transaction.is_managed():
+        uncommitted[(kind, value)] = record_id
+    elif (kind, value) not in uncommitted:
+        ids[value] = record_id
+
+#############################################################################
+
+def _get_uncommitted():
+    """ Return the uncommitted records created by the current thread.
+
+        We return a dictionary mapping (kind, value) tuples to record IDs.
+    """
+    if not hasattr(_local, "uncommitted"):
+        _local.uncommitted = {}
+    return _local.uncommitted
 
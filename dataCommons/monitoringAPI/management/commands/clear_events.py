@@ -7,6 +7,7 @@
 from django.core.management.base import BaseCommand, CommandError
 
 from dataCommons.monitoringAPI.models import *
+from dataCommons.monitoringAPI        import postingQueue, event_recorder
 
 #############################################################################
 
@@ -20,7 +21,12 @@ class Command(BaseCommand):
         if len(args) > 0:
             raise CommandError("This command doesn't take any parameters.")
 
+        EventRollup.objects.all().delete()
         EventSource.objects.all().delete()
         EventType.objects.all().delete()
         Event.objects.all().delete()
 
+        event_recorder.clear_cache()
+
+        postingQueue.reconcile()
+
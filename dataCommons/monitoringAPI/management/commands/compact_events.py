@@ -0,0 +1,39 @@
+""" dataCommons.monitoringAPI.management.commands.compact_events
+
+    This module defines the "compact_events" management command used by the
+    Data Commons system.  Running this command summarises the recently-recorded
+    events into the per-minute and per-hour event rollups used by the reports.
+
+    If the --rebuild option is given, the existing rollups are deleted and
+    recalculated from scratch.
+"""
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dataCommons.monitoringAPI import rollups
+
+#############################################################################
+
+class Command(BaseCommand):
+    """ Our "compact_events" management command.
+    """
+    args = 'none'
+    help = 'Summarises the recorded events into the event rollups.'
+
+    option_list = BaseCommand.option_list + (
+        make_option("--rebuild",
+                    action="store_true",
+                    dest="rebuild",
+                    default=False,
+                    help="Recalculate all the event rollups from scratch."),
+    )
+
+    def handle(self, *args, **kwargs):
+        if len(args) > 0:
+            raise CommandError("This command doesn't take any parameters.")
+
+        if kwargs['rebuild']:
+            rollups.rebuild()
+        else:
+            rollups.compact()
@@ -0,0 +1,68 @@
+""" dataCommons.monitoringAPI.management.commands.reconcile_posting_queue
+
+    This module defines the "reconcile_posting_queue" management command used
+    by the Data Commons system.  Running this command recalculates the size of
+    the posting queue from the event log, and updates the posting queue counter
+    to match.
+
+    If the --reset option is given, we also work around a bug where the number
+    of "POSTINGS_DEQUEUED" events don't match the number of "POSTINGS_QUEUED"
+    events, even when all postings have been processed.  In this case, we add a
+    "POSTINGS_DEQUEUED" event to reset the number of postings back to zero.
+
+    Note that --reset should only be used when there are no postings coming in
+    from the Grabbers.
+"""
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dataCommons.monitoringAPI.models import *
+from dataCommons.monitoringAPI        import postingQueue
+
+from dataCommons.shared.lib import dateHelpers
+
+#############################################################################
+
+class Command(BaseCommand):
+    """ Our "reconcile_posting_queue" management command.
+    """
+    args = 'none'
+    help = 'Recalculates the size of the posting queue from the event log.'
+
+    option_list = BaseCommand.option_list + (
+        make_option("--reset",
+                    action="store_true",
+                    dest="reset",
+                    default=False,
+                    help="Reset the posting queue down to zero."),
+    )
+
+    def handle(self, *args, **kwargs):
+        if len(args) > 0:
+            raise CommandError("This command doesn't take any parameters.")
+
+        old_size = postingQueue.get_size()
+        new_size = postingQueue.calc_size_from_events()
+
+        if kwargs['reset'] and new_size != 0:
+            # Add a new "POSTINGS_DEQUEUED" event to reset the number of
+            # postings back to zero.
+
+            posting_api_source = EventSource.objects.get_or_create(
+                                                source="POSTING_API")[0]
+            postings_dequeued_event = EventType.objects.get_or_create(
+                                                type="POSTINGS_DEQUEUED")[0]
+
+            event = Event()
+            event.timestamp     = dateHelpers.datetime_in_utc()
+            event.type          = postings_dequeued_event
+            event.source        = posting_api_source
+            event.primary_value = new_size
+            event.save()
+
+        new_size = postingQueue.reconcile()
+
+        self.stdout.write("Posting queue size changed from %d to %d\n"
+                          % (old_size, new_size))
+
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'EventRollup'
+        db.create_table('monitoringAPI_eventrollup', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('resolution', self.gf('django.db.models.fields.IntegerField')()),
+            ('period_start', self.gf('django.db.models.fields.DateTimeField')(db_index=True)),
+            ('source', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['monitoringAPI.EventSource'])),
+            ('type', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['monitoringAPI.EventType'])),
+            ('num_events', self.gf('django.db.models.fields.IntegerField')()),
+            ('primary_total', self.gf('django.db.models.fields.BigIntegerField')(null=True)),
+            ('secondary_total', self.gf('django.db.models.fields.BigIntegerField')(null=True)),
+            ('min_latency', self.gf('django.db.models.fields.IntegerField')(null=True)),
+            ('max_latency', self.gf('django.db.models.fields.IntegerField')(null=True)),
+            ('histogram', self.gf('django.db.models.fields.TextField')()),
+        ))
+        db.send_create_signal('monitoringAPI', ['EventRollup'])
+
+        # Adding unique constraint on 'EventRollup', fields ['resolution', 'period_start', 'source', 'type']
+        db.create_unique('monitoringAPI_eventrollup', ['resolution', 'period_start', 'source_id', 'type_id'])
+
+
+    def backwards(self, orm):
+        # Removing unique constraint on 'EventRollup', fields ['resolution', 'period_start', 'source', 'type']
+        db.delete_unique('monitoringAPI_eventrollup', ['resolution', 'period_start', 'source_id', 'type_id'])
+
+        # Deleting model 'EventRollup'
+        db.delete_table('monitoringAPI_eventrollup')
+
+
+    models = {
+        'monitoringAPI.event': {
+            'Meta': {'object_name': 'Event'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'primary_value': ('django.db.models.fields.IntegerField', [], {'null': 'True'}),
+            'secondary_value': ('django.db.models.fields.IntegerField', [], {'null': 'True'}),
+            'source': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['monitoringAPI.EventSource']"}),
+            'text': ('django.db.models.fields.TextField', [], {'null': 'True'}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['monitoringAPI.EventType']"})
+        },
+        'monitoringAPI.eventrollup': {
+            'Meta': {'unique_together': "(('resolution', 'period_start', 'source', 'type'),)", 'object_name': 'EventRollup'},
+            'histogram': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'max_latency': ('django.db.models.fields.IntegerField', [], {'null': 'True'}),
+            'min_latency': ('django.db.models.fields.IntegerField', [], {'null': 'True'}),
+            'num_events': ('django.db.models.fields.IntegerField', [], {}),
+            'period_start': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'primary_total': ('django.db.models.fields.BigIntegerField', [], {'null': 'True'}),
+            'resolution': ('django.db.models.fields.IntegerField', [], {}),
+            'secondary_total': ('django.db.models.fields.BigIntegerField', [], {'null': 'True'}),
+            'source': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['monitoringAPI.EventSource']"}),
+            'type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['monitoringAPI.EventType']"})
+        },
+        'monitoringAPI.eventsource': {
+            'Meta': {'object_name': 'EventSource'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'source': ('django.db.models.fields.TextField', [], {'unique': 'True', 'db_index': 'True'})
+        },
+        'monitoringAPI.eventtype': {
+            'Meta': {'object_name': 'EventType'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'type': ('django.db.models.fields.TextField', [], {'unique': 'True', 'db_index': 'True'})
+        }
+    }
+
+    complete_apps = ['monitoringAPI']
@@ -40,3 +40,34 @@ class Event(models.Model):
     secondary_value = models.IntegerField(null=True)
     text            = models.TextField(null=True)
 
+
+#############################################################################
+
+class EventRollup(models.Model):
+    """ A summary of the events of a given source and type in a time period.
+
+        The event rollups are calculated from the raw events, and are used by
+        the reports so that they don't have to scan through every event within
+        the report's timeframe.  Each rollup summarises the events for either a
+        single minute or a single hour, as given by the 'resolution' field.
+
+        The "latency" of an event is the event's secondary value divided by its
+        primary value, for example the number of milliseconds taken to process
+        each posting in a batch.  The 'histogram' field holds the number of
+        events which fall into each of the latency buckets defined by the
+        monitoringAPI.rollups module, as a comma-separated string.
+    """
+    id              = models.AutoField(primary_key=True)
+    resolution      = models.IntegerField() # Number of seconds per period.
+    period_start    = models.DateTimeField(db_index=True)
+    source          = models.ForeignKey(EventSource)
+    type            = models.ForeignKey(EventType)
+    num_events      = models.IntegerField()
+    primary_total   = models.BigIntegerField(null=True)
+    secondary_total = models.BigIntegerField(null=True)
+    min_latency     = models.IntegerField(null=True)
+    max_latency     = models.IntegerField(null=True)
+    histogram       = models.TextField()
+
+    class Meta:
+        unique_together = ("resolution", "period_start", "source", "type")
@@ -0,0 +1,165 @@
+""" dataCommons.monitoringAPI.postingQueue
+
+    This module keeps track of the current size of the posting queue.
+
+    The size of the posting queue is the total number of postings which have
+    been queued, less the total number of postings which have been dequeued.
+    Rather than calculating this from the POSTINGS_QUEUED and POSTINGS_DEQUEUED
+    events each time it is needed, we keep a running total in an atomic counter
+    stored in the data cache.  The counter is updated whenever one of these
+    events is recorded.
+
+    When an event is written to the database as part of a transaction, the
+    counter must only be updated once that transaction has been committed.
+    Otherwise, a rollback would remove the event but leave the counter
+    changed.  For this reason, adjust_after_commit() holds the adjustment
+    until apply_pending_adjustments() or discard_pending_adjustments() is
+    called.
+
+    If the counter is missing (for example, because the data cache has been
+    flushed), it is rebuilt from the event log the next time it is used.  The
+    counter is only ever created if it doesn't already exist, and only ever
+    incremented if it does, so that concurrent processes can't overwrite each
+    other's changes.
+"""
+import logging
+import threading
+
+from django.db.models import Sum
+
+from dataCommons.shared.lib           import dataCache
+from dataCommons.monitoringAPI.models import *
+
+#############################################################################
+
+# The data cache key used to store our counter:
+
+COUNTER_KEY = "posting_queue_size"
+
+#############################################################################
+
+logger = logging.getLogger(__name__)
+
+#############################################################################
+
+def get_size():
+    """ Return the current size of the posting queue.
+
+        We return the number of postings which have been queued but not yet
+        dequeued.
+    """
+    size = dataCache.get_counter(COUNTER_KEY)
+    if size == None:
+        size = reconcile(only_if_missing=True)
+
+    if size < 0: size = 0
+    return size
+
+#############################################################################
+
+def adjust(num_postings):
+    """ Adjust the size of the posting queue by the given number of postings.
+
+        'num_postings' should be positive if postings have been added to the
+        queue, or negative if postings have been removed.
+
+        Note that this should be called after the associated event has been
+        committed to the database, so that the event will be included if the
+        counter has to be rebuilt.
+    """
+    if dataCache.incr_if_exists(COUNTER_KEY, num_postings) == None:
+        reconcile(only_if_missing=True)
+
+#############################################################################
+
+def adjust_after_commit(num_postings):
+    """ Adjust the size of the posting queue once the current transaction has
+        been committed.
+
+        This works like adjust(), above, except that the adjustment is held
+        until apply_pending_adjustments() is called.
+    """
+    _get_pending().append(num_postings)
+
+#############################################################################
+
+def apply_pending_adjustments():
+    """ Apply any adjustments held by adjust_after_commit().
+
+        This should be called once the current transaction has been committed.
+    """
+    pending = _get_pending()
+    if len(pending) > 0:
+        adjust(sum(pending))
+        del pending[:]
+
+#############################################################################
+
+def discard_pending_adjustments():
+    """ Throw away any adjustments held by adjust_after_commit().
+
+        This should be called if the current transaction has been rolled back.
+    """
+    del _get_pending()[:]
+
+#############################################################################
+
+def reconcile(only_if_missing=False):
+    """ Recalculate the size of the posting queue from the event log.
+
+        We sum up the POSTINGS_QUEUED and POSTINGS_DEQUEUED events, and store
+        the result into our counter.  If 'only_if_missing' is True, the
+        counter is only stored if it doesn't already exist; this stops us from
+        overwriting the changes made by another process which rebuilt the
+        counter at the same time.
+
+        Upon completion, we return the current size of the posting queue.
+    """
+    size = calc_size_from_events()
+    if dataCache.set_counter(COUNTER_KEY, size, only_if_missing):
+        logger.debug("Posting queue size reconciled to %d" % size)
+    else:
+        size = dataCache.get_counter(COUNTER_KEY)
+        if size == None: size = 0
+    return size
+
+#############################################################################
+
+def calc_size_from_events():
+    """ Calculate the size of the posting queue directly from the event log.
+
+        We return the total value of the POSTINGS_QUEUED events, less the total
+        value of the POSTINGS_DEQUEUED events.  Note that, unlike get_size(),
+        this can be negative.
+    """
+    num_postings_queued = \
+        Event.objects.filter(type__type="POSTINGS_QUEUED").aggregate(
+                Sum("primary_value"))['primary_value__sum']
+    if num_postings_queued == None: num_postings_queued = 0
+
+    num_postings_dequeued = \
+        Event.objects.filter(type__type="POSTINGS_DEQUEUED").aggregate(
+                Sum("primary_value"))['primary_value__sum']
+    if num_postings_dequeued == None: num_postings_dequeued = 0
+
+    return num_postings_queued - num_postings_dequeued
+
+
+#############################################################################
+#                                                                           #
+#                    P R I V A T E   D E F I N I T I O N S                  #
+#                                                                           #
+#############################################################################
+
+# The adjustments held by adjust_after_commit(), for each thread.
+
+_local = threading.local()
+
+#############################################################################
+
+def _get_pending():
+    """ Return the list of pending adjustments for the current thread.
+    """
+    if not hasattr(_local, "pending"):
+        _local.pending = []
+    return _local.pending
@@ -0,0 +1,376 @@
+""" dataCommons.monitoringAPI.rollups
+
+    This module maintains the per-minute and per-hour event rollups, and lets
+    the reports retrieve summarised event data without scanning through every
+    event in the report's timeframe.
+
+    The rollups are calculated by compacting the raw events: each time
+    compact() is called, we summarise the events which have arrived since the
+    last compaction using a grouped query for each resolution, and store the
+    results as EventRollup records.  To keep each query and transaction to a
+    manageable size, the events are compacted COMPACT_WINDOW seconds at a
+    time, with the rollups for each window being committed separately.
+    Events newer than ROLLUP_DELAY seconds are left uncompacted, so that
+    events which are buffered or recorded within a long-running transaction
+    aren't missed.
+
+    When retrieving the summarised data, get_periods() combines the stored
+    rollups with summaries calculated on-the-fly from the raw events which
+    haven't been compacted yet.  This means that the returned data is always
+    up-to-date, even if compact() hasn't been called recently.
+"""
+import datetime
+import logging
+
+from django.db import connection, transaction, IntegrityError
+
+from dataCommons.shared.lib           import dateHelpers
+from dataCommons.monitoringAPI.models import *
+
+#############################################################################
+
+# The resolutions we calculate rollups for, in seconds, along with the
+# Postgres date_trunc() field name for each resolution:
+
+MINUTE_RESOLUTION = 60
+HOUR_RESOLUTION   = 3600
+
+RESOLUTIONS = {MINUTE_RESOLUTION : "minute",
+               HOUR_RESOLUTION   : "hour"}
+
+# The upper bound of each latency bucket in our histograms, in milliseconds.
+# Note that there is an extra bucket at the end for latencies greater than the
+# last value in this list.
+
+LATENCY_BUCKETS = [10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+# The number of seconds to wait before compacting an event:
+
+ROLLUP_DELAY = 300
+
+# The number of seconds' worth of events to compact at once.  This must be a
+# multiple of each of our resolutions.
+
+COMPACT_WINDOW = 24 * 3600
+
+# Timeframes up to this many seconds should be reported using the raw events,
+# and timeframes up to MINUTE_ROLLUPS_TIMEFRAME seconds should be reported
+# using the per-minute rollups.  Longer timeframes use the per-hour rollups.
+
+RAW_EVENTS_TIMEFRAME     = 6 * 3600
+MINUTE_ROLLUPS_TIMEFRAME = 7 * 24 * 3600
+
+#############################################################################
+
+logger = logging.getLogger(__name__)
+
+#############################################################################
+
+def compact():
+    """ Summarise any events which haven't been rolled up yet.
+
+        We calculate the per-minute and per-hour rollups for all the events
+        received since the last compaction, up to ROLLUP_DELAY seconds ago.
+        The events are compacted one window at a time, committing the rollups
+        for each window before moving on to the next, so that compacting a
+        long history doesn't require a single huge query and transaction.  If
+        another process is compacting the events at the same time, we leave
+        it to do the work.
+    """
+    now = dateHelpers.datetime_in_utc()
+    for resolution in RESOLUTIONS.keys():
+        start_time = _get_watermark(resolution)
+        if start_time == None:
+            start_time = _get_first_event_time()
+            if start_time == None:
+                continue # No events to compact.
+            start_time = _floor(start_time, resolution)
+
+        end_time = _floor(now - datetime.timedelta(seconds=ROLLUP_DELAY),
+                          resolution)
+
+        if end_time <= start_time:
+            continue # Nothing to do.
+
+        num_rollups  = 0
+        window_start = start_time
+        while window_start < end_time:
+            window_end = min(window_start +
+                             datetime.timedelta(seconds=COMPACT_WINDOW),
+                             end_time)
+
+            rollups = _aggregate_events(resolution, window_start, window_end)
+
+            try:
+                with transaction.commit_on_success():
+                    EventRollup.objects.bulk_create(rollups)
+            except IntegrityError:
+                logger.debug("Events already compacted by another process")
+                break
+
+            num_rollups  = num_rollups + len(rollups)
+            window_start = window_end
+
+        logger.debug("Compacted %d event rollups at resolution %d"
+                     % (num_rollups, resolution))
+
+#############################################################################
+
+def rebuild():
+    """ Delete all the event rollups, and recalculate them from scratch.
+    """
+    EventRollup.objects.all().delete()
+    compact()
+
+#############################################################################
+
+def choose_resolution(start_time, end_time):
+    """ Choose the rollup resolution to use for the given timeframe.
+
+        'start_time' and 'end_time' are datetime.datetime objects defining the
+        timeframe covered by a report.  We return the resolution, in seconds,
+        of the rollups to use for the report, or None if the timeframe is
+        short enough that the report should use the raw events.
+    """
+    num_secs = dateHelpers.datetime_to_seconds(end_time) \
+             - dateHelpers.datetime_to_seconds(start_time)
+
+    if num_secs <= RAW_EVENTS_TIMEFRAME:
+        return None
+    elif num_secs <= MINUTE_ROLLUPS_TIMEFRAME:
+        return MINUTE_RESOLUTION
+    else:
+        return HOUR_RESOLUTION
+
+#############################################################################
+
+def get_periods(type, resolution, start_time=None, end_time=None):
+    """ Return the summarised events of a given type within a timeframe.
+
+        The parameters are as follows:
+
+            'type'
+
+                The type of event to summarise, as a string.
+
+            'resolution'
+
+                The length of each period, in seconds.  This must be one of
+                the resolutions defined in RESOLUTIONS, above.
+
+            'start_time'
+
+                The start of the timeframe, as a datetime.datetime object.  If
+                this is None, the timeframe starts with the first event.
+
+            'end_time'
+
+                The end of the timeframe, as a datetime.datetime object.  If
+                this is None, the timeframe ends with the most recent event.
+
+        We return a list of EventRollup objects, sorted by period, summarising
+        the events within the given timeframe.  There will be one EventRollup
+        for each period and event source with at least one event.  Note that
+        if 'start_time' doesn't fall on a period boundary, the first period
+        will be shortened to begin at 'start_time'.
+    """
+    try:
+        event_type = EventType.objects.get(type=type)
+    except EventType.DoesNotExist:
+        return []
+
+    if end_time != None:
+        end_time = end_time + datetime.timedelta(microseconds=1) # Exclusive.
+
+    # Split the timeframe into three parts: the partial period at the start
+    # of the timeframe, the periods which we have rollups for, and the
+    # remaining events which haven't been compacted yet.
+
+    watermark = _get_watermark(resolution)
+
+    if start_time == None:
+        rollups_start = None
+    else:
+        rollups_start = _floor(start_time, resolution)
+        if rollups_start < start_time:
+            rollups_start = rollups_start \
+                          + datetime.timedelta(seconds=resolution)
+
+    if watermark == None:
+        rollups_end = rollups_start
+    elif end_time == None:
+        rollups_end = watermark
+    else:
+        rollups_end = min(watermark, _floor(end_time, resolution))
+
+    if rollups_start != None and rollups_end != None:
+        rollups_end = max(rollups_start, rollups_end)
+
+    # Collect the summarised events for each part of the timeframe.
+
+    periods = []
+
+    if start_time != None and rollups_start > start_time:
+        head_end = rollups_start
+        if end_time != None and end_time < head_end:
+            head_end = end_time
+        for rollup in _aggregate_events(resolution, start_time, head_end,
+                                        event_type.id):
+            rollup.period_start = start_time
+            periods.append(rollup)
+
+    if rollups_end != None:
+        query = EventRollup.objects.filter(resolution=resolution,
+                                           type=event_type,
+                                           period_start__lt=rollups_end)
+        if rollups_start != None:
+            query = query.filter(period_start__gte=rollups_start)
+        periods.extend(query.order_by("period_start"))
+
+    tail_start = rollups_end
+    if tail_start == None:
+        tail_start = start_time
+    if tail_start == None:
+        tail_start = _get_first_event_time()
+
+    if tail_start != None and (end_time == None or tail_start < end_time):
+        periods.extend(_aggregate_events(resolution, tail_start, end_time,
+                                         event_type.id))
+
+    return periods
+
+#############################################################################
+
+def get_histogram(rollup):
+    """ Return the latency histogram for the given EventRollup.
+
+        We return a list with one entry for each latency bucket, holding the
+        number of events with a latency in that bucket.
+    """
+    return [int(s) for s in rollup.histogram.split(",")]
+
+#############################################################################
+#                                                                           #
+#                    P R I V A T E   D E F I N I T I O N S                  #
+#                                                                           #
+#############################################################################
+
+def _floor(timestamp, resolution):
+    """ Round the given timestamp down to the start of its period.
+    """
+    secs = dateHelpers.datetime_to_seconds(timestamp)
+    return dateHelpers.datetime_in_utc(secs - (secs % resolution))
+
+#############################################################################
+
+def _get_watermark(resolution):
+    """ Return the time up to which the events have been compacted.
+
+        We return a datetime.datetime object for the end of the most recent
+        rollup period at the given resolution, or None if there are no rollups
+        at this resolution.
+    """
+    query = EventRollup.objects.filter(resolution=resolution)
+    query = query.order_by("-period_start").values_list("period_start",
+                                                        flat=True)
+    latest = list(query[:1])
+    if len(latest) == 0:
+        return None
+    else:
+        return latest[0] + datetime.timedelta(seconds=resolution)
+
+#############################################################################
+
+def _get_first_event_time():
+    """ Return the timestamp of the oldest event, or None if there are none.
+    """
+    query = Event.objects.order_by("timestamp").values_list("timestamp",
+                                                            flat=True)
+    first = list(query[:1])
+    if len(first) == 0:
+        return None
+    else:
+        return first[0]
+
+#############################################################################
+
+def _aggregate_events(resolution, start_time, end_time, type_id=None):
+    """ Summarise the raw events within the given timeframe.
+
+        The parameters are as follows:
+
+            'resolution'
+
+                The length of each period, in seconds.
+
+            'start_time'
+
+                The start of the timeframe, inclusive.
+
+            'end_time'
+
+                The end of the timeframe, exclusive.  If this is None, we
+                include all events after 'start_time'.
+
+            'type_id'
+
+                If supplied, the record ID of the EventType to summarise.
+                Otherwise, we summarise events of every type.
+
+        We return a list of unsaved EventRollup objects, one for each period,
+        event source and event type.  Note that all the events are summarised
+        using a single grouped query.
+    """
+    latency = "CASE WHEN primary_value > 0 " \
+            + "THEN secondary_value / primary_value END"
+
+    bucket_counts = []
+    lower_bound = None
+    for upper_bound in LATENCY_BUCKETS + [None]:
+        conditions = []
+        if lower_bound != None:
+            conditions.append("latency >= %d" % lower_bound)
+        if upper_bound != None:
+            conditions.append("latency < %d" % upper_bound)
+        bucket_counts.append("SUM(CASE WHEN " + " AND ".join(conditions) +
+                             " THEN 1 ELSE 0 END)")
+        lower_bound = upper_bound
+
+    conditions = ["timestamp >= %s"]
+    params     = [RESOLUTIONS[resolution], start_time]
+    if end_time != None:
+        conditions.append("timestamp < %s")
+        params.append(end_time)
+    if type_id != None:
+        conditions.append("type_id = %s")
+        params.append(type_id)
+
+    cursor = connection.cursor()
+    cursor.execute("SELECT date_trunc(%s, timestamp), source_id, type_id, " +
+                   "COUNT(*), SUM(primary_value), SUM(secondary_value), " +
+                   "MIN(latency), MAX(latency), " +
+                   ", ".join(bucket_counts) + " " +
+                   "FROM (SELECT timestamp, source_id, type_id, " +
+                   "primary_value, secondary_value, " + latency + " AS " +
+                   "latency FROM " + '"' + Event._meta.db_table + '" ' +
+                   "WHERE " + " AND ".join(conditions) + ") e " +
+                   "GROUP BY 1, 2, 3 ORDER BY 1",
+                   params)
+
+    rollups = []
+    for row in cursor.fetchall():
+        rollup = EventRollup()
+        rollup.resolution      = resolution
+        rollup.period_start    = row[0]
+        rollup.source_id       = row[1]
+        rollup.type_id         = row[2]
+        rollup.num_events      = row[3]
+        rollup.primary_total   = row[4]
+        rollup.secondary_total = row[5]
+        rollup.min_latency     = row[6]
+        rollup.max_latency     = row[7]
+        rollup.histogram       = ",".join([str(n) for n in row[8:]])
+        rollups.append(rollup)
+
+    return rollups
+
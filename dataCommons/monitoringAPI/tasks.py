@@ -0,0 +1,38 @@
+""" dataCommons.monitoringAPI.tasks
+
+    This module implements the background tasks run by the Celery task queuing
+    system.
+"""
+import datetime
+import logging
+
+from celery.task import periodic_task
+
+from dataCommons.shared.lib.decorators import print_exceptions_to_stdout
+
+from dataCommons.monitoringAPI import rollups
+
+#############################################################################
+
+# How often to compact the recently-recorded events into the event rollups:
+
+COMPACT_EVENTS_INTERVAL = datetime.timedelta(minutes=5)
+
+#############################################################################
+
+logger = logging.getLogger(__name__)
+
+#############################################################################
+
+@periodic_task(run_every=COMPACT_EVENTS_INTERVAL)
+@print_exceptions_to_stdout
+def compact_events():
+    """ Summarise the recently-recorded events into the event rollups.
+
+        This runs periodically so that the reports can read the event rollups
+        without having to summarise a backlog of raw events themselves.  Note
+        that the periodic task will only be run if the Celery "beat" scheduler
+        is running.
+    """
+    rollups.compact()
+
@@ -13,55 +13,22 @@ from django.views.decorators.csrf import csrf_exempt
 from django.db                    import connection, transaction
 from django.db.utils              import DatabaseError
 
+from dataCommons.searchAPI import resultHydrator
+
 from dataCommons.shared.models          import *
 from dataCommons.shared.lib.decorators  import *
 from dataCommons.shared.lib             import dateHelpers
 
 #############################################################################
 
-logger = logging.getLogger(__name__)
+# The fields to return for each polled posting:
+
+RETVALS = set(["id", "source", "category", "category_group", "location",
+               "heading", "timestamp", "annotations"])
 
 #############################################################################
 
-#def _p_resolve_base(posting_dict, posting_db):
-#    posting_dict['category_group'] = posting_db.category_group.name
-#    posting_dict['id']        = posting_db.id
-#    posting_dict['category']  = posting_db.category.name
-#    posting_dict['source']    = posting_db.source.code
-#    posting_dict['heading']   = posting_db.heading
-#    posting_dict['timestamp'] = str(posting_db.timestamp)
-#    posting_dict['updated_at'] = str(posting_db.updated_at)
-#    posting_dict['has_image'] = posting_db.has_image
-#    
-    # NOTE: 'inserted' is not correct db value for 'indexed' attr, it will be fixed soon.
-    # posting_dict['inserted']   = str(posting_db.inserted)
-#    posting_dict['indexed']   = str(posting_db.inserted)
-#
-#def _p_resolve_locs(posting_dict, posting_db):
-#    l_attr = ('latitude', 'longitude', 'accuracy')
-#
-#    l_attr_code = ('country', 'state', 'metro', 'region', 'county', 'city',
-#                   'locality', 'zipcode')
-#
-#    posting_dict['location'] = {}
-#
-#    for key in (l_attr + l_attr_code):
-#        data = getattr(posting_db, 'location_' + key)
-#        
-#        if data is not None:
-#            if key in l_attr:
-#                posting_dict['location'][key] = data
-#            else:
-#                posting_dict['location'][key] = data.code
-#
-#def _p_resolve_annotaions(posting_dict, posting_db):
-#    posting_dict['annotations'] = {}
-#    posting_dict['annotations'].update(
-#        map(
-#            lambda ann: ann.annotation.annotation.split(":", 1),
-#            posting_db.postingannotation_set.all()
-#        )
-#    )
+logger = logging.getLogger(__name__)
 
 #############################################################################
 
@@ -122,8 +89,8 @@ def poll(request):
 
     timestamp = dateHelpers.datetime_in_utc(timestamp)
 
-    query = Posting.objects.filter(updated_at__gte=timestamp)
-    query = query.order_by("-updated_at")
+    query = Posting.objects.filter(updated__gte=timestamp)
+    query = query.order_by("-updated")
     query = query[:rpp]
 
     # Before running the query, set a timeout so we don't hang if the query
@@ -137,13 +104,8 @@ def poll(request):
     found_postings = []
 
     try:
-        for posting in query:
-            found_posting = {}
-            _p_resolve_base(found_posting, posting)
-            _p_resolve_locs(found_posting, posting)
-            _p_resolve_annotaions(found_posting, posting)
-
-            found_postings.append(found_posting)
+        rows = resultHydrator.fetch_rows(query, RETVALS)
+        found_postings = resultHydrator.hydrate(rows, RETVALS)
     except DatabaseError,e:
         transaction.rollback()  # Let the database keep working.
 
@@ -0,0 +1,379 @@
+""" dataCommons.postingAPI.bulkIngester
+
+    This module implements the bulk ingest engine used to store a whole batch
+    of parsed postings into the database at once.
+
+    Rather than adding or updating each posting one at a time, we resolve the
+    existing postings for the entire batch with a single query, and then COPY
+    the batch into a temporary "staging" table.  The staged rows are merged
+    into the Posting table using set-based SQL: a single UPDATE statement for
+    the postings which already exist, and a single INSERT statement for the new
+    postings.  The posting counts are then updated to reflect the changes made
+    to the batch of postings.
+
+    Note that the staging table is dropped automatically when the current
+    transaction is committed, so the functions in this module must be called
+    from within a managed transaction.  This module is specific to Postgres.
+"""
+import cStringIO
+import logging
+
+from django.db        import connection, transaction, IntegrityError
+from django.db.utils  import DatabaseError
+from django.db        import models
+from django.db.models import Q
+
+from dataCommons.shared.models import *
+from dataCommons.shared.lib    import postingCounts
+
+#############################################################################
+
+# How many times to retry storing a batch of postings if another process
+# inserts one of our postings at the same time, or we deadlock with another
+# process:
+
+MAX_NUM_ATTEMPTS = 3
+
+# The Postgres error messages for the errors which can be fixed by simply
+# trying again.  Note that Django doesn't pass on the underlying error code,
+# so we have to check the error message instead.
+
+RETRYABLE_ERRORS = ["deadlock detected",
+                    "could not serialize access"]
+
+#############################################################################
+
+logger = logging.getLogger(__name__)
+
+#############################################################################
+
+def store_postings(postings):
+    """ Add or update a batch of postings in the database.
+
+        'postings' should be a list of posting dictionaries, as produced by the
+        posting parser.  The fields in each dictionary match the attributes
+        with the same name in the Posting object.
+
+        Postings which don't already exist (as identified by their source and
+        external ID) are added to the database.  Existing postings are updated
+        using the supplied field values; fields which aren't included in the
+        posting dictionary keep their existing values.
+
+        Upon completion, we return a list of Posting record IDs, one for each
+        entry in 'postings'.
+    """
+    if len(postings) == 0:
+        return []
+
+    for attempt in range(MAX_NUM_ATTEMPTS):
+        sid = transaction.savepoint()
+        try:
+            posting_ids = _store_postings(postings)
+        except IntegrityError:
+            # Another process added one of our postings (or posting counts)
+            # after we looked for the existing ones -> try again.
+            transaction.savepoint_rollback(sid)
+            if attempt == MAX_NUM_ATTEMPTS - 1:
+                raise
+            logger.debug("Posting added by another process, trying again")
+        except DatabaseError,e:
+            # If we deadlocked with another process, try again.  Otherwise,
+            # let the error through.
+            transaction.savepoint_rollback(sid)
+            if not _is_retryable(e) or attempt == MAX_NUM_ATTEMPTS - 1:
+                raise
+            logger.debug("Deadlocked with another process, trying again")
+        else:
+            transaction.savepoint_commit(sid)
+            return posting_ids
+
+#############################################################################
+#                                                                           #
+#                    P R I V A T E   D E F I N I T I O N S                  #
+#                                                                           #
+#############################################################################
+
+# The Posting fields which we store, and a mapping from both the name and the
+# attribute name of each field to the field itself.
+
+_POSTING_FIELDS    = [f for f in Posting._meta.fields if f.name != "id"]
+_POSTING_COLUMNS   = [f.column for f in _POSTING_FIELDS]
+_FIELDS_BY_NAME    = {}
+
+for _field in _POSTING_FIELDS:
+    _FIELDS_BY_NAME[_field.name]    = _field
+    _FIELDS_BY_NAME[_field.attname] = _field
+
+#############################################################################
+
+def _store_postings(postings):
+    """ Store the given postings into the database.
+
+        This does the actual work of store_postings(), above.  We return the
+        list of Posting record IDs, and raise an IntegrityError if another
+        process inserted one of the postings (or one of the posting counts)
+        before we could do so.
+    """
+    # Convert the supplied postings into a dictionary of attribute values,
+    # keyed by (source_id, external_id).  If a posting appears more than once
+    # in the batch, the later values override the earlier ones.
+
+    keys           = [] # List of (source_id, external_id) tuples.
+    values_for_key = {} # Maps (source_id, external_id) to attribute values.
+
+    for posting in postings:
+        values = _get_attribute_values(posting)
+        key = (values['source_id'], values['external_id'])
+        keys.append(key)
+        if key in values_for_key:
+            values_for_key[key].update(values)
+        else:
+            values_for_key[key] = values
+
+    # Find the postings which already exist in the database.
+
+    posting_ids = _find_existing_postings(values_for_key.keys())
+
+    # Build the rows to stage.  New postings are given a complete set of
+    # values, with any missing fields set to their default value.  Existing
+    # postings only include the supplied values.  Along with each row, we
+    # stage a mask saying which of the fields were supplied; fields which
+    # weren't supplied keep their existing values when the postings are
+    # merged, while supplied fields are stored even if they are NULL.
+
+    rows = []
+    for key,values in values_for_key.items():
+        existing_id = posting_ids.get(key)
+        row      = [existing_id]
+        supplied = []
+        for field in _POSTING_FIELDS:
+            if field.attname in values:
+                value = field.get_db_prep_save(values[field.attname],
+                                               connection=connection)
+                supplied.append("t")
+            elif existing_id == None:
+                value = field.get_db_prep_save(field.get_default(),
+                                               connection=connection)
+                supplied.append("t")
+            else:
+                value = None
+                supplied.append("f")
+            row.append(value)
+        row.append("{" + ",".join(supplied) + "}")
+        rows.append(row)
+
+    # Copy the rows into our staging table.
+
+    cursor = connection.cursor()
+    _create_staging_table(cursor, "posting_staging", "shared_posting",
+                          _POSTING_COLUMNS,
+                          extra_columns=[("existing_id", "integer"),
+                                         ("supplied",    "boolean[]")])
+    _copy_rows(cursor, "posting_staging",
+               ["existing_id"] + _POSTING_COLUMNS + ["supplied"], rows)
+
+    # Merge the staged rows into the Posting table.  We update the existing
+    # postings with one statement, and then insert the new postings with
+    # another.  Note that we remember the counted attributes of each posting
+    # before and after the change, so we can update the posting counts.
+
+    removed = [] # Counted attributes of the postings before the change.
+    added   = [] # Counted attributes of the postings after the change.
+
+    if len(posting_ids) > 0:
+        cursor.execute("SELECT " + postingCounts.select_list("p") + " " +
+                       "FROM shared_posting p " +
+                       "WHERE p.id IN (SELECT existing_id " +
+                       "FROM posting_staging " +
+                       "WHERE existing_id IS NOT NULL) " +
+                       "ORDER BY p.id FOR UPDATE")
+        removed.extend(cursor.fetchall())
+
+        assignments = []
+        for i,column in enumerate(_POSTING_COLUMNS):
+            assignments.append('"%s"=CASE WHEN s.supplied[%d] THEN s."%s" '
+                               % (column, i+1, column) +
+                               'ELSE p."%s" END' % column)
+
+        cursor.execute("UPDATE shared_posting p SET " +
+                       ", ".join(assignments) + " " +
+                       "FROM posting_staging s " +
+                       "WHERE s.existing_id IS NOT NULL " +
+                       "AND p.id=s.existing_id " +
+                       "RETURNING " + postingCounts.select_list("p"))
+        added.extend(cursor.fetchall())
+
+    if len(posting_ids) < len(values_for_key):
+        column_list = ", ".join(['"%s"' % column
+                                 for column in _POSTING_COLUMNS])
+
+        cursor.execute("INSERT INTO shared_posting (" + column_list + ") " +
+                       "SELECT " + column_list + " FROM posting_staging " +
+                       "WHERE existing_id IS NULL " +
+                       "RETURNING id, source_id, external_id, " +
+                       postingCounts.select_list("shared_posting"))
+
+        for row in cursor.fetchall():
+            posting_id,source_id,external_id = row[:3]
+            posting_ids[(source_id, external_id)] = posting_id
+            added.append(row[3:])
+
+    # Bring the posting counts up to date.
+
+    postingCounts.record_changes(removed, added)
+
+    # Finally, return the record ID for each of the supplied postings.
+
+    return [posting_ids[key] for key in keys]
+
+#############################################################################
+
+def _is_retryable(error):
+    """ Return True if the given DatabaseError can be fixed by trying again.
+    """
+    for message in RETRYABLE_ERRORS:
+        if message in str(error):
+            return True
+    return False
+
+#############################################################################
+
+def _get_attribute_values(posting):
+    """ Convert a posting dictionary into a dictionary of attribute values.
+
+        The keys in 'posting' can be either field names or attribute names,
+        and foreign keys can be supplied as model instances or record IDs.  We
+        return a copy of the posting with each key converted to the associated
+        attribute name, and each model instance replaced by its record ID.
+    """
+    values = {}
+    for key,value in posting.items():
+        try:
+            field = _FIELDS_BY_NAME[key]
+        except KeyError:
+            raise RuntimeError("Unknown posting field: " + repr(key))
+
+        if isinstance(value, models.Model):
+            value = value.pk
+
+        values[field.attname] = value
+    return values
+
+#############################################################################
+
+def _find_existing_postings(keys):
+    """ Find the postings which already exist in the database.
+
+        'keys' should be a list of (source_id, external_id) tuples.  We return
+        a dictionary mapping each (source_id, external_id) tuple to the record
+        ID of the existing posting.  Keys which don't match an existing posting
+        will not be included in the returned dictionary.
+
+        Note that we find all the existing postings with a single query.
+    """
+    external_ids_by_source = {} # Maps source ID to set of external IDs.
+    for source_id,external_id in keys:
+        if source_id not in external_ids_by_source:
+            external_ids_by_source[source_id] = set()
+        external_ids_by_source[source_id].add(external_id)
+
+    combined_q = None
+    for source_id,external_ids in external_ids_by_source.items():
+        q = Q(source_id=source_id, external_id__in=list(external_ids))
+        if combined_q == None:
+            combined_q = q
+        else:
+            combined_q = combined_q | q
+
+    posting_ids = {}
+    if combined_q != None:
+        query = Posting.objects.filter(combined_q)
+        for posting_id,source_id,external_id in \
+                query.values_list("id", "source_id", "external_id"):
+            posting_ids[(source_id, external_id)] = posting_id
+
+    return posting_ids
+
+#############################################################################
+
+def _create_staging_table(cursor, staging_table, table, columns,
+                          extra_columns=[]):
+    """ Create a temporary staging table.
+
+        The parameters are as follows:
+
+            'cursor'
+
+                The database cursor to use.
+
+            'staging_table'
+
+                The name of the staging table to create.
+
+            'table'
+
+                The name of the table whose column definitions we copy.
+
+            'columns'
+
+                A list of the columns to copy from 'table'.
+
+            'extra_columns'
+
+                A list of (column, type) tuples for any additional columns to
+                add to the staging table, where 'type' is the Postgres type
+                for that column.
+
+        Note that the staging table doesn't have any of the NOT NULL
+        constraints used by the source table, and is automatically dropped
+        when the current transaction is committed.
+    """
+    select_list = []
+    for column,type in extra_columns:
+        select_list.append('NULL::%s AS "%s"' % (type, column))
+    for column in columns:
+        select_list.append('"%s"' % column)
+
+    cursor.execute("CREATE TEMPORARY TABLE " + staging_table + " " +
+                   "ON COMMIT DROP AS SELECT " + ", ".join(select_list) + " " +
+                   "FROM " + table + " LIMIT 0")
+
+#############################################################################
+
+def _copy_rows(cursor, staging_table, columns, rows):
+    """ Use the Postgres COPY command to copy rows into a staging table.
+
+        'rows' should be a list of rows, where each row is a list of values
+        with one entry for each column in 'columns'.
+    """
+    buffer = cStringIO.StringIO()
+    for row in rows:
+        buffer.write("\t".join([_copy_value(value) for value in row]))
+        buffer.write("\n")
+    buffer.seek(0)
+
+    cursor.copy_from(buffer, staging_table, columns=columns)
+
+#############################################################################
+
+def _copy_value(value):
+    """ Convert a single value into Postgres' COPY text format.
+    """
+    if value == None:
+        return "\\N"
+    elif isinstance(value, bool):
+        if value:
+            return "t"
+        else:
+            return "f"
+
+    if not isinstance(value, basestring):
+        value = unicode(value)
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+
+    return value.replace("\\", "\\\\") \
+                .replace("\t", "\\t") \
+                .replace("\n", "\\n") \
+                .replace("\r", "\\r")
+
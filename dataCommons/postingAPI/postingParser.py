@@ -24,6 +24,12 @@
         'annotations'  ->  a list of annotation strings.
         'images'       ->  a list of image reference dictionaries.
 
+    If the raw posting didn't include any annotations or images, the
+    associated entry will be set to None rather than an empty list.  This lets
+    the posting processor tell the difference between a posting which has no
+    images or annotations, and an update which leaves the existing images or
+    annotations unchanged.
+
     This dictionary will be passed on to the posting processor so that the
     posting can be added to the system.
 """
@@ -32,7 +38,7 @@ import decimal
 import logging
 
 from dataCommons.shared.models import *
-from dataCommons.shared.lib    import dataCache, dateHelpers
+from dataCommons.shared.lib    import dateHelpers, referenceRegistry
 
 #############################################################################
 
@@ -53,9 +59,9 @@ def check_raw_postings(raw_postings):
         a suitable error message explaining why that posting was not
         acceptable.
     """
-    source_codes    = get_source_codes()
-    category_codes  = get_category_codes()
-    category_groups = get_category_groups()
+    source_codes    = referenceRegistry.get_ids("source")
+    category_codes  = referenceRegistry.get_ids("category")
+    category_groups = referenceRegistry.get_category_groups()
     country_codes   = None # Loaded into memory as required.
     state_codes     = None # ditto.
     metro_codes     = None # ditto.
@@ -69,8 +75,8 @@ def check_raw_postings(raw_postings):
     for raw_posting in raw_postings:
         try:
             posting     = {}
-            annotations = []
-            images      = []
+            annotations = None
+            images      = None
 
             if not isinstance(raw_posting, dict):
                 raise ParsingException("Posting must be an object or " +
@@ -88,9 +94,9 @@ def check_raw_postings(raw_postings):
             parse_field(raw_posting, "category", posting, "category",
                         remaining_fields, foreign_key=category_codes)
 
-            if "category" in raw_posting:
+            if "category_id" in posting:
                 posting['category_group_id'] = \
-                    category_groups[raw_posting['category'].upper()]
+                    category_groups[posting['category_id']]
 
             if "location" in raw_posting:
                 raw_loc = raw_posting['location']
@@ -116,49 +122,49 @@ def check_raw_postings(raw_postings):
 
                 if "country" in raw_loc:
                     if country_codes == None:
-                        country_codes = get_country_codes()
+                        country_codes = referenceRegistry.get_ids("country")
 
                     parse_field(raw_loc, "country", posting, "location_country",
                                 remaining_loc_fields, foreign_key=country_codes)
 
                 if "state" in raw_loc:
                     if state_codes == None:
-                        state_codes = get_state_codes()
+                        state_codes = referenceRegistry.get_ids("state")
 
                     parse_field(raw_loc, "state", posting, "location_state",
                                 remaining_loc_fields, foreign_key=state_codes)
 
                 if "metro" in raw_loc:
                     if metro_codes == None:
-                        metro_codes = get_metro_codes()
+                        metro_codes = referenceRegistry.get_ids("metro")
 
                     parse_field(raw_loc, "metro", posting, "location_metro",
                                 remaining_loc_fields, foreign_key=metro_codes)
 
                 if "region" in raw_loc:
                     if region_codes == None:
-                        region_codes = get_region_codes()
+                        region_codes = referenceRegistry.get_ids("region")
 
                     parse_field(raw_loc, "region", posting, "location_region",
                                 remaining_loc_fields, foreign_key=region_codes)
 
                 if "county" in raw_loc:
                     if county_codes == None:
-                        county_codes = get_county_codes()
+                        county_codes = referenceRegistry.get_ids("county")
 
                     parse_field(raw_loc, "county", posting, "location_county",
                                 remaining_loc_fields, foreign_key=county_codes)
 
                 if "city" in raw_loc:
                     if city_codes == None:
-                        city_codes = get_city_codes()
+                        city_codes = referenceRegistry.get_ids("city")
 
                     parse_field(raw_loc, "city", posting, "location_city",
                                 remaining_loc_fields, foreign_key=city_codes)
 
                 if "locality" in raw_loc:
                     if locality_codes == None:
-                        locality_codes = get_locality_codes()
+                        locality_codes = referenceRegistry.get_ids("locality")
 
                     parse_field(raw_loc, "locality", posting,
                                 "location_locality", remaining_loc_fields,
@@ -166,7 +172,7 @@ def check_raw_postings(raw_postings):
 
                 if "zipcode" in raw_loc:
                     if zip_codes == None:
-                        zip_codes = get_zip_codes()
+                        zip_codes = referenceRegistry.get_ids("zipcode")
 
                     parse_field(raw_loc, "zipcode", posting,
                                 "location_zipcode", remaining_loc_fields,
@@ -218,6 +224,7 @@ def check_raw_postings(raw_postings):
                 if not isinstance(raw_images, (list, tuple)):
                     raise ParsingException("images must be an array")
 
+                images = []
                 for raw_image in raw_images:
                     remaining_image_fields = set(raw_image.keys())
 
@@ -255,15 +262,16 @@ def check_raw_postings(raw_postings):
 
                     images.append(image)
 
-            if len(images) > 0:
-                posting['has_image'] = True
-            else:
-                posting['has_image'] = False
+                if len(images) > 0:
+                    posting['has_image'] = True
+                else:
+                    posting['has_image'] = False
 
             if "annotations" in raw_posting:
                 raw_annotations = raw_posting['annotations']
                 remaining_fields.remove("annotations")
 
+                annotations = []
                 for key,value in raw_annotations.items():
                     if value == None: continue
 
@@ -343,216 +351,6 @@ class ParsingException(Exception):
 
 #############################################################################
 
-def get_source_codes():
-    """ Return a dictionary containing the valid source codes.
-
-        We return a dictionary mapping each source code (in uppercase) to the
-        Source record ID used for that source code.  The source code dictionary
-        is automatically recalculated if it isn't in the cache.
-    """
-    source_codes = dataCache.get("source_codes")
-
-    if source_codes == None:
-        source_codes = {}
-        for source in Source.objects.all():
-            source_codes[source.code.upper()] = source.id
-        dataCache.set("source_codes", source_codes)
-
-    return source_codes
-
-#############################################################################
-
-def get_category_codes():
-    """ Return a dictionary containing the valid category codes.
-
-        We return a dictionary mapping each category code (in uppercase) to the
-        Category record ID used for that category code.  The category code
-        dictionary is automatically recalculated if it isn't in the cache.
-    """
-    category_codes = dataCache.get("category_codes")
-
-    if category_codes == None:
-        category_codes = {}
-        for category in Category.objects.all():
-            category_codes[category.code.upper()] = category.id
-        dataCache.set("category_codes", category_codes)
-
-    return category_codes
-
-#############################################################################
-
-def get_category_groups():
-    """ Return dictionary mapping category code to category group record ID.
-
-        We return a dictionary mapping each category code (in uppercase) to the
-        CategoryGroup record ID used for that category code.  The category
-        group dictionary is automatically recalculated if it isn't in the
-        cache.
-    """
-    category_groups = dataCache.get("category_groups")
-
-    if category_groups == None:
-        category_groups = {}
-        for category in Category.objects.all():
-            category_groups[category.code.upper()] = category.group.id
-        dataCache.set("category_groups", category_groups)
-
-    return category_groups
-
-#############################################################################
-
-def get_country_codes():
-    """ Return a dictionary containing the valid country codes.
-
-        We return a dictionary mapping each country code (in uppercase) to the
-        Location record ID used for that country code.  The country code
-        dictionary is automatically recalculated if it isn't in the cache.
-    """
-    country_codes = dataCache.get("country_codes")
-
-    if country_codes == None:
-        country_codes = {}
-        for loc in Location.objects.filter(level=Location.LEVEL_COUNTRY):
-            country_codes[loc.code.upper()] = loc.id
-        dataCache.set("country_codes", country_codes)
-
-    return country_codes
-
-#############################################################################
-
-def get_state_codes():
-    """ Return a dictionary containing the valid state codes.
-
-        We return a dictionary mapping each state code (in uppercase) to the
-        Location record ID used for that state code.  The state code dictionary
-        is automatically recalculated if it isn't in the cache.
-    """
-    state_codes = dataCache.get("state_codes")
-
-    if state_codes == None:
-        state_codes = {}
-        for loc in Location.objects.filter(level=Location.LEVEL_STATE):
-            state_codes[loc.code.upper()] = loc.id
-        dataCache.set("state_codes", state_codes)
-
-    return state_codes
-
-#############################################################################
-
-def get_metro_codes():
-    """ Return a dictionary containing the valid metro area codes.
-
-        We return a dictionary mapping each metro area code (in uppercase) to
-        the Location record ID used for that metro area code.  The metro area
-        code dictionary is automatically recalculated if it isn't in the cache.
-    """
-    metro_codes = dataCache.get("metro_codes")
-
-    if metro_codes == None:
-        metro_codes = {}
-        for loc in Location.objects.filter(level=Location.LEVEL_METRO):
-            metro_codes[loc.code.upper()] = loc.id
-        dataCache.set("metro_codes", metro_codes)
-
-    return metro_codes
-
-#############################################################################
-
-def get_region_codes():
-    """ Return a dictionary containing the valid region codes.
-
-        We return a dictionary mapping each region code (in uppercase) to the
-        Location record ID used for that region code.  The region code
-        dictionary is automatically recalculated if it isn't in the cache.
-    """
-    region_codes = dataCache.get("region_codes")
-
-    if region_codes == None:
-        region_codes = {}
-        for loc in Location.objects.filter(level=Location.LEVEL_REGION):
-            region_codes[loc.code.upper()] = loc.id
-        dataCache.set("region_codes", region_codes)
-
-    return region_codes
-
-#############################################################################
-
-def get_county_codes():
-    """ Return a dictionary containing the valid county codes.
-
-        We return a dictionary mapping each county code (in uppercase) to the
-        Location record ID used for that county code.  The county code
-        dictionary is automatically recalculated if it isn't in the cache.
-    """
-    county_codes = dataCache.get("county_codes")
-
-    if county_codes == None:
-        county_codes = {}
-        for loc in Location.objects.filter(level=Location.LEVEL_COUNTY):
-            county_codes[loc.code.upper()] = loc.id
-        dataCache.set("county_codes", county_codes)
-
-    return county_codes
-
-#############################################################################
-
-def get_city_codes():
-    """ Return a dictionary containing the valid city codes.
-
-        We return a dictionary mapping each city code (in uppercase) to the
-        Location record ID used for that city code.  The city code dictionary
-        is automatically recalculated if it isn't in the cache.
-    """
-    city_codes = dataCache.get("city_codes")
-
-    if city_codes == None:
-        city_codes = {}
-        for loc in Location.objects.filter(level=Location.LEVEL_CITY):
-            city_codes[loc.code.upper()] = loc.id
-        dataCache.set("city_codes", city_codes)
-
-    return city_codes
-
-#############################################################################
-
-def get_locality_codes():
-    """ Return a dictionary containing the valid locality codes.
-
-        We return a dictionary mapping each locality code (in uppercase) to the
-        Location record ID used for that locality code.  The locality code
-        dictionary is automatically recalculated if it isn't in the cache.
-    """
-    locality_codes = dataCache.get("locality_codes")
-
-    if locality_codes == None:
-        locality_codes = {}
-        for loc in Location.objects.filter(level=Location.LEVEL_LOCALITY):
-            locality_codes[loc.code.upper()] = loc.id
-        dataCache.set("locality_codes", locality_codes)
-
-    return locality_codes
-
-#############################################################################
-
-def get_zip_codes():
-    """ Return a dictionary containing the valid zip codes.
-
-        We return a dictionary mapping each zip code (in uppercase) to the
-        Location record ID used for that zip code.  The zip code dictionary is
-        automatically recalculated if it isn't in the cache.
-    """
-    zip_codes = dataCache.get("zip_codes")
-
-    if zip_codes == None:
-        zip_codes = {}
-        for loc in Location.objects.filter(level=Location.LEVEL_ZIPCODE):
-            zip_codes[loc.code.upper()] = loc.id
-        dataCache.set("zip_codes", zip_codes)
-
-    return zip_codes
-
-#############################################################################
-
 def parse_field(src_dict, src_key, dst_dict, dst_key, remaining_fields,
                 required=False, coerce_to_type="string", foreign_key=None,
                 min_value=None, max_value=None):
@@ -9,19 +9,16 @@ import traceback
 
 import newrelic.agent
 
-from django.db import transaction,DatabaseError
+from django.db import transaction
 
 from dataCommons.shared.models import *
 from dataCommons.shared.lib import eventRecorder, dateHelpers
+from dataCommons.shared.lib import annotationInterner, ingestWatermark
 from dataCommons.shared.lib.decorators import *
 
 from dataCommons.geolocator import reverseGeocoder
 
-#############################################################################
-
-# How many postings to process before committing our changes to the database:
-
-MAX_NUM_POSTINGS_IN_TRANSACTION = 10
+from dataCommons.postingAPI import bulkIngester, postingReconciler
 
 #############################################################################
 
@@ -48,13 +45,15 @@ def process_postings(parsed_postings):
             'annotations'
 
                 A list of annotation values to associate with this posting.
-                Each string will be of the form "key:value"
+                Each string will be of the form "key:value".  If this is None,
+                the posting's existing annotations are left unchanged.
 
             'images'
 
                 A list of images to associate with this posting. Each image
                 will be a dictionary with 'full_url' and 'thumbnail_url'
-                entries, as appropriate.
+                entries, as appropriate.  If this is None, the posting's
+                existing images are left unchanged.
 
         We process the postings, adding them to the system as appropriate.
         Note that this involves the following steps:
@@ -71,9 +70,13 @@ def process_postings(parsed_postings):
 
     start_time = time.time()
 
-    # If necessary, geolocate the postings.
+    # If necessary, geolocate the postings.  Note that we geolocate all the
+    # postings in the batch at once.
 
     try:
+        to_geolocate = [] # List of postings to geolocate.
+        points       = [] # (lat, long, bounds, accuracy) for each posting.
+
         for src in parsed_postings:
             posting = src['posting']
 
@@ -95,128 +98,84 @@ def process_postings(parsed_postings):
                 # This posting has a lat/long value but no location codes ->
                 # reverse geocode the posting to see which locations it belongs
                 # to.
-                locs = reverseGeocoder.calc_locations(
-                                float(posting['location_latitude']),
-                                float(posting['location_longitude']),
-                                posting.get("location_bounds"),
-                                posting.get("location_accuracy"))
-
+                to_geolocate.append(posting)
+                points.append((float(posting['location_latitude']),
+                               float(posting['location_longitude']),
+                               posting.get("location_bounds"),
+                               posting.get("location_accuracy")))
+
+        if len(points) > 0:
+            batch_locs = reverseGeocoder.calc_locations_batch(points)
+            for posting,locs in zip(to_geolocate, batch_locs):
                 for level,loc in locs.items():
                     posting["location_" + level] = loc
 
-            # If we were supplied a bounds array, convert it to a string for
-            # storage.
+        # If we were supplied a bounds array, convert it to a string for
+        # storage.
 
+        for src in parsed_postings:
+            posting = src['posting']
             if "location_bounds" in posting:
                 posting['location_bounds'] = repr(posting['location_bounds'])
     except:
         transaction.rollback()
+        eventRecorder.transaction_rolled_back()
         raise
     else:
         transaction.commit()
+        eventRecorder.transaction_committed()
 
-    # Get the Annotation objects used by these postings. Since these
-    # objects hold unique annotation values, they can be shared across
-    # postings -- we use the existing Annotation object if it exists, and
-    # create new ones where necessary.
-
-    annotations = {} # Maps annotation string to Annotation object.
-
-    for src in parsed_postings:
-        for annotation_value in src['annotations']:
-            if annotation_value not in annotations:
-                # The following attempts to work around a database deadlock
-                # issue. We attempt to get_or_create the given Annotation
-                # record, and if this results in a database deadlock, we wait a
-                # moment before trying again.
-
-                while True:
-                    try:
-                        annotation,created = Annotation.objects.get_or_create(
-                                                annotation=annotation_value)
-                    except DatabaseError,e:
-                        if "deadlock" in str(e):
-                            logger.debug("DEADLOCK DETECTED!!! TRYING AGAIN")
-                            time.sleep(0.1)
-                            continue
-                        else:
-                            raise
-                    else:
-                        break
-
-                annotations[annotation_value] = annotation
-
-    transaction.commit()
-
-    # Save the postings into the database. Note that we simply process the
-    # postings one at a time, using a transaction to periodically commit
-    # changes. This may not be the fastest way to do it, but given the fact
-    # that we have to update existing postings, we may not have a choice...
+    # Get the record IDs of the Annotation objects used by these postings.
+    # Since these objects hold unique annotation values, they can be shared
+    # across postings -- the annotation interner returns the existing
+    # annotation IDs, and creates new Annotation records where necessary.
 
     try:
-        num_postings_in_transaction = 0
-
+        annotation_values = []
         for src in parsed_postings:
+            if src['annotations'] != None:
+                annotation_values.extend(src['annotations'])
+
+        # Maps annotation string to Annotation record ID.
+        annotations = annotationInterner.intern_annotations(annotation_values)
+    except:
+        transaction.rollback()
+        eventRecorder.transaction_rolled_back()
+        raise
+    else:
+        transaction.commit()
+        eventRecorder.transaction_committed()
 
-            # Add or update the posting itself.
+    # Save the postings into the database.  Note that we use the bulk ingest
+    # engine to add or update the entire batch of postings at once, and the
+    # posting reconciler to update their annotations and image references.
 
-            now = dateHelpers.datetime_in_utc()
+    try:
+        now = dateHelpers.datetime_in_utc()
+        for src in parsed_postings:
             src['posting']['inserted'] = now
             src['posting']['updated']  = now
 
-            posting,created = Posting.objects.get_or_create(
-                                source_id=src['posting']['source_id'],
-                                external_id=src['posting']['external_id'],
-                                defaults=src['posting'])
-
-            if not created:
-                # We have an existing posting -> update it with the
-                # newly-supplied values.
-                for key,value in src['posting'].items():
-                    if key not in ["source_id", "external_id"]:
-                        setattr(posting, key, value)
-                posting.save()
-
-            # Add or update the posting's annotations.
-
-            for annotation_value in src['annotations']:
-                annotation = annotations[annotation_value]
-
-                posting_annotation,created = \
-                        PostingAnnotation.objects.get_or_create(
-                                                posting=posting,
-                                                annotation=annotation)
+        posting_ids = bulkIngester.store_postings(
+                                [src['posting'] for src in parsed_postings])
 
-            # Add or update the posting's image references.
+        # Bring the postings' annotations and image references up to date.
+        # Note that postings which weren't supplied with any annotations or
+        # images keep their existing ones.
 
-            existing_images = []
-            for image_ref in ImageReference.objects.filter(posting=posting):
-                existing_images.append(image_ref)
+        posting_annotations = {} # Maps posting ID to list of annotation IDs.
+        posting_images      = {} # Maps posting ID to list of images.
 
-            for image in src['images']:
-                full_url = image.get("full_url")
-                thumbnail_url = image.get("thumbnail_url")
+        for posting_id,src in zip(posting_ids, parsed_postings):
+            if src['annotations'] != None:
+                posting_annotations[posting_id] = \
+                    [annotations[value] for value in src['annotations']]
 
-                already_exists = False
-                for existing_image in existing_images:
-                    if ((full_url == existing_image.full_url) and
-                        (thumbnail_url == existing_image.thumbnail_url)):
-                        already_exists = True
-                        break
+            if src['images'] != None:
+                posting_images[posting_id] = src['images']
 
-                if not already_exists:
-                    image_ref = ImageReference()
-                    image_ref.posting = posting
-                    image_ref.full_url = full_url
-                    image_ref.thumbnail_url = thumbnail_url
-                    image_ref.save()
-
-            # If we've created enough postings, commit the transaction.
-
-            num_postings_in_transaction = num_postings_in_transaction + 1
-            if num_postings_in_transaction >= MAX_NUM_POSTINGS_IN_TRANSACTION:
-                transaction.commit()
-                num_postings_in_transaction = 0
+        postingReconciler.reconcile_annotations(posting_annotations)
+        postingReconciler.reconcile_images(posting_images)
 
         # Now that the postings are in the database, send them out via the
         # notification system.
@@ -232,7 +191,17 @@ def process_postings(parsed_postings):
                              len(parsed_postings), time_taken)
     except:
         transaction.rollback()
+        eventRecorder.transaction_rolled_back()
         raise
     else:
         transaction.commit()
+        eventRecorder.transaction_committed()
+
+    # Finally, now that the postings have been committed, advance the ingest
+    # watermark so that any cached summaries are known to be out of date.
+
+    try:
+        ingestWatermark.advance()
+    except:
+        logger.exception("Unable to advance the ingest watermark")
 
@@ -0,0 +1,174 @@
+""" dataCommons.postingAPI.postingReconciler
+
+    This module implements the logic for reconciling the annotations and image
+    references for a batch of postings.
+
+    Rather than checking each annotation or image one at a time, we fetch the
+    existing annotations and image references for the entire batch of postings
+    at once, compare them against the new values in memory, and then apply the
+    resulting inserts and deletes using bulk statements.  This means that
+    reconciling a batch of postings takes a fixed number of queries, no matter
+    how many postings, annotations or images there are.
+"""
+import logging
+
+from django.db import connection
+
+from dataCommons.shared.models import *
+
+#############################################################################
+
+# The ImageReference fields which we store for each image:
+
+IMAGE_FIELDS = ["full_url", "full_width", "full_height",
+                "thumbnail_url", "thumbnail_width", "thumbnail_height"]
+
+#############################################################################
+
+logger = logging.getLogger(__name__)
+
+#############################################################################
+
+def reconcile_annotations(posting_annotations):
+    """ Bring the annotations for a batch of postings up to date.
+
+        'posting_annotations' should be a dictionary mapping posting record
+        IDs to a list of Annotation record IDs for that posting.  Upon
+        completion, each of these postings will have exactly the given set of
+        annotations: missing PostingAnnotation records are added, and records
+        for annotations which are no longer used by the posting are deleted.
+
+        Postings which aren't in 'posting_annotations' are left unchanged.
+    """
+    if len(posting_annotations) == 0:
+        return
+
+    # Calculate the set of (posting_id, annotation_id) tuples we want to end
+    # up with.
+
+    wanted = set()
+    for posting_id,annotation_ids in posting_annotations.items():
+        for annotation_id in annotation_ids:
+            wanted.add((posting_id, annotation_id))
+
+    # Compare the existing PostingAnnotation records against the wanted set.
+
+    query = PostingAnnotation.objects.filter(
+                            posting_id__in=posting_annotations.keys())
+
+    found     = set() # Set of (posting_id, annotation_id) tuples.
+    to_delete = []    # List of PostingAnnotation record IDs to delete.
+
+    for record_id,posting_id,annotation_id in \
+            query.values_list("id", "posting_id", "annotation_id"):
+        key = (posting_id, annotation_id)
+        if key in wanted and key not in found:
+            found.add(key)
+        else:
+            to_delete.append(record_id)
+
+    to_insert = []
+    for posting_id,annotation_id in wanted - found:
+        to_insert.append(PostingAnnotation(posting_id=posting_id,
+                                           annotation_id=annotation_id))
+
+    # Finally, apply the changes.
+
+    _delete_records(PostingAnnotation, to_delete)
+    if len(to_insert) > 0:
+        PostingAnnotation.objects.bulk_create(to_insert)
+
+    logger.debug("Reconciled annotations: %d added, %d deleted"
+                 % (len(to_insert), len(to_delete)))
+
+#############################################################################
+
+def reconcile_images(posting_images):
+    """ Bring the image references for a batch of postings up to date.
+
+        'posting_images' should be a dictionary mapping posting record IDs to
+        a list of images for that posting.  Each image should be a dictionary
+        with 'full_url' and 'thumbnail_url' entries, and optionally the width
+        and height of each image.
+
+        Upon completion, each of these postings will have exactly the given
+        set of images.  Images are identified by their full and thumbnail URLs;
+        if the width or height of an existing image has changed, the image
+        reference is replaced.
+
+        Postings which aren't in 'posting_images' are left unchanged.
+    """
+    if len(posting_images) == 0:
+        return
+
+    # Calculate the images we want to end up with.  This is a dictionary
+    # mapping (posting_id, full_url, thumbnail_url) tuples to a tuple of
+    # values for the image's fields.
+
+    wanted = {}
+    for posting_id,images in posting_images.items():
+        for image in images:
+            key = (posting_id, image.get("full_url"),
+                   image.get("thumbnail_url"))
+            wanted[key] = tuple([image.get(field) for field in IMAGE_FIELDS])
+
+    # Compare the existing ImageReference records against the wanted images.
+
+    query = ImageReference.objects.filter(
+                            posting_id__in=posting_images.keys())
+
+    found     = set() # Set of (posting_id, full_url, thumbnail_url) tuples.
+    to_delete = []    # List of ImageReference record IDs to delete.
+
+    for row in query.values_list("id", "posting_id", *IMAGE_FIELDS):
+        record_id  = row[0]
+        posting_id = row[1]
+        values     = row[2:]
+        key        = (posting_id, values[IMAGE_FIELDS.index("full_url")],
+                      values[IMAGE_FIELDS.index("thumbnail_url")])
+
+        if key in found or wanted.get(key) != values:
+            to_delete.append(record_id)
+        else:
+            found.add(key)
+
+    to_insert = []
+    for key,values in wanted.items():
+        if key not in found:
+            image_ref = ImageReference(posting_id=key[0])
+            for field,value in zip(IMAGE_FIELDS, values):
+                setattr(image_ref, field, value)
+            to_insert.append(image_ref)
+
+    # Finally, apply the changes.
+
+    _delete_records(ImageReference, to_delete)
+    if len(to_insert) > 0:
+        ImageReference.objects.bulk_create(to_insert)
+
+    logger.debug("Reconciled images: %d added, %d deleted"
+                 % (len(to_insert), len(to_delete)))
+
+#############################################################################
+#                                                                           #
+#                    P R I V A T E   D E F I N I T I O N S                  #
+#                                                                           #
+#############################################################################
+
+def _delete_records(model, record_ids):
+    """ Delete the given records from the database.
+
+        'model' is the Django model class, and 'record_ids' is a list of record
+        IDs to delete.  We delete all the records using a single statement.
+
+        Note that we bypass the Django ORM's deletion logic, which would load
+        each record before deleting it.  This is only safe because nothing
+        refers to the records we're deleting.
+    """
+    if len(record_ids) == 0:
+        return
+
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM " + model._meta.db_table + " " +
+                   "WHERE id IN %s", [tuple(record_ids)])
+
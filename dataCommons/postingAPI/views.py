@@ -20,7 +20,7 @@ from dataCommons.shared.models         import *
 from dataCommons.shared.lib.decorators import *
 from dataCommons.shared.lib            import eventRecorder
 
-from dataCommons.monitoringAPI.models import *
+from dataCommons.monitoringAPI import postingQueue
 
 from dataCommons.postingAPI import postingParser
 from dataCommons.postingAPI import tasks
@@ -119,20 +119,10 @@ def calc_wait_for_time(num_postings_in_batch):
         We calculate the "wait_for" time based on the current size of the
         posting queue.
     """
-    # Calculate the current size of the posting queue.
+    # Get the current size of the posting queue.  Note that this is kept in a
+    # running counter, so we don't have to calculate it from the event log.
 
-    num_postings_queued = \
-        Event.objects.filter(type__type="POSTINGS_QUEUED").aggregate(
-                Sum("primary_value"))['primary_value__sum']
-    if num_postings_queued == None: num_postings_queued = 0
-
-    num_postings_dequeued = \
-        Event.objects.filter(type__type="POSTINGS_DEQUEUED").aggregate(
-                Sum("primary_value"))['primary_value__sum']
-    if num_postings_dequeued == None: num_postings_dequeued = 0
-
-    posting_queue_size = num_postings_queued - num_postings_dequeued
-    if posting_queue_size < 0: posting_queue_size = 0
+    posting_queue_size = postingQueue.get_size()
 
     # Now calculate the "wait_for" time, based on the current size of the
     # posting queue.
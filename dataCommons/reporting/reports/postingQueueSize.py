@@ -8,6 +8,7 @@ from django.db.models import *
 from dataCommons.shared.lib import dateHelpers,reportHelpers
 
 from dataCommons.monitoringAPI.models import *
+from dataCommons.monitoringAPI        import rollups
 
 #############################################################################
 
@@ -64,25 +65,22 @@ def generator(params, timezone_offset):
     # Now calculate the queue size at the start of the time period.  We get
     # this by summing up the total value of the POSTINGS_QUEUED events, and
     # then subtract the total value of the POSTINGS_DEQUEUED events, prior to
-    # the starting time period.
-
-    if postings_queued_event != None:
-        query = Event.objects.filter(timestamp__lt=startTime,
-                                     type=postings_queued_event)
-        num_postings_added = \
-            query.aggregate(Sum("primary_value"))['primary_value__sum']
-        if num_postings_added == None: num_postings_added = 0
-    else:
-        num_postings_added = 0
-
-    if postings_dequeued_event != None:
-        query = Event.objects.filter(timestamp__lt=startTime,
-                                     type=postings_dequeued_event)
-        num_postings_removed = \
-            query.aggregate(Sum("primary_value"))['primary_value__sum']
-        if num_postings_removed == None: num_postings_removed = 0
-    else:
-        num_postings_removed = 0
+    # the starting time period.  Note that we use the hourly event rollups to
+    # avoid having to scan through every event.
+
+    before_start = startTime - reportHelpers.ONE_MICROSECOND
+
+    num_postings_added = 0
+    for rollup in rollups.get_periods("POSTINGS_QUEUED",
+                                      rollups.HOUR_RESOLUTION,
+                                      None, before_start):
+        num_postings_added = num_postings_added + rollup.primary_total
+
+    num_postings_removed = 0
+    for rollup in rollups.get_periods("POSTINGS_DEQUEUED",
+                                      rollups.HOUR_RESOLUTION,
+                                      None, before_start):
+        num_postings_removed = num_postings_removed + rollup.primary_total
 
     starting_queue_size = num_postings_added - num_postings_removed
 
@@ -94,17 +92,35 @@ def generator(params, timezone_offset):
     reducer.set_period(startTime, endTime)
     reducer.set_value_combiner(sum)
 
-    if postings_queued_event != None:
-        for event in Event.objects.filter(timestamp__gte=startTime,
-                                          timestamp__lte=endTime,
-                                          type=postings_queued_event):
-            reducer.add(event.timestamp, event.primary_value)
-
-    if postings_dequeued_event != None:
-        for event in Event.objects.filter(timestamp__gte=startTime,
-                                          timestamp__lte=endTime,
-                                          type=postings_dequeued_event):
-            reducer.add(event.timestamp, -event.primary_value)
+    resolution = rollups.choose_resolution(startTime, endTime)
+
+    if resolution == None:
+        if postings_queued_event != None:
+            query = Event.objects.filter(timestamp__gte=startTime,
+                                         timestamp__lte=endTime,
+                                         type=postings_queued_event)
+            reducer.add_many(query.values_list("timestamp",
+                                               "primary_value").iterator())
+
+        if postings_dequeued_event != None:
+            query = Event.objects.filter(timestamp__gte=startTime,
+                                         timestamp__lte=endTime,
+                                         type=postings_dequeued_event)
+            reducer.add_many((timestamp, -num_postings)
+                             for timestamp,num_postings
+                             in query.values_list("timestamp",
+                                                  "primary_value").iterator())
+    else:
+        # The timeframe is long enough to use the event rollups rather than
+        # the raw events.
+
+        for rollup in rollups.get_periods("POSTINGS_QUEUED", resolution,
+                                          startTime, endTime):
+            reducer.add(rollup.period_start, rollup.primary_total)
+
+        for rollup in rollups.get_periods("POSTINGS_DEQUEUED", resolution,
+                                          startTime, endTime):
+            reducer.add(rollup.period_start, -rollup.primary_total)
 
     reduced_data = reducer.get_reduced_data()
 
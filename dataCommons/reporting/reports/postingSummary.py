@@ -1,10 +1,11 @@
-""" dataCommons.reporting.reports.postingSumamry
+""" dataCommons.reporting.reports.postingSummary
 
     This module implements the "Posting Summary" report for the 3taps
     Reporting system.
 """
 import datetime
 
+from django.db        import connection
 from django.db.models import *
 
 from dataCommons.shared.lib import dateHelpers,reportHelpers
@@ -91,17 +92,27 @@ def generator(params, timezone_offset):
     periods = []
     period_start = startTime
     while period_start <= endTime:
-        periods.append({'start' : period_start,
-                        'end'   : period_start + chunk_size -
-                                  datetime.timedelta(microseconds=1)})
+        periods.append({'start'        : period_start,
+                        'end'          : period_start + chunk_size -
+                                         datetime.timedelta(microseconds=1),
+                        'num_postings' : 0})
         period_start = period_start + chunk_size
 
-    # Calculate the total for each time period in turn.
+    # Calculate the totals for all the time periods at once.  We do this using
+    # a single query which groups the postings by the index of the period they
+    # fall within; periods without any postings keep their total of zero.
 
-    for period in periods:
-        query = {date_field + "__gte" : period['start'],
-                 date_field + "__lte" : period['end']}
-        period['num_postings'] = Posting.objects.filter(**query).count()
+    chunk_secs = chunk_size.days * 24 * 3600 + chunk_size.seconds
+
+    cursor = connection.cursor()
+    cursor.execute('SELECT FLOOR(EXTRACT(EPOCH FROM "' + date_field + '" - ' +
+                   '%s) / %s), COUNT(*) FROM ' + Posting._meta.db_table + ' ' +
+                   'WHERE "' + date_field + '" >= %s ' +
+                   'AND "' + date_field + '" <= %s GROUP BY 1',
+                   [startTime, chunk_secs, startTime, periods[-1]['end']])
+
+    for period_num,num_postings in cursor.fetchall():
+        periods[int(period_num)]['num_postings'] = num_postings
 
     # Assemble the results to display.
 
@@ -8,6 +8,7 @@ from django.db.models import *
 from dataCommons.shared.lib import dateHelpers,reportHelpers
 
 from dataCommons.monitoringAPI.models import *
+from dataCommons.monitoringAPI        import rollups
 
 #############################################################################
 
@@ -65,14 +66,30 @@ def generator(params, timezone_offset):
     reducer.set_period(startTime, endTime)
     reducer.set_value_combiner(max)
 
-    if postings_processed_event != None:
-        for event in Event.objects.filter(timestamp__gte=startTime,
-                                          timestamp__lte=endTime,
-                                          type=postings_processed_event):
-            num_postings = event.primary_value
-            tot_time     = event.secondary_value # milliseconds.
-            time_per_posting = tot_time / num_postings
-            reducer.add(event.timestamp, time_per_posting)
+    resolution = rollups.choose_resolution(startTime, endTime)
+
+    if resolution == None:
+        if postings_processed_event != None:
+            query = Event.objects.filter(timestamp__gte=startTime,
+                                         timestamp__lte=endTime,
+                                         type=postings_processed_event)
+            query = query.values_list("timestamp", "primary_value",
+                                      "secondary_value")
+
+            # Note that the secondary value is the total time, in
+            # milliseconds, and the primary value is the number of postings.
+
+            reducer.add_many((timestamp, tot_time / num_postings)
+                             for timestamp,num_postings,tot_time
+                             in query.iterator())
+    else:
+        # The timeframe is long enough to use the event rollups rather than
+        # the raw events.
+
+        for rollup in rollups.get_periods("POSTINGS_PROCESSED", resolution,
+                                          startTime, endTime):
+            if rollup.max_latency != None:
+                reducer.add(rollup.period_start, rollup.max_latency)
 
     reduced_data = reducer.get_reduced_data()
 
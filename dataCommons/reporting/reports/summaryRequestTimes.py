@@ -8,6 +8,7 @@ from django.db.models import *
 from dataCommons.shared.lib import dateHelpers,reportHelpers
 
 from dataCommons.monitoringAPI.models import *
+from dataCommons.monitoringAPI        import rollups
 
 #############################################################################
 
@@ -64,15 +65,30 @@ def generator(params, timezone_offset):
     reducer.set_period(startTime, endTime)
     reducer.set_value_combiner(max)
 
-    if summary_requests_event != None:
-        for event in Event.objects.filter(timestamp__gte=startTime,
-                                          timestamp__lte=endTime,
-                                          type=summary_requests_event):
-            num_requests     = event.primary_value
-            tot_time         = event.secondary_value # milliseconds.
-            time_per_request = tot_time / num_requests
-
-            reducer.add(event.timestamp, time_per_request)
+    resolution = rollups.choose_resolution(startTime, endTime)
+
+    if resolution == None:
+        if summary_requests_event != None:
+            query = Event.objects.filter(timestamp__gte=startTime,
+                                         timestamp__lte=endTime,
+                                         type=summary_requests_event)
+            query = query.values_list("timestamp", "primary_value",
+                                      "secondary_value")
+
+            # Note that the secondary value is the total time, in
+            # milliseconds, and the primary value is the number of requests.
+
+            reducer.add_many((timestamp, tot_time / num_requests)
+                             for timestamp,num_requests,tot_time
+                             in query.iterator())
+    else:
+        # The timeframe is long enough to use the event rollups rather than
+        # the raw events.
+
+        for rollup in rollups.get_periods("SUMMARY_REQUESTS", resolution,
+                                          startTime, endTime):
+            if rollup.max_latency != None:
+                reducer.add(rollup.period_start, rollup.max_latency)
 
     reduced_data = reducer.get_reduced_data()
 
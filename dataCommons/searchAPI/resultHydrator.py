@@ -0,0 +1,254 @@
+""" dataCommons.searchAPI.resultHydrator
+
+    This module converts a page of search results into the posting data
+    returned back to the caller.
+
+    Rather than loading each posting as a Posting object and following its
+    foreign keys and related records one at a time, we retrieve only the
+    columns needed for the requested return values, translate the various
+    foreign keys into codes using the in-process reference registry, and
+    retrieve the images and annotations for the entire page of postings using
+    a single query each.  This means that the number of database queries
+    needed to assemble a page of search results doesn't depend on the number
+    of postings in the page.
+"""
+import logging
+
+from dataCommons.shared.models          import *
+from dataCommons.shared.lib             import referenceRegistry
+from dataCommons.shared.lib.dateHelpers import datetime_to_seconds
+
+#############################################################################
+
+# The location fields which refer to Location records, along with the key to
+# use for each field in the returned location data:
+
+LOCATION_FIELDS = [("location_country",  "country"),
+                   ("location_state",    "state"),
+                   ("location_metro",    "metro"),
+                   ("location_region",   "region"),
+                   ("location_county",   "county"),
+                   ("location_city",     "city"),
+                   ("location_locality", "locality"),
+                   ("location_zipcode",  "zipcode")]
+
+# The Posting columns needed for each of the possible return values:
+
+COLUMNS = {
+    'id'             : [],
+    'account_id'     : ["account_id"],
+    'source'         : ["source"],
+    'category'       : ["category"],
+    'category_group' : ["category_group"],
+    'location'       : ["location_latitude", "location_longitude",
+                        "location_accuracy"] + \
+                       [field for field,key in LOCATION_FIELDS],
+    'external_id'    : ["external_id"],
+    'external_url'   : ["external_url"],
+    'heading'        : ["heading"],
+    'body'           : ["body"],
+    'html'           : ["html"],
+    'timestamp'      : [],
+    'expires'        : ["expires"],
+    'language'       : ["language"],
+    'price'          : ["price"],
+    'currency'       : ["currency"],
+    'images'         : [],
+    'annotations'    : [],
+    'status'         : ["status_offered", "status_lost", "status_stolen",
+                        "status_found", "status_deleted"],
+    'immortal'       : ["immortal"],
+}
+
+# The ImageReference fields to return for each image:
+
+IMAGE_FIELDS = ["full_url", "full_width", "full_height",
+                "thumbnail_url", "thumbnail_width", "thumbnail_height"]
+
+#############################################################################
+
+logger = logging.getLogger(__name__)
+
+#############################################################################
+
+def fetch_rows(query, retvals):
+    """ Retrieve the raw posting data for a page of search results.
+
+        The parameters are as follows:
+
+            'query'
+
+                A QuerySet returning the Posting records in the current page
+                of search results.
+
+            'retvals'
+
+                A set of the fields to return for each posting.
+
+        We return a list of dictionaries, one for each posting, mapping column
+        names to values.  Only the columns needed for the given return values
+        are retrieved from the database.  Note that the "id" and "timestamp"
+        columns are always included.
+    """
+    columns = ["id", "timestamp"]
+    for retval in retvals:
+        for column in COLUMNS[retval]:
+            if column not in columns:
+                columns.append(column)
+
+    return list(query.values(*columns))
+
+#############################################################################
+
+def hydrate(rows, retvals):
+    """ Convert the given raw posting data into the data to return.
+
+        The parameters are as follows:
+
+            'rows'
+
+                A list of posting rows, as returned by fetch_rows(), above.
+
+            'retvals'
+
+                A set of the fields to return for each posting.
+
+        We return a list of dictionaries, one for each posting, containing the
+        requested fields for each posting in the format expected by the
+        caller.
+    """
+    posting_ids = [row['id'] for row in rows]
+
+    # Collect the codes, images and annotations we need for the entire page
+    # of postings.
+
+    if "source" in retvals:
+        source_codes = referenceRegistry.get_codes("source")
+    if "category" in retvals:
+        category_codes = referenceRegistry.get_codes("category")
+    if "category_group" in retvals:
+        group_codes = referenceRegistry.get_codes("category_group")
+    if "location" in retvals:
+        location_codes = referenceRegistry.get_codes("location")
+    if "images" in retvals:
+        images = _get_images(posting_ids)
+    if "annotations" in retvals:
+        annotations = _get_annotations(posting_ids)
+
+    # Build the data to return for each posting.
+
+    found_postings = []
+    for row in rows:
+        found_posting = {}
+        if "id" in retvals:
+            found_posting['id'] = row['id']
+        if "account_id" in retvals:
+            found_posting['account_id'] = row['account_id']
+        if "source" in retvals:
+            found_posting['source'] = source_codes.get(row['source'])
+        if "category" in retvals:
+            found_posting['category'] = category_codes.get(row['category'])
+        if "category_group" in retvals:
+            found_posting['category_group'] = \
+                group_codes.get(row['category_group'])
+        if "location" in retvals:
+            loc = {}
+            if row['location_latitude'] != None:
+                loc['latitude'] = row['location_latitude']
+            if row['location_longitude'] != None:
+                loc['longitude'] = row['location_longitude']
+            if row['location_accuracy'] != None:
+                loc['accuracy'] = row['location_accuracy']
+            for field,key in LOCATION_FIELDS:
+                if row[field] != None:
+                    loc[key] = location_codes.get(row[field])
+            found_posting['location'] = loc
+        if "external_id" in retvals:
+            found_posting['external_id'] = row['external_id']
+        if "external_url" in retvals:
+            found_posting['external_url'] = row['external_url']
+        if "heading" in retvals:
+            found_posting['heading'] = row['heading']
+        if "body" in retvals:
+            found_posting['body'] = row['body']
+        if "html" in retvals:
+            found_posting['html'] = row['html']
+        if "timestamp" in retvals:
+            found_posting['timestamp'] = datetime_to_seconds(row['timestamp'])
+        if "expires" in retvals:
+            found_posting['expires'] = datetime_to_seconds(row['expires'])
+        if "language" in retvals:
+            found_posting['language'] = row['language']
+        if "price" in retvals:
+            found_posting['price'] = row['price']
+        if "currency" in retvals:
+            found_posting['currency'] = row['currency']
+        if "images" in retvals:
+            found_posting['images'] = images.get(row['id'], [])
+        if "annotations" in retvals:
+            found_posting['annotations'] = annotations.get(row['id'], {})
+        if "status" in retvals:
+            status = {}
+            status['offered'] = row['status_offered']
+            status['lost']    = row['status_lost']
+            status['stolen']  = row['status_stolen']
+            status['found']   = row['status_found']
+            status['deleted'] = row['status_deleted']
+            found_posting['status'] = status
+        if "immortal" in retvals:
+            found_posting['immortal'] = row['immortal']
+
+        found_postings.append(found_posting)
+
+    return found_postings
+
+#############################################################################
+#                                                                           #
+#                    P R I V A T E   D E F I N I T I O N S                  #
+#                                                                           #
+#############################################################################
+
+def _get_images(posting_ids):
+    """ Return the images for the given postings.
+
+        We return a dictionary mapping each posting ID to a list of images for
+        that posting, where each image is a dictionary holding the non-null
+        fields for that image.  Postings with no images will not be included
+        in the returned dictionary.
+    """
+    images = {}
+    if len(posting_ids) == 0:
+        return images
+
+    query = ImageReference.objects.filter(posting__in=posting_ids)
+    query = query.order_by("id").values_list("posting", *IMAGE_FIELDS)
+    for row in query:
+        image = {}
+        for field,value in zip(IMAGE_FIELDS, row[1:]):
+            if value != None:
+                image[field] = value
+        images.setdefault(row[0], []).append(image)
+
+    return images
+
+#############################################################################
+
+def _get_annotations(posting_ids):
+    """ Return the annotations for the given postings.
+
+        We return a dictionary mapping each posting ID to a dictionary of
+        annotations for that posting.  Postings with no annotations will not
+        be included in the returned dictionary.
+    """
+    annotations = {}
+    if len(posting_ids) == 0:
+        return annotations
+
+    query = PostingAnnotation.objects.filter(posting__in=posting_ids)
+    query = query.values_list("posting", "annotation__annotation")
+    for posting_id,s in query:
+        key,value = s.split(":", 1)
+        annotations.setdefault(posting_id, {})[key] = value
+
+    return annotations
+
@@ -2,7 +2,10 @@
 
     This module defines the view functions made available by the Search API.
 """
+import base64
+import hashlib
 import logging
+import re
 import time
 
 from datetime import datetime, timedelta
@@ -15,18 +18,33 @@ from django.http import HttpResponseBadRequest
 from django.views.decorators.csrf import csrf_exempt
 
 from django.db import connection, transaction
+from django.utils.timezone import utc
 from django.db.utils import DatabaseError
 
 import simplejson as json
 
+from dataCommons.searchAPI import resultHydrator
+
 from dataCommons.shared.models          import *
 from dataCommons.shared.lib.decorators  import *
+from dataCommons.shared.lib             import dataCache
 from dataCommons.shared.lib             import eventRecorder
 from dataCommons.shared.lib             import searchHelpers
 from dataCommons.shared.lib.dateHelpers import datetime_to_seconds
 
 #############################################################################
 
+# The number of seconds to cache an exact count of the matching postings:
+
+COUNT_CACHE_TIME = 60
+
+# When estimating the number of matching postings, we count up to this many
+# postings before falling back to the database's own estimate:
+
+ESTIMATE_LIMIT = 10000
+
+#############################################################################
+
 logger = logging.getLogger(__name__)
 
 #############################################################################
@@ -63,6 +81,13 @@ def search(request):
     # If the caller didn't supply a timestamp, add a default timestamp to the
     # search query.
 
+    # Remember the key to use for caching the number of matching postings.
+    # Note that we calculate this before adding the default timestamp, as the
+    # default timestamp changes every second.
+
+    count_cache_key = calc_count_cache_key(criteria,
+                                           request.GET.get("anchor"))
+
     if "timestamp" not in criteria:
         criteria['timestamp'] = str(int((time.time() - 24*3600))) + '..' + \
                                 str(int(time.time()))
@@ -121,6 +146,37 @@ def search(request):
     else:
         page = 0
 
+    if "count" in request.GET:
+        count_mode = request.GET['count']
+        if count_mode not in ["exact", "estimate", "none"]:
+            return HttpResponse(json.dumps(
+                                    {'success' : False,
+                                     'error'   : "Invalid 'count' value"}),
+                                mimetype="application/json")
+    else:
+        count_mode = "exact"
+
+    if "cursor" in request.GET:
+        if page != 0:
+            return HttpResponse(json.dumps(
+                                    {'success' : False,
+                                     'error'   : "Can't use both 'cursor' " +
+                                                 "and 'page'"}),
+                                mimetype="application/json")
+        use_cursor = True
+        if request.GET['cursor'] in ["", "start"]:
+            cursor_pos = None # Start at the beginning.
+        else:
+            cursor_pos = decode_cursor(request.GET['cursor'])
+            if cursor_pos == None:
+                return HttpResponse(json.dumps(
+                                    {'success' : False,
+                                     'error'   : "Invalid 'cursor' value"}),
+                                    mimetype="application/json")
+    else:
+        use_cursor = False
+        cursor_pos = None
+
     # Construct a search query based on the supplied parameters.
 
     success,result = searchHelpers.build_search_query(criteria)
@@ -135,10 +191,35 @@ def search(request):
     if anchor != None:
         query = query.filter(id__lte=anchor)
 
-    num_matches = query.count()
+    # Count the number of matching postings, using the desired count mode.
 
-    query = query.order_by("-timestamp")
-    query = query[page*rpp:page*rpp+rpp]
+    if count_mode == "exact":
+        num_matches = get_cached_count(count_cache_key)
+        if num_matches == None:
+            num_matches = query.count()
+            set_cached_count(count_cache_key, num_matches)
+        num_matches_is_estimate = False
+    elif count_mode == "estimate":
+        num_matches,num_matches_is_estimate = estimate_count(query)
+    else:
+        num_matches = None
+        num_matches_is_estimate = False
+
+    # Note that we order by record ID as well as timestamp, so that the order
+    # of the postings is always the same.  If we've been given a cursor, we
+    # start immediately after the cursor's position rather than skipping over
+    # the previous pages; this uses the composite (timestamp, id) index, so
+    # every page costs the same no matter how far back it is.
+
+    query = query.order_by("-timestamp", "-id")
+    if use_cursor:
+        if cursor_pos != None:
+            query = query.extra(where=['("shared_posting"."timestamp", ' +
+                                       '"shared_posting"."id") < (%s, %s)'],
+                                params=list(cursor_pos))
+        query = query[:rpp]
+    else:
+        query = query[page*rpp:page*rpp+rpp]
     sql = str(query.query)
 
     # Testing: If the caller provided a "return_sql" parameter, return the raw
@@ -157,108 +238,18 @@ def search(request):
 
     found_postings = []
     new_anchor = None
+    last_row = None
 
     try:
-        for posting in query:
-            if anchor == None and new_anchor == None:
+        rows = resultHydrator.fetch_rows(query, retvals)
+        if len(rows) > 0:
+            if anchor == None:
                 # Remember the ID of the first (ie, most recent) found posting.
                 # This will be our anchor for subsequent requests.
-                new_anchor = str(posting.id)
-
-            found_posting = {}
-            if "id" in retvals:
-                found_posting['id'] = posting.id
-            if "account_id" in retvals:
-                found_posting['account_id'] = posting.account_id
-            if "source" in retvals:
-                found_posting['source'] = posting.source.code
-            if "category" in retvals:
-                found_posting['category'] = posting.category.code
-            if "category_group" in retvals:
-                found_posting['category_group'] = posting.category_group.code
-            if "location" in retvals:
-                loc = {}
-                if posting.location_latitude != None:
-                    loc['latitude'] = posting.location_latitude
-                if posting.location_longitude != None:
-                    loc['longitude'] = posting.location_longitude
-                if posting.location_accuracy != None:
-                    loc['accuracy'] = posting.location_accuracy
-                if posting.location_country != None:
-                    loc['country'] = posting.location_country.code
-                if posting.location_state != None:
-                    loc['state'] = posting.location_state.code
-                if posting.location_metro != None:
-                    loc['metro'] = posting.location_metro.code
-                if posting.location_region != None:
-                    loc['region'] = posting.location_region.code
-                if posting.location_county != None:
-                    loc['county'] = posting.location_county.code
-                if posting.location_city != None:
-                    loc['city'] = posting.location_city.code
-                if posting.location_locality != None:
-                    loc['locality'] = posting.location_locality.code
-                if posting.location_zipcode != None:
-                    loc['zipcode'] = posting.location_zipcode.code
-                found_posting['location'] = loc
-            if "external_id" in retvals:
-                found_posting['external_id'] = posting.external_id
-            if "external_url" in retvals:
-                found_posting['external_url'] = posting.external_url
-            if "heading" in retvals:
-                found_posting['heading'] = posting.heading
-            if "body" in retvals:
-                found_posting['body'] = posting.body
-            if "html" in retvals:
-                found_posting['html'] = posting.html
-            if "timestamp" in retvals:
-                found_posting['timestamp'] = datetime_to_seconds(
-                                                        posting.timestamp)
-            if "expires" in retvals:
-                found_posting['expires'] = datetime_to_seconds(posting.expires)
-            if "language" in retvals:
-                found_posting['language'] = posting.language
-            if "price" in retvals:
-                found_posting['price'] = posting.price
-            if "currency" in retvals:
-                found_posting['currency'] = posting.currency
-            if "images" in retvals:
-                images = []
-                for image in posting.imagereference_set.all():
-                    dst_image = {}
-                    if image.full_url != None:
-                        dst_image['full_url'] = image.full_url
-                    if image.full_width != None:
-                        dst_image['full_width'] = image.full_width
-                    if image.full_height != None:
-                        dst_image['full_height'] = image.full_height
-                    if image.thumbnail_url != None:
-                        dst_image['thumbnail_url'] = image.thumbnail_url
-                    if image.thumbnail_width != None:
-                        dst_image['thumbnail_width'] = image.thumbnail_width
-                    if image.thumbnail_height != None:
-                        dst_image['thumbnail_height'] = image.thumbnail_height
-                    images.append(dst_image)
-                found_posting['images'] = images
-            if "annotations" in retvals:
-                annotations = {}
-                for posting_annotation in posting.postingannotation_set.all():
-                    s = posting_annotation.annotation.annotation
-                    key,value = s.split(":", 1)
-                    annotations[key] = value
-                found_posting['annotations'] = annotations
-            if "status" in retvals:
-                status = {}
-                status['offered'] = posting.status_offered
-                status['lost']    = posting.status_lost
-                status['stolen']  = posting.status_stolen
-                status['found']   = posting.status_found
-                status['deleted'] = posting.status_deleted
-                found_posting['status'] = status
-            if "immortal" in retvals:
-                found_posting['immortal'] = posting.immortal
-
-            found_postings.append(found_posting)
+                new_anchor = str(rows[0]['id'])
+            last_row = rows[-1]
+
+        found_postings = resultHydrator.hydrate(rows, retvals)
     except DatabaseError, e:
         if "statement timeout" in str(e):
             # The query timed out.  Tell the user the bad news.
@@ -277,20 +268,35 @@ def search(request):
 
     # Assemble our search response.
 
-    response = {'success'     : True,
-                'num_matches' : num_matches,
-                'postings'    : found_postings}
+    response = {'success'  : True,
+                'postings' : found_postings}
+
+    if num_matches != None:
+        response['num_matches'] = num_matches
+        if num_matches_is_estimate:
+            response['num_matches_is_estimate'] = True
 
     if anchor == None and new_anchor != None:
         response['anchor'] = new_anchor
 
+    # If we're using a cursor and there may be more postings to come, return
+    # the cursor to use for the next page of results.
+
+    if use_cursor and len(found_postings) == rpp:
+        response['next_cursor'] = encode_cursor(last_row['timestamp'],
+                                                last_row['id'])
+
     # If the caller gave us an anchor, see if any new postings have come in
     # since the original query was made.
 
-    if anchor != None:
+    if anchor != None and count_mode != "none":
         success,query = searchHelpers.build_search_query(criteria)
         if success:
-            response['new_postings'] = query.filter(id__gt=anchor).count()
+            query = query.filter(id__gt=anchor)
+            if count_mode == "exact":
+                response['new_postings'] = query.count()
+            else:
+                response['new_postings'] = estimate_count(query)[0]
 
     # Record an event telling us how long the search request took.
 
@@ -309,3 +315,129 @@ def search(request):
     return HttpResponse(json.dumps(response, sort_keys=True, indent="    "),
                         mimetype="application/json")
 
+#############################################################################
+#                                                                           #
+#                    P R I V A T E   D E F I N I T I O N S                  #
+#                                                                           #
+#############################################################################
+
+def calc_count_cache_key(criteria, anchor):
+    """ Return the data cache key to use for caching a count of postings.
+
+        'criteria' is a dictionary holding the search criteria supplied by the
+        caller, and 'anchor' is the caller's anchor value, if any.  We return
+        a string which can be used to cache the number of postings which match
+        these criteria.
+
+        Note that the criteria are normalised so that the same criteria will
+        always result in the same key, regardless of the order in which they
+        were supplied.
+    """
+    parts = []
+    for key in sorted(criteria.keys()):
+        parts.append(key + "=" + criteria[key].strip())
+    if anchor != None:
+        parts.append("anchor=" + anchor)
+
+    s = "&".join(parts).encode("utf-8")
+    return "search_count." + hashlib.md5(s).hexdigest()
+
+#############################################################################
+
+def get_cached_count(key):
+    """ Return the cached count stored under the given key.
+
+        If there is no cached count, we return None.
+    """
+    try:
+        return dataCache.get(key)
+    except:
+        logger.exception("Unable to read cached count")
+        return None
+
+#############################################################################
+
+def set_cached_count(key, count):
+    """ Store the given count into the data cache under the given key.
+
+        The cached count expires after COUNT_CACHE_TIME seconds.
+    """
+    try:
+        dataCache.set(key, count, ttl=COUNT_CACHE_TIME)
+    except:
+        logger.exception("Unable to cache count")
+
+#############################################################################
+
+def estimate_count(query):
+    """ Return an estimate of the number of records matching a query.
+
+        'query' is a QuerySet to count the records for.  We start by counting
+        at most ESTIMATE_LIMIT+1 records; if there are no more than
+        ESTIMATE_LIMIT matching records, this is the exact number of records.
+        Otherwise, we ask the database for its estimate of the number of
+        matching records, which is quick but may be wildly inaccurate.
+
+        Note that we can't use query[:ESTIMATE_LIMIT+1].count() to count the
+        records, as Django ignores the limit when counting a sliced query.
+        Instead, we wrap the limited query in our own COUNT(*) query.
+
+        We return a (count, is_estimate) tuple, where 'count' is the number of
+        matching records, and 'is_estimate' is True if this number is only an
+        estimate.
+    """
+    cursor = connection.cursor()
+
+    limited_query = query.order_by().values_list("id")[:ESTIMATE_LIMIT+1]
+    sql,params = limited_query.query.sql_with_params()
+    cursor.execute("SELECT COUNT(*) FROM (" + sql + ") AS s", params)
+    count = cursor.fetchone()[0]
+    if count <= ESTIMATE_LIMIT:
+        return (count, False)
+
+    sql,params = query.query.sql_with_params()
+    cursor.execute("EXPLAIN " + sql, params)
+    plan = cursor.fetchone()[0]
+
+    match = re.search(r"rows=(\d+)", plan)
+    if match != None:
+        count = max(count, int(match.group(1)))
+
+    return (count, True)
+
+#############################################################################
+
+def encode_cursor(timestamp, posting_id):
+    """ Return the opaque cursor string for the given position.
+
+        'timestamp' and 'posting_id' are the timestamp and record ID of the
+        last posting returned in a page of search results.  We return a string
+        which encodes this position, and can be passed back to us to retrieve
+        the next page of results.
+    """
+    secs = datetime_to_seconds(timestamp)
+    s = "%d.%06d,%d" % (secs, timestamp.microsecond, posting_id)
+    return base64.urlsafe_b64encode(s)
+
+#############################################################################
+
+def decode_cursor(cursor):
+    """ Decode a cursor string created by encode_cursor(), above.
+
+        We return a (timestamp, posting_id) tuple, where 'timestamp' is a
+        timezone-aware datetime.datetime object.  If the cursor is invalid, we
+        return None.
+    """
+    try:
+        s = base64.urlsafe_b64decode(str(cursor))
+        timestamp_str,id_str = s.split(",")
+        secs_str,microsecs_str = timestamp_str.split(".")
+        timestamp = datetime.utcfromtimestamp(int(secs_str))
+        timestamp = timestamp.replace(microsecond=int(microsecs_str),
+                                      tzinfo=utc)
+        posting_id = int(id_str)
+    except (TypeError, ValueError, UnicodeError):
+        return None
+
+    return (timestamp, posting_id)
+
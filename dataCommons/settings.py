@@ -48,8 +48,25 @@ import_setting("AWS_S3_SECURE_URLS",        None)
 import_setting("REDIS_HOST",                '10.5.5.1')
 import_setting("REDIS_PORT",                6379)
 import_setting("REDIS_PASSWORD",            None)
+import_setting("REDIS_MAX_CONNECTIONS",     None)
+import_setting("DATA_CACHE_L1_SIZE",        1000)
+import_setting("DATA_CACHE_L1_TTL",         5)
 
 import_setting("QUERY_TIMEOUT",             20000)
+
+import_setting("ENABLE_SUMMARY_CACHE",      True)
+import_setting("SUMMARY_CACHE_TTL",         3600)
+import_setting("SUMMARY_CACHE_STALE_TIME",  300)
+import_setting("SUMMARY_CACHE_MIN_AGE",     60)
+import_setting("ENABLE_POSTING_COUNTS",     False)
+
+import_setting("EVENT_RECORDING_MODE",      "sync")
+import_setting("EVENT_BUFFER_SIZE",         100)
+import_setting("EVENT_FLUSH_INTERVAL",      5)
+import_setting("ENABLE_SPATIAL_INDEX",      True)
+import_setting("GEOCODE_CACHE_SIZE",        100000)
+import_setting("GEOCODE_CACHE_PRECISION",   4)
+import_setting("GEOCODE_CACHE_USE_REDIS",   False)
 import_setting("GEOS_LIBRARY_PATH",         None)
 import_setting("GDAL_LIBRARY_PATH",         None)
 
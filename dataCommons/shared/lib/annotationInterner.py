@@ -0,0 +1,268 @@
+""" dataCommons.shared.lib.annotationInterner
+
+    This module implements the annotation interning service.  Given a batch of
+    "key:value" annotation strings, we return the record ID of the Annotation
+    object for each string, creating new Annotation records as required.
+
+    To avoid hitting the database for every annotation, we keep a bounded LRU
+    cache of annotation IDs within the current process, backed by a shared
+    cache in Redis.  Annotation strings which aren't in either cache are looked
+    up using a single database query, and any annotations which don't exist yet
+    are inserted using a single statement.
+
+    Note that the annotation IDs are cached indefinitely, as an Annotation
+    record never changes once it has been created.  If the Annotation table is
+    cleared out, the data cache must be flushed and the worker processes
+    restarted.
+"""
+import hashlib
+import logging
+import time
+
+from django.db import connection, transaction, IntegrityError, DatabaseError
+
+from dataCommons.shared.models       import Annotation
+from dataCommons.shared.lib          import dataCache
+from dataCommons.shared.lib.lruCache import LRUCache
+
+#############################################################################
+
+# The maximum number of annotation IDs to hold in our in-process cache:
+
+MAX_CACHE_SIZE = 10000
+
+# How many times to retry inserting a batch of annotations if another process
+# inserts one of our annotations at the same time:
+
+MAX_NUM_ATTEMPTS = 5
+
+#############################################################################
+
+logger = logging.getLogger(__name__)
+
+#############################################################################
+
+def intern_annotations(annotation_values):
+    """ Return the record IDs for the given annotation values.
+
+        'annotation_values' should be a list of "key:value" annotation strings.
+        We return a dictionary mapping each of these strings to the record ID
+        of the associated Annotation object.  Annotation records are created
+        for any strings which aren't already in the database.
+
+        Note that new annotations are inserted using a savepoint, so this
+        function must be called from within a managed transaction.  The new
+        annotations won't be visible to other processes until the transaction
+        has been committed.
+    """
+    annotation_ids = _get_cached_ids(annotation_values)
+    missing_values = _get_missing_values(annotation_values, annotation_ids)
+
+    if len(missing_values) > 0:
+        for attempt in range(MAX_NUM_ATTEMPTS):
+            sid = transaction.savepoint()
+            try:
+                found_ids = _find_annotations(missing_values)
+                values_to_insert = _get_missing_values(missing_values,
+                                                       found_ids)
+                inserted_ids = _insert_annotations(values_to_insert)
+            except IntegrityError:
+                # Another process inserted one of our annotations at the same
+                # time -> try again.
+                transaction.savepoint_rollback(sid)
+                if attempt == MAX_NUM_ATTEMPTS - 1:
+                    raise
+                logger.debug("Annotation added by another process, " +
+                             "trying again")
+            except DatabaseError,e:
+                if "deadlock" in str(e) and attempt < MAX_NUM_ATTEMPTS - 1:
+                    transaction.savepoint_rollback(sid)
+                    logger.debug("DEADLOCK DETECTED!!! TRYING AGAIN")
+                    time.sleep(0.1)
+                else:
+                    raise
+            else:
+                transaction.savepoint_commit(sid)
+                break
+
+        # Note that we don't cache the newly-inserted annotations, as they
+        # haven't been committed yet.  They'll be cached the next time they
+        # are used.
+
+        _remember_ids(found_ids)
+        annotation_ids.update(found_ids)
+        annotation_ids.update(inserted_ids)
+
+    return annotation_ids
+
+#############################################################################
+
+def lookup_annotations(annotation_values):
+    """ Return the record IDs for the given annotation values, if they exist.
+
+        'annotation_values' should be a list of "key:value" annotation strings.
+        We return a dictionary mapping each of these strings to the record ID
+        of the associated Annotation object.  Unlike intern_annotations(), we
+        don't create any new Annotation records; strings which don't match an
+        existing annotation will not be included in the returned dictionary.
+    """
+    annotation_ids = _get_cached_ids(annotation_values)
+    missing_values = _get_missing_values(annotation_values, annotation_ids)
+
+    if len(missing_values) > 0:
+        new_ids = _find_annotations(missing_values)
+        _remember_ids(new_ids)
+        annotation_ids.update(new_ids)
+
+    return annotation_ids
+
+#############################################################################
+
+def clear_cache():
+    """ Remove all the annotation IDs from our in-process cache.
+
+        Note that this doesn't affect the shared cache, or the caches held by
+        other processes.
+    """
+    _get_local_cache().clear()
+
+#############################################################################
+#                                                                           #
+#                    P R I V A T E   D E F I N I T I O N S                  #
+#                                                                           #
+#############################################################################
+
+def _get_local_cache():
+    """ Return the LRUCache object used to cache annotation IDs in-process.
+
+        Note that we use a private global variable so that only one instance of
+        the LRU cache will be used per process.
+    """
+    global _local_cache
+
+    try:
+        return _local_cache
+    except NameError:
+        _local_cache = LRUCache(MAX_CACHE_SIZE)
+        return _local_cache
+
+#############################################################################
+
+def _get_cache_key(annotation_value):
+    """ Return the data cache key to use for the given annotation value.
+
+        As annotation values can be of any length, we use a hash of the
+        annotation value rather than the value itself.
+    """
+    if isinstance(annotation_value, unicode):
+        annotation_value = annotation_value.encode("utf-8")
+    return "annotation_id." + hashlib.md5(annotation_value).hexdigest()
+
+#############################################################################
+
+def _get_cached_ids(annotation_values):
+    """ Return the cached record IDs for the given annotation values.
+
+        We look in our in-process cache first, and then in the shared cache.
+        Upon completion, we return a dictionary mapping annotation values to
+        record IDs for those values which were found in one of the caches.
+    """
+    local_cache = _get_local_cache()
+
+    annotation_ids = {}
+    values_to_get  = []
+    for annotation_value in set(annotation_values):
+        annotation_id = local_cache.get(annotation_value)
+        if annotation_id != None:
+            annotation_ids[annotation_value] = annotation_id
+        else:
+            values_to_get.append(annotation_value)
+
+    if len(values_to_get) > 0:
+        keys = [_get_cache_key(value) for value in values_to_get]
+        cached_ids = dataCache.get_many(keys)
+        for annotation_value,key in zip(values_to_get, keys):
+            if key in cached_ids:
+                annotation_ids[annotation_value] = cached_ids[key]
+                local_cache.set(annotation_value, cached_ids[key])
+
+    return annotation_ids
+
+#############################################################################
+
+def _get_missing_values(annotation_values, annotation_ids):
+    """ Return the annotation values which aren't in 'annotation_ids'.
+
+        We return a sorted list of the distinct values in 'annotation_values'
+        which don't have an entry in the given dictionary.
+    """
+    missing_values = set()
+    for annotation_value in annotation_values:
+        if annotation_value not in annotation_ids:
+            missing_values.add(annotation_value)
+    return sorted(missing_values)
+
+#############################################################################
+
+def _find_annotations(annotation_values):
+    """ Find the existing Annotation records for the given annotation values.
+
+        We return a dictionary mapping annotation values to record IDs for
+        those values which already exist in the database.  Note that all the
+        annotations are found using a single query.
+    """
+    annotation_ids = {}
+    query = Annotation.objects.filter(annotation__in=annotation_values)
+    for annotation_id,annotation_value in query.values_list("id",
+                                                            "annotation"):
+        annotation_ids[annotation_value] = annotation_id
+    return annotation_ids
+
+#############################################################################
+
+def _insert_annotations(annotation_values):
+    """ Insert new Annotation records for the given annotation values.
+
+        We return a dictionary mapping each annotation value to the record ID
+        of the newly-created Annotation record.  Note that all the annotations
+        are inserted using a single statement, and that annotations which
+        already exist are skipped.
+
+        To avoid deadlocks between concurrent processes, the annotations are
+        always inserted in the same (sorted) order.
+    """
+    annotation_ids = {}
+    if len(annotation_values) == 0:
+        return annotation_ids
+
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO shared_annotation (annotation) " +
+                   "SELECT v.annotation FROM (SELECT DISTINCT " +
+                   "unnest(%s::text[]) AS annotation) v " +
+                   "WHERE NOT EXISTS (SELECT 1 FROM shared_annotation a " +
+                   "WHERE a.annotation=v.annotation) " +
+                   "ORDER BY v.annotation " +
+                   "RETURNING id, annotation",
+                   [list(annotation_values)])
+
+    for annotation_id,annotation_value in cursor.fetchall():
+        annotation_ids[annotation_value] = annotation_id
+    return annotation_ids
+
+#############################################################################
+
+def _remember_ids(annotation_ids):
+    """ Add the given annotation IDs to our caches.
+
+        'annotation_ids' is a dictionary mapping annotation values to record
+        IDs.  We add these IDs to both our in-process cache and the shared
+        cache.
+    """
+    local_cache = _get_local_cache()
+
+    values = {}
+    for annotation_value,annotation_id in annotation_ids.items():
+        local_cache.set(annotation_value, annotation_id)
+        values[_get_cache_key(annotation_value)] = annotation_id
+    dataCache.set_many(values)
+
@@ -12,8 +12,9 @@
         <value>          ::= <string>
         <rel_op>         ::= "and" | "or"
 """
-from dataCommons.shared.models import Annotation
-from django.db.models          import Q
+from django.db.models import Q
+
+from dataCommons.shared.lib import annotationInterner
 
 #############################################################################
 
@@ -70,21 +71,15 @@ def parse(criteria):
     if expecting != "rel_op":
         return (False, 'Annotation criteria cannot finish on an "AND" or "OR"')
 
-    # Convert each key/value pair into an Annotation record ID.
+    # Convert each key/value pair into an Annotation record ID.  Note that
+    # unknown annotations have an ID of None, which won't match any postings.
 
-    annotation_ids = []
-    for key,value in terms:
-        try:
-            annotation = Annotation.objects.get(annotation=key+":"+value)
-        except Annotation.DoesNotExist:
-            annotation = None
-
-        if annotation == None:
-            annotation_ids.append(None)
-        else:
-            annotation_ids.append(annotation.id)
+    annotation_values = [key+":"+value for key,value in terms]
+    known_ids = annotationInterner.lookup_annotations(annotation_values)
 
-    print annotation_ids
+    annotation_ids = []
+    for annotation_value in annotation_values:
+        annotation_ids.append(known_ids.get(annotation_value))
 
     # Finally, build the various "Q" objects out of the supplied query
     # parameters, and join them together to yield a single "Q" object
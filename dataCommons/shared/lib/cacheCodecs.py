@@ -0,0 +1,144 @@
+""" dataCommons.shared.lib.cacheCodecs
+
+    This module implements the codecs used to convert values to and from the
+    strings stored in the data cache.
+
+    Each encoded value starts with a single header byte identifying the codec
+    used to encode that value.  The following codecs are currently supported:
+
+        PICKLE_CODEC
+
+            The value is pickled using the highest pickle protocol.
+
+        COMPRESSED_CODEC
+
+            The remainder of the string is a zlib-compressed value, which was
+            itself encoded using one of the other codecs.  Values are only
+            compressed if their encoded size is more than COMPRESS_THRESHOLD
+            bytes, and compression actually makes them smaller.
+
+        PACKED_MAP_CODEC
+
+            The value is a dictionary mapping strings to integers, stored as
+            a count, the NUL-separated keys and a packed array of 64-bit
+            integers.  This is much smaller, and much quicker to decode, than
+            the pickled equivalent.
+
+    Values stored before these codecs were introduced are plain pickles
+    without a header byte.  Since the header bytes can never appear at the
+    start of a protocol 0 pickle, these values are recognised and unpickled
+    as before.
+"""
+import cPickle as pickle
+import struct
+import zlib
+
+#############################################################################
+
+# The header bytes for our various codecs:
+
+PICKLE_CODEC     = "\x01"
+COMPRESSED_CODEC = "\x02"
+PACKED_MAP_CODEC = "\x03"
+
+# Encoded values larger than this many bytes are compressed:
+
+COMPRESS_THRESHOLD = 4096
+
+# The zlib compression level to use.  We favour speed over size.
+
+COMPRESSION_LEVEL = 1
+
+#############################################################################
+
+def encode(value):
+    """ Encode the given value into a string.
+
+        We choose the most compact codec for the given value, and return the
+        encoded value as a string starting with the codec's header byte.
+    """
+    if _is_packable_map(value):
+        data = PACKED_MAP_CODEC + _pack_map(value)
+    else:
+        data = PICKLE_CODEC + pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    if len(data) > COMPRESS_THRESHOLD:
+        compressed = COMPRESSED_CODEC + zlib.compress(data, COMPRESSION_LEVEL)
+        if len(compressed) < len(data):
+            data = compressed
+
+    return data
+
+#############################################################################
+
+def decode(data):
+    """ Decode a string created by encode(), above.
+
+        We return the original value.  Note that strings without a recognised
+        header byte are treated as plain pickles.
+    """
+    header = data[:1]
+    if header == PICKLE_CODEC:
+        return pickle.loads(data[1:])
+    elif header == COMPRESSED_CODEC:
+        return decode(zlib.decompress(data[1:]))
+    elif header == PACKED_MAP_CODEC:
+        return _unpack_map(data[1:])
+    else:
+        return pickle.loads(data) # Entry stored before codecs were added.
+
+#############################################################################
+#                                                                           #
+#                    P R I V A T E   D E F I N I T I O N S                  #
+#                                                                           #
+#############################################################################
+
+# The smallest and largest values which can be stored in a packed map:
+
+_MIN_PACKED_VALUE = -2**63
+_MAX_PACKED_VALUE = 2**63 - 1
+
+#############################################################################
+
+def _is_packable_map(value):
+    """ Return True if the given value can be encoded as a packed map.
+
+        The value must be a non-empty dictionary mapping byte strings which
+        don't contain a NUL character to 64-bit integers.
+    """
+    if type(value) != dict or len(value) == 0:
+        return False
+
+    for key,item in value.iteritems():
+        if type(key) != str or "\0" in key:
+            return False
+        if type(item) not in (int, long):
+            return False
+        if item < _MIN_PACKED_VALUE or item > _MAX_PACKED_VALUE:
+            return False
+
+    return True
+
+#############################################################################
+
+def _pack_map(value):
+    """ Encode the given dictionary as a packed map.
+    """
+    keys   = value.keys()
+    values = [value[key] for key in keys]
+    return struct.pack("<I", len(keys)) + "\0".join(keys) + "\0" \
+         + struct.pack("<%dq" % len(values), *values)
+
+#############################################################################
+
+def _unpack_map(data):
+    """ Decode a packed map created by _pack_map(), above.
+    """
+    num_keys = struct.unpack("<I", data[:4])[0]
+    values_start = len(data) - num_keys * 8
+
+    keys   = data[4:values_start-1].split("\0")
+    values = struct.unpack("<%dq" % num_keys, data[values_start:])
+
+    return dict(zip(keys, values))
+
@@ -14,13 +14,39 @@
         port
 
             The TCP/IP port to use to access the Redis host.
+
+    All access to Redis goes through a single connection pool, which is shared
+    by every thread in the current process.  The maximum size of the pool is
+    set by the REDIS_MAX_CONNECTIONS setting.
+
+    To avoid going to Redis (and decoding the value) each time a cache entry
+    is retrieved, we keep a local copy of the most recently used entries
+    within the current process.  Each entry in Redis has a generation number
+    which is incremented whenever that entry is changed or deleted, along with
+    a global generation number which is incremented whenever the cache is
+    flushed.  A local copy is used without checking Redis for up to
+    DATA_CACHE_L1_TTL seconds; after that, the generation numbers are checked
+    and the local copy is discarded if the entry has changed.  This means that
+    changing an entry in one process is seen by every other process within
+    DATA_CACHE_L1_TTL seconds.  The maximum number of entries to keep locally
+    is set by the DATA_CACHE_L1_SIZE setting.
+
+    Note that the values returned from the local cache are shared, so the
+    caller must not modify them.
+
+    The values are converted to and from strings using the codecs defined in
+    the cacheCodecs module.
 """
-import cPickle as pickle
+import threading
+import time
 
 from django.conf import settings
 
 import redis
 
+from dataCommons.shared.lib          import cacheCodecs
+from dataCommons.shared.lib.lruCache import LRUCache
+
 #############################################################################
 
 # The following string is used as a prefix for our keys in the redis server.
@@ -29,22 +55,61 @@ import redis
 
 PREFIX = "3taps.dataCommons.dataCache."
 
+# The prefix used for the generation number of each cache entry.  Note that
+# this falls within PREFIX, so that the generation numbers are removed when
+# the cache is flushed.
+
+GENERATION_PREFIX = PREFIX + "generation."
+
+# The key used for our global generation number.  Note that this falls
+# outside of PREFIX, so it isn't removed when the cache is flushed.
+
+GLOBAL_GENERATION_KEY = "3taps.dataCommons.dataCacheGeneration"
+
+# The prefix used for persistent counters.  Like the global generation
+# number, this falls outside of PREFIX so that these counters survive the
+# cache being flushed.
+
+PERSISTENT_PREFIX = "3taps.dataCommons.dataCachePersistent."
+
+# The Lua script used to increment a counter only if it already exists:
+
+INCR_IF_EXISTS_SCRIPT = """
+    if redis.call("EXISTS", KEYS[1]) == 1 then
+        return redis.call("INCRBY", KEYS[1], ARGV[1])
+    else
+        return false
+    end
+"""
+
+# The number of keys to retrieve or delete at once when flushing the cache:
+
+FLUSH_BATCH_SIZE = 1000
+
 #############################################################################
 
-def set(key, value):
+def set(key, value, ttl=None):
     """ Set the given cache entry to the given value.
 
         'key' must be a string, and 'value' can be any Python data structure,
-        including the value None.
+        including the value None.  If 'ttl' is supplied, the cache entry will
+        expire after this many seconds.
 
         We associate the given value with the given key in our data cache.
     """
     cache = _get_cache()
 
+    pipeline = cache.pipeline()
     if value == None:
-        cache.delete(PREFIX + key)
+        pipeline.delete(PREFIX + key)
+    elif ttl != None:
+        pipeline.setex(PREFIX + key, cacheCodecs.encode(value), ttl)
     else:
-        cache.set(PREFIX + key, pickle.dumps(value))
+        pipeline.set(PREFIX + key, cacheCodecs.encode(value))
+    pipeline.incr(GENERATION_PREFIX + key)
+    pipeline.execute()
+
+    _get_local_cache().delete(key)
 
 #############################################################################
 
@@ -53,13 +118,275 @@ def get(key):
 
         If there is no value associated with that key, we return None.
     """
+    return get_many([key]).get(key)
+
+#############################################################################
+
+def get_many(keys):
+    """ Retrieve the values currently associated with the given keys.
+
+        'keys' should be a list of strings.  We return a dictionary mapping
+        each key to its associated value.  Keys which have no associated value
+        will not be included in the returned dictionary.
+
+        Note that any keys which aren't in our local cache are retrieved using
+        a single pipelined request to Redis.
+    """
+    if len(keys) == 0:
+        return {}
+
+    local_cache = _get_local_cache()
+    now         = time.time()
+
+    # Start by seeing which entries we have in our local cache.  Entries which
+    # haven't been checked recently must be checked against Redis to make
+    # sure they haven't changed.
+
+    values        = {}
+    keys_to_check = []
+    keys_to_fetch = []
+
+    for key in keys:
+        entry = local_cache.get(key)
+        if entry == None:
+            keys_to_fetch.append(key)
+        elif now >= entry['expires_at']:
+            local_cache.delete(key)
+            keys_to_fetch.append(key)
+        elif now < entry['check_at']:
+            values[key] = entry['value']
+        else:
+            keys_to_check.append(key)
+
+    if len(keys_to_check) > 0:
+        generations = _get_generations(keys_to_check)
+        for key in keys_to_check:
+            entry = local_cache.get(key)
+            if entry != None and entry['generation'] == generations[key]:
+                entry['check_at'] = now + settings.DATA_CACHE_L1_TTL
+                values[key] = entry['value']
+            else:
+                local_cache.delete(key)
+                keys_to_fetch.append(key)
+
+    _record_stats(len(keys) - len(keys_to_fetch), len(keys_to_fetch))
+
+    # Retrieve the remaining entries from Redis, along with their generation
+    # numbers and expiry times, and add them to our local cache.
+
+    if len(keys_to_fetch) > 0:
+        cache = _get_cache()
+
+        pipeline = cache.pipeline()
+        pipeline.mget([PREFIX + key for key in keys_to_fetch])
+        pipeline.mget([GENERATION_PREFIX + key for key in keys_to_fetch])
+        pipeline.get(GLOBAL_GENERATION_KEY)
+        for key in keys_to_fetch:
+            pipeline.ttl(PREFIX + key)
+        results = pipeline.execute()
+
+        encoded_values    = results[0]
+        key_generations   = results[1]
+        global_generation = results[2]
+        ttls              = results[3:]
+
+        for i,key in enumerate(keys_to_fetch):
+            if encoded_values[i] == None:
+                continue
+
+            value = cacheCodecs.decode(encoded_values[i])
+            values[key] = value
+
+            if ttls[i] != None and ttls[i] >= 0:
+                expires_at = now + ttls[i]
+            else:
+                expires_at = now + 365 * 24 * 3600 # Never expires.
+
+            local_cache.set(key,
+                            {'value'      : value,
+                             'generation' : (key_generations[i],
+                                             global_generation),
+                             'check_at'   : now + settings.DATA_CACHE_L1_TTL,
+                             'expires_at' : expires_at})
+
+    return values
+
+#############################################################################
+
+def set_many(values, ttl=None):
+    """ Set a number of cache entries at once.
+
+        'values' should be a dictionary mapping each key to the value to store
+        for that key.  Unlike set(), the values cannot be None.  If 'ttl' is
+        supplied, the cache entries will expire after this many seconds.
+
+        Note that all the values are stored using a single pipelined request
+        to Redis.
+    """
+    if len(values) == 0:
+        return
+
     cache = _get_cache()
 
-    pickled_value = cache.get(PREFIX + key)
-    if pickled_value == None:
+    encoded_values = {}
+    for key,value in values.items():
+        encoded_values[PREFIX + key] = cacheCodecs.encode(value)
+
+    pipeline = cache.pipeline()
+    if ttl == None:
+        pipeline.mset(encoded_values)
+    else:
+        for key,encoded_value in encoded_values.items():
+            pipeline.setex(key, encoded_value, ttl)
+    for key in values.keys():
+        pipeline.incr(GENERATION_PREFIX + key)
+    pipeline.execute()
+
+    local_cache = _get_local_cache()
+    for key in values.keys():
+        local_cache.delete(key)
+
+#############################################################################
+
+def add(key, value, ttl=None):
+    """ Set the given cache entry, but only if it doesn't already exist.
+
+        'key' must be a string, and 'value' can be any Python data structure
+        other than None.  If 'ttl' is supplied, the cache entry will expire
+        after this many seconds.
+
+        We return True if the cache entry was set, or False if it already
+        existed.  Because the check and the set are done atomically, this can
+        be used to make sure that only one process does a given piece of
+        work.
+    """
+    cache = _get_cache()
+
+    if ttl != None:
+        added = cache.execute_command("SET", PREFIX + key,
+                                      cacheCodecs.encode(value),
+                                      "EX", ttl, "NX")
+    else:
+        added = cache.setnx(PREFIX + key, cacheCodecs.encode(value))
+
+    if not added:
+        return False
+
+    cache.incr(GENERATION_PREFIX + key)
+    _get_local_cache().delete(key)
+    return True
+
+#############################################################################
+
+def incr(key, amount=1, persistent=False):
+    """ Atomically add the given amount to a counter in the data cache.
+
+        'key' is the key for the counter, and 'amount' is the (possibly
+        negative) integer amount to add.  If the counter doesn't exist, it is
+        created with an initial value of zero.  We return the new value of the
+        counter.
+
+        If 'persistent' is True, the counter is not removed when the cache is
+        flushed.  This is useful for version numbers, which must never go
+        backwards.
+
+        Note that counters are stored as plain integers rather than encoded
+        values, so they should only be accessed using incr(), incr_if_exists(),
+        get_counter() and set_counter().  Counters are never held in our local cache.
+    """
+    cache = _get_cache()
+    return cache.incr(_counter_key(key, persistent), amount)
+
+#############################################################################
+
+def get_counter(key, persistent=False):
+    """ Return the current value of the given counter.
+
+        'persistent' should be True if the counter was created as a persistent
+        counter by incr(), above.  If the counter doesn't exist, we return
+        None.
+    """
+    cache = _get_cache()
+
+    value = cache.get(_counter_key(key, persistent))
+    if value == None:
         return None
     else:
-        return pickle.loads(pickled_value)
+        return int(value)
+
+#############################################################################
+
+def set_counter(key, value, only_if_missing=False):
+    """ Set the given counter to the given integer value.
+
+        If 'only_if_missing' is True, the counter is only set if it doesn't
+        already exist.  We return True if the counter was set.
+    """
+    cache = _get_cache()
+    if only_if_missing:
+        return cache.setnx(_counter_key(key, False), int(value))
+    else:
+        cache.set(_counter_key(key, False), int(value))
+        return True
+
+#############################################################################
+
+def incr_if_exists(key, amount=1):
+    """ Atomically add the given amount to a counter, if the counter exists.
+
+        This works like incr(), above, except that the counter isn't created
+        if it doesn't already exist.  We return the new value of the counter,
+        or None if the counter doesn't exist.
+    """
+    cache = _get_cache()
+    return cache.eval(INCR_IF_EXISTS_SCRIPT, 1, _counter_key(key, False),
+                      int(amount))
+
+#############################################################################
+
+def incr_score(key, member, amount=1):
+    """ Add the given amount to a member's score in a scored set.
+
+        'key' is the key for the scored set, 'member' is the string to add the
+        amount to, and 'amount' is the amount to add.  If the member isn't
+        already in the set, it is added with an initial score of zero.
+
+        Note that, like counters, scored sets are never held in our local
+        cache, and should only be accessed using incr_score(),
+        decay_scores() and get_top_scores().
+    """
+    cache = _get_cache()
+    cache.zincrby(PREFIX + key, member, amount)
+
+#############################################################################
+
+def decay_scores(key, factor, max_members=None):
+    """ Scale down the scores in a scored set, and trim the set.
+
+        'key' is the key for the scored set, and 'factor' is the number to
+        multiply each member's score by.  If 'max_members' is supplied, the
+        members with the lowest scores are then removed so that the set holds
+        no more than this many members.
+    """
+    cache = _get_cache()
+
+    pipeline = cache.pipeline()
+    if factor != 1:
+        pipeline.zunionstore(PREFIX + key, {PREFIX + key : factor})
+    if max_members != None:
+        pipeline.zremrangebyrank(PREFIX + key, 0, -max_members - 1)
+    pipeline.execute()
+
+#############################################################################
+
+def get_top_scores(key, num_members):
+    """ Return the members with the highest scores in a scored set.
+
+        We return a list of up to 'num_members' (member, score) tuples, in
+        descending order of score.
+    """
+    cache = _get_cache()
+    return cache.zrevrange(PREFIX + key, 0, num_members - 1, withscores=True)
 
 #############################################################################
 
@@ -67,18 +394,74 @@ def delete(key):
     """ Delete the given entry from our data cache.
     """
     cache = _get_cache()
-    cache.delete(PREFIX + key)
+
+    pipeline = cache.pipeline()
+    pipeline.delete(PREFIX + key)
+    pipeline.incr(GENERATION_PREFIX + key)
+    pipeline.execute()
+
+    _get_local_cache().delete(key)
 
 #############################################################################
 
 def flush():
     """ Remove all entries from our data cache.
+
+        Rather than using the KEYS command, which blocks the Redis server
+        while it scans every key, we use SCAN to step through the keys in
+        batches, deleting each batch of matching keys as we go.  Once all the
+        entries have been removed, we increment the global generation number
+        so that every process discards its local copies of the entries.
     """
     cache = _get_cache()
-    keys = []
-    for key_name in cache.keys(PREFIX + "*"):
-        keys.append(key_name)
-    cache.delete(*keys)
+
+    cursor = "0"
+    while True:
+        cursor,keys = cache.execute_command("SCAN", cursor,
+                                            "MATCH", PREFIX + "*",
+                                            "COUNT", FLUSH_BATCH_SIZE)
+        if len(keys) > 0:
+            cache.delete(*keys)
+        if int(cursor) == 0:
+            break
+
+    cache.incr(GLOBAL_GENERATION_KEY)
+    _get_local_cache().clear()
+
+#############################################################################
+
+def get_stats():
+    """ Return statistics about the use of our local cache.
+
+        We return a dictionary with the following entries:
+
+            'hits'
+
+                The number of entries which were found in our local cache.
+
+            'misses'
+
+                The number of entries which had to be retrieved from Redis.
+
+            'size'
+
+                The number of entries currently held in our local cache.
+
+        Note that these statistics are for the current process only.
+    """
+    with _stats_lock:
+        return {'hits'   : _stats['hits'],
+                'misses' : _stats['misses'],
+                'size'   : len(_get_local_cache())}
+
+#############################################################################
+
+def reset_stats():
+    """ Reset the statistics returned by get_stats() back to zero.
+    """
+    with _stats_lock:
+        _stats['hits']   = 0
+        _stats['misses'] = 0
 
 #############################################################################
 #                                                                           #
@@ -89,14 +472,99 @@ def flush():
 def _get_cache():
     """ Return the redis.Redis object to use for accessing the Redis cache.
 
-        Note that we use a private global variable so that only one instance of
-        the redis cache object will be used per thread.
+        The redis.Redis object, and the connection pool it uses, is created
+        the first time it is needed and then shared by every thread in the
+        current process.  Note that the connection pool automatically discards
+        its connections if the process is forked.
     """
     global _redis_cache
 
-    try:
-        return _redis_cache
-    except NameError:
-        _redis_cache = redis.Redis(**settings.REDIS_CONFIG)
+    with _redis_lock:
+        if _redis_cache == None:
+            pool = redis.ConnectionPool(
+                            max_connections=settings.REDIS_MAX_CONNECTIONS,
+                            **settings.REDIS_CONFIG)
+            _redis_cache = redis.Redis(connection_pool=pool)
         return _redis_cache
 
+#############################################################################
+
+def _counter_key(key, persistent):
+    """ Return the Redis key used to store the given counter.
+    """
+    if persistent:
+        return PERSISTENT_PREFIX + key
+    else:
+        return PREFIX + key
+
+#############################################################################
+
+def _get_local_cache():
+    """ Return the LRUCache object holding our local copies of the entries.
+
+        Each entry in the local cache is a dictionary with the following
+        entries:
+
+            'value'
+
+                The value associated with this entry.
+
+            'generation'
+
+                A (key_generation, global_generation) tuple holding the
+                generation numbers for this entry when it was retrieved.
+
+            'check_at'
+
+                The time at which the entry should be checked against Redis.
+
+            'expires_at'
+
+                The time at which the entry expires in Redis.
+    """
+    global _local_cache
+
+    with _redis_lock:
+        if _local_cache == None:
+            _local_cache = LRUCache(settings.DATA_CACHE_L1_SIZE)
+        return _local_cache
+
+#############################################################################
+
+def _get_generations(keys):
+    """ Return the current generation numbers for the given entries.
+
+        We return a dictionary mapping each key to a (key_generation,
+        global_generation) tuple.  The generation numbers are retrieved using
+        a single pipelined request to Redis.
+    """
+    cache = _get_cache()
+
+    pipeline = cache.pipeline()
+    pipeline.mget([GENERATION_PREFIX + key for key in keys])
+    pipeline.get(GLOBAL_GENERATION_KEY)
+    key_generations,global_generation = pipeline.execute()
+
+    generations = {}
+    for key,key_generation in zip(keys, key_generations):
+        generations[key] = (key_generation, global_generation)
+    return generations
+
+#############################################################################
+
+def _record_stats(num_hits, num_misses):
+    """ Update our local cache statistics.
+    """
+    with _stats_lock:
+        _stats['hits']   = _stats['hits']   + num_hits
+        _stats['misses'] = _stats['misses'] + num_misses
+
+#############################################################################
+
+_redis_cache = None
+_local_cache = None
+_redis_lock  = threading.Lock()
+
+_stats       = {'hits' : 0, 'misses' : 0}
+_stats_lock  = threading.Lock()
+
@@ -38,6 +38,10 @@ def record(source, type, primary_value=None, secondary_value=None, text=None):
         monitoring API directly to do the work.  Otherwise, we send off an HTTP
         request to the monitoring API machine to record the event remotely.
 
+        Note that, depending on the EVENT_RECORDING_MODE setting, the
+        monitoring API may buffer the event and write it to the database
+        later on.  The event is still checked straight away.
+
         If an error occurred, we raise a suitable RuntimeError so that the
         caller will know that something went wrong.
     """
@@ -53,3 +57,29 @@ def record(source, type, primary_value=None, secondary_value=None, text=None):
         # request.
         raise RuntimeError("Remote event reporting is not implemented yet")
 
+
+#############################################################################
+
+def transaction_committed():
+    """ Tell the event recorder that the caller's transaction was committed.
+
+        Code which records events within a manually-managed transaction should
+        call this after committing the transaction, so that any changes which
+        depend on those events (such as the posting queue size) are applied.
+    """
+    if "dataCommons.monitoringAPI" in settings.INSTALLED_APPS:
+        from dataCommons.monitoringAPI import event_recorder
+        event_recorder.transaction_committed()
+
+#############################################################################
+
+def transaction_rolled_back():
+    """ Tell the event recorder that the caller's transaction was rolled back.
+
+        This is the counterpart to transaction_committed(), above, and should
+        be called after rolling back a transaction in which events may have
+        been recorded.
+    """
+    if "dataCommons.monitoringAPI" in settings.INSTALLED_APPS:
+        from dataCommons.monitoringAPI import event_recorder
+        event_recorder.transaction_rolled_back()
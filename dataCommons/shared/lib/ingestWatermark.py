@@ -0,0 +1,43 @@
+""" dataCommons.shared.lib.ingestWatermark
+
+    This module keeps track of the "ingest watermark": a number which is
+    incremented each time a batch of postings has been stored into the
+    database.
+
+    Caches of data calculated from the postings (such as the summarizer's
+    summary cache) can record the watermark at the time the data was
+    calculated.  If the watermark has since moved on, the cached data may be
+    out of date.
+"""
+from dataCommons.shared.lib import dataCache
+
+#############################################################################
+
+# The data cache key used to store the ingest watermark:
+
+WATERMARK_KEY = "ingest_watermark"
+
+#############################################################################
+
+def get():
+    """ Return the current ingest watermark.
+
+        We return the watermark as an integer.  Note that the watermark will be
+        zero if no postings have been stored since the data cache was last
+        flushed.
+    """
+    watermark = dataCache.get_counter(WATERMARK_KEY)
+    if watermark == None:
+        return 0
+    else:
+        return watermark
+
+#############################################################################
+
+def advance():
+    """ Tell everyone that a batch of postings has been stored.
+
+        We return the new value of the ingest watermark.
+    """
+    return dataCache.incr(WATERMARK_KEY)
+
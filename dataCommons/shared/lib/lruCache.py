@@ -0,0 +1,80 @@
+""" dataCommons.shared.lib.lruCache
+
+    This module implements a simple in-memory cache with a bounded size.  When
+    the cache is full, the least recently used entry is discarded to make room
+    for the new one.
+
+    The LRU cache is used to keep frequently-used values within the current
+    process, so that we don't have to retrieve them from Redis or the database
+    each time they are needed.  Note that the cache is thread-safe.
+"""
+import collections
+import threading
+
+#############################################################################
+
+class LRUCache:
+    """ A bounded in-memory cache with a least-recently-used eviction policy.
+    """
+    def __init__(self, max_size):
+        """ Standard initialiser.
+
+            'max_size' is the maximum number of entries to hold in the cache.
+        """
+        self._max_size = max_size
+        self._entries  = collections.OrderedDict()
+        self._lock     = threading.Lock()
+
+
+    def get(self, key, default=None):
+        """ Return the value associated with the given key.
+
+            If there is no entry in the cache for the given key, we return the
+            given default value.
+        """
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                return default
+            self._entries[key] = value # Move to most-recently-used position.
+            return value
+
+
+    def set(self, key, value):
+        """ Associate the given value with the given key.
+
+            If the cache is full, we discard the least recently used entry.
+        """
+        with self._lock:
+            try:
+                del self._entries[key]
+            except KeyError:
+                pass
+            self._entries[key] = value
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+
+    def delete(self, key):
+        """ Remove the given entry from the cache, if it exists.
+        """
+        with self._lock:
+            try:
+                del self._entries[key]
+            except KeyError:
+                pass
+
+
+    def clear(self):
+        """ Remove all entries from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+    def __len__(self):
+        """ Return the number of entries currently in the cache.
+        """
+        return len(self._entries)
+
@@ -0,0 +1,198 @@
+""" dataCommons.shared.lib.postingCounts
+
+    This module maintains the posting counts: a pre-aggregated summary of the
+    Posting table, held in the PostingCount table, which holds the number of
+    postings for each combination of hour, category, category group, source,
+    location, deleted status and image status.
+
+    The posting counts are kept up to date by the bulk ingest engine, which
+    calls record_changes() with the attributes of each posting before and
+    after the postings were stored.  The changes for an entire batch of
+    postings are applied using two set-based SQL statements: an UPDATE for the
+    posting counts which already exist, and an INSERT for the new ones.
+
+    The Summarizer API uses the posting counts, rather than scanning through
+    every matching posting, whenever the search criteria only refer to the
+    attributes held in the posting counts.
+"""
+import logging
+
+from django.conf import settings
+from django.db   import connection
+
+from dataCommons.shared.models import *
+
+#############################################################################
+
+# The columns in the PostingCount table which hold the attributes of the
+# counted postings, in addition to the hour.  Each of these has the same
+# name as the equivalent column in the Posting table.
+
+ATTRIBUTE_COLUMNS = ["category_id", "category_group_id", "source_id",
+                     "location_country_id", "location_state_id",
+                     "location_metro_id", "location_region_id",
+                     "location_county_id", "location_city_id",
+                     "location_locality_id", "location_zipcode_id",
+                     "status_deleted", "has_image"]
+
+# The columns which can be NULL:
+
+NULLABLE_COLUMNS = ["location_country_id", "location_state_id",
+                    "location_metro_id", "location_region_id",
+                    "location_county_id", "location_city_id",
+                    "location_locality_id", "location_zipcode_id"]
+
+# The Postgres type of each column, used when passing the changes to the
+# database:
+
+COLUMN_TYPES = {"status_deleted" : "boolean",
+                "has_image"      : "boolean"}
+
+# The search criteria which can be answered using the posting counts:
+
+CRITERIA = ["category_group", "category", "source", "country", "state",
+            "metro", "region", "county", "city", "locality", "zipcode",
+            "timestamp", "has_image", "include_deleted"]
+
+#############################################################################
+
+logger = logging.getLogger(__name__)
+
+#############################################################################
+
+def select_list(table):
+    """ Return the SQL to select a posting's counted attributes.
+
+        'table' is the name or alias of the Posting table in the SQL
+        statement.  We return a string which can be used in a SELECT or
+        RETURNING clause to retrieve the hour and attributes for each posting,
+        in the order expected by record_changes().
+    """
+    columns = ["date_trunc('hour', %s.\"timestamp\")" % table]
+    for column in ATTRIBUTE_COLUMNS:
+        columns.append('%s."%s"' % (table, column))
+    return ", ".join(columns)
+
+#############################################################################
+
+def record_changes(removed, added):
+    """ Update the posting counts to reflect a change to the postings.
+
+        'removed' is a list of the postings which have been removed or changed,
+        and 'added' is a list of the postings which have been added or changed.
+        Each posting is represented by a tuple holding the posting's hour and
+        attributes, as selected using select_list().  For changed postings,
+        'removed' should hold the posting's old attributes and 'added' its new
+        attributes.
+
+        We calculate the net change for each combination of hour and
+        attributes, and apply these changes to the PostingCount table.  Note
+        that this must be called from within a managed transaction.  If
+        another process adds the same posting count at the same time, we raise
+        an IntegrityError.
+
+        To avoid deadlocks between ingest processes updating the same posting
+        counts, the existing posting counts are locked in order of their
+        record ID before they are changed, and new posting counts are
+        inserted in a fixed order.
+    """
+    changes = {} # Maps (hour, attributes...) tuple to change in count.
+    for row in removed:
+        changes[tuple(row)] = changes.get(tuple(row), 0) - 1
+    for row in added:
+        changes[tuple(row)] = changes.get(tuple(row), 0) + 1
+
+    values = []
+    params = []
+    for row,change in sorted(changes.items()):
+        if change == 0: continue
+        placeholders = ["%s::timestamp with time zone"]
+        for column in ATTRIBUTE_COLUMNS:
+            placeholders.append("%%s::%s" % COLUMN_TYPES.get(column,
+                                                              "integer"))
+        placeholders.append("%s::integer")
+        values.append("(" + ", ".join(placeholders) + ")")
+        params.extend(row)
+        params.append(change)
+
+    if len(values) == 0:
+        return
+
+    columns = ["hour"] + ATTRIBUTE_COLUMNS
+    changes_table = "(VALUES " + ", ".join(values) + ") " + \
+                    "AS d(" + ", ".join(columns + ["change"]) + ")"
+
+    matches = []
+    for column in columns:
+        if column in NULLABLE_COLUMNS:
+            matches.append("COALESCE(c.%s, 0)=COALESCE(d.%s, 0)"
+                           % (column, column))
+        else:
+            matches.append("c.%s=d.%s" % (column, column))
+    match = " AND ".join(matches)
+
+    cursor = connection.cursor()
+    cursor.execute("SELECT c.id FROM shared_postingcount c, " +
+                   changes_table + " WHERE " + match + " " +
+                   "ORDER BY c.id FOR UPDATE OF c",
+                   params)
+    cursor.execute("UPDATE shared_postingcount c " +
+                   "SET count=c.count+d.change " +
+                   "FROM " + changes_table + " WHERE " + match,
+                   params)
+    cursor.execute("INSERT INTO shared_postingcount " +
+                   "(" + ", ".join(columns) + ", count) " +
+                   "SELECT d.* FROM " + changes_table + " " +
+                   "WHERE NOT EXISTS (SELECT 1 FROM shared_postingcount c " +
+                   "WHERE " + match + ") " +
+                   "ORDER BY " + ", ".join(["d." + column
+                                            for column in columns]),
+                   params)
+
+#############################################################################
+
+def can_answer(criteria):
+    """ Return True if the posting counts can be used for the given criteria.
+
+        'criteria' is a dictionary containing the supplied search criteria.
+        We return True if the posting counts are enabled, and the criteria
+        only refer to attributes held in the posting counts.
+    """
+    if not settings.ENABLE_POSTING_COUNTS:
+        return False
+
+    for name in criteria.keys():
+        if name not in CRITERIA:
+            return False
+    return True
+
+#############################################################################
+
+def rebuild():
+    """ Delete all the posting counts, and recalculate them from scratch.
+
+        Note that this must be called from within a managed transaction.  To
+        ensure that no postings are missed, the Posting table is locked
+        against changes until the transaction is committed.
+    """
+    columns = ", ".join(["hour"] + ATTRIBUTE_COLUMNS)
+
+    cursor = connection.cursor()
+    cursor.execute("LOCK TABLE shared_posting IN SHARE MODE")
+    cursor.execute("DELETE FROM shared_postingcount")
+    cursor.execute("INSERT INTO shared_postingcount " +
+                   "(" + columns + ", count) " +
+                   "SELECT " + select_list("p") + ", COUNT(*) " +
+                   "FROM shared_posting p " +
+                   "GROUP BY " + ", ".join([str(i+1) for i in
+                                     range(len(ATTRIBUTE_COLUMNS) + 1)]))
+
+    logger.debug("Rebuilt posting counts")
+
+#############################################################################
+
+def clear():
+    """ Delete all the posting counts.
+    """
+    PostingCount.objects.all().delete()
+
@@ -0,0 +1,242 @@
+""" dataCommons.shared.lib.referenceRegistry
+
+    This module implements an in-process registry of the reference data used
+    throughout the Data Commons system: the data sources, categories, category
+    groups and locations.
+
+    The registry lets the caller translate a 3taps code into the record ID for
+    that code, and a record ID back into its code, without going to the
+    database or unpickling a large dictionary from Redis each time.  Each
+    table in the registry is loaded from the database the first time it is
+    used, and then kept in memory for the life of the current process.
+
+    To ensure that every process sees changes to the reference data, a version
+    number is stored in the data cache as a persistent counter, so that it
+    keeps increasing even when the data cache is flushed.  Whenever the
+    reference data is changed (for example, by the "load_fixtures" management
+    command), the version number should be bumped by calling bump_version().
+    Each process checks the version number at most once every
+    VERSION_CHECK_INTERVAL seconds, and discards its tables if the reference
+    data has changed.
+"""
+import logging
+import threading
+import time
+
+from dataCommons.shared.models import *
+from dataCommons.shared.lib    import dataCache
+
+#############################################################################
+
+# The data cache key used to store the version number of the reference data:
+
+VERSION_KEY = "reference_data_version"
+
+# The number of seconds between checks of the reference data version number:
+
+VERSION_CHECK_INTERVAL = 60
+
+# The various kinds of reference data we support.  For each kind, we store the
+# model class and, for locations, the level of the locations of that kind:
+
+KINDS = {
+    'source'         : (Source,        None),
+    'category'       : (Category,      None),
+    'category_group' : (CategoryGroup, None),
+    'country'        : (Location,      Location.LEVEL_COUNTRY),
+    'state'          : (Location,      Location.LEVEL_STATE),
+    'metro'          : (Location,      Location.LEVEL_METRO),
+    'region'         : (Location,      Location.LEVEL_REGION),
+    'county'         : (Location,      Location.LEVEL_COUNTY),
+    'city'           : (Location,      Location.LEVEL_CITY),
+    'locality'       : (Location,      Location.LEVEL_LOCALITY),
+    'zipcode'        : (Location,      Location.LEVEL_ZIPCODE),
+}
+
+# The kinds of reference data which refer to Location records:
+
+LOCATION_KINDS = ["country", "state", "metro", "region", "county", "city",
+                  "locality", "zipcode"]
+
+#############################################################################
+
+logger = logging.getLogger(__name__)
+
+#############################################################################
+
+def get_ids(kind):
+    """ Return a dictionary mapping codes to record IDs.
+
+        'kind' is the kind of reference data to return, as listed in KINDS,
+        above.  We return a dictionary mapping each code (in uppercase) to the
+        record ID for that code.  The returned dictionary must not be
+        modified.
+    """
+    return _get_table(kind + "_ids")
+
+#############################################################################
+
+def get_id(kind, code):
+    """ Return the record ID for the given code.
+
+        'kind' is the kind of reference data to look up, as listed in KINDS,
+        above, and 'code' is the 3taps code to look up.  Note that codes are
+        not case sensitive.  We return the record ID for the given code, or
+        None if there is no such code.
+    """
+    return get_ids(kind).get(code.upper())
+
+#############################################################################
+
+def get_codes(kind):
+    """ Return a dictionary mapping record IDs to codes.
+
+        'kind' is the kind of reference data to return, as listed in KINDS,
+        above, or "location" for all locations.  We return a dictionary
+        mapping each record ID to the code for that record.  Note that, for
+        locations, the returned dictionary includes the locations at every
+        level.  The returned dictionary must not be modified.
+    """
+    if kind == "location" or kind in LOCATION_KINDS:
+        return _get_table("location_codes")
+    else:
+        return _get_table(kind + "_codes")
+
+#############################################################################
+
+def get_code(kind, record_id):
+    """ Return the code for the given record ID.
+
+        'kind' is the kind of reference data to look up, as listed in KINDS,
+        above, and 'record_id' is the record ID to look up.  We return the code
+        for the given record, or None if there is no such record.
+    """
+    return get_codes(kind).get(record_id)
+
+#############################################################################
+
+def get_category_groups():
+    """ Return a dictionary mapping category IDs to category group IDs.
+
+        We return a dictionary mapping the record ID of each category to the
+        record ID of the category group that category belongs to.  The
+        returned dictionary must not be modified.
+    """
+    return _get_table("category_groups")
+
+#############################################################################
+
+def get_version():
+    """ Return the current version number of the reference data.
+
+        This can be used by other in-process caches which depend on the
+        reference data, to tell when they need to be rebuilt.  Note that the
+        version number may be None if the reference data has never been
+        changed.
+    """
+    return dataCache.get_counter(VERSION_KEY, persistent=True)
+
+#############################################################################
+
+def bump_version():
+    """ Tell every process that the reference data has changed.
+
+        This should be called whenever the sources, categories, category
+        groups or locations have been changed.  Each process will reload its
+        reference data the next time it is used.
+    """
+    dataCache.incr(VERSION_KEY, persistent=True)
+    clear()
+
+#############################################################################
+
+def clear():
+    """ Discard the reference data loaded into the current process.
+    """
+    global _tables, _version, _checked_at
+
+    with _lock:
+        _tables     = {}
+        _version    = None
+        _checked_at = 0
+
+#############################################################################
+#                                                                           #
+#                    P R I V A T E   D E F I N I T I O N S                  #
+#                                                                           #
+#############################################################################
+
+def _get_table(name):
+    """ Return the table with the given name, loading it if necessary.
+
+        If VERSION_CHECK_INTERVAL seconds have passed since we last did so,
+        we check the version number of the reference data, discarding our
+        tables if the version has changed.  We then return the given table,
+        loading it from the database if it isn't already in memory.
+    """
+    global _tables, _version, _checked_at
+
+    with _lock:
+        if time.time() - _checked_at >= VERSION_CHECK_INTERVAL:
+            try:
+                version = dataCache.get_counter(VERSION_KEY, persistent=True)
+            except:
+                # If we can't read the version number, keep using our
+                # existing tables rather than failing the request.
+                logger.exception("Unable to read the reference data version")
+                version = _version
+
+            if version != _version:
+                _tables  = {}
+                _version = version
+            _checked_at = time.time()
+
+        table = _tables.get(name)
+        if table == None:
+            table = _load_table(name)
+            _tables[name] = table
+
+    return table
+
+#############################################################################
+
+def _load_table(name):
+    """ Load the given table from the database.
+
+        We return a dictionary holding the contents of the given table.
+    """
+    table = {}
+
+    if name == "category_groups":
+        for category_id,group_id in Category.objects.values_list("id",
+                                                                 "group"):
+            table[category_id] = group_id
+    elif name == "location_codes":
+        for record_id,code in Location.objects.values_list("id", "code"):
+            table[record_id] = code
+    elif name.endswith("_codes"):
+        model,level = KINDS[name[:-len("_codes")]]
+        for record_id,code in model.objects.values_list("id", "code"):
+            table[record_id] = code
+    elif name.endswith("_ids"):
+        model,level = KINDS[name[:-len("_ids")]]
+        query = model.objects.all()
+        if level != None:
+            query = query.filter(level=level)
+        for record_id,code in query.values_list("id", "code"):
+            table[code.upper()] = record_id
+
+    logger.debug("Loaded reference data table %s" % name)
+    return table
+
+#############################################################################
+
+# Our in-memory tables, keyed by table name, along with the version number of
+# the reference data they were loaded from and the time at which we last
+# checked the version number:
+
+_tables     = {}
+_version    = None
+_checked_at = 0
+_lock       = threading.Lock()
+
@@ -200,6 +200,28 @@ def calc_timeframe(timeframe):
 
 #############################################################################
 
+def percentile(percent):
+    """ Return a value combiner which calculates the given percentile.
+
+        'percent' should be a number between 0 and 100.  We return a function
+        which can be passed to DataReducer.set_value_combiner(), below, to
+        combine the values in each bucket by taking the given percentile of
+        those values.  For example, percentile(95) will return the 95th
+        percentile value in each bucket.
+
+        Note that we use the "nearest rank" method to calculate the
+        percentile, so the returned value will always be one of the values in
+        the bucket.
+    """
+    def combiner(values):
+        values = sorted(values)
+        rank = int(math.ceil(percent / 100.0 * len(values)))
+        return values[max(rank, 1) - 1]
+
+    return combiner
+
+#############################################################################
+
 class DataReducer:
     """ Helper class to reduce the number of data points in a time-based chart.
 
@@ -208,17 +230,26 @@ class DataReducer:
         small enough, each bucket corresponds to a single second.  Otherwise,
         the bucket size is increased to keep the total number of data points to
         a given limit.
+
+        Note that the bucket for a given data point is calculated directly from
+        the data point's timestamp, and buckets are only created when a data
+        point is added to them.  For the built-in value combiners, each bucket
+        keeps a running total rather than a list of values, so the amount of
+        memory used depends on the number of data points in the report, not on
+        the length of the report's timeframe.
     """
     def __init__(self):
         """ Standard initialiser.
         """
         self._max_num_data_points = 1000
-        self._value_combiner      = sum
+        self._value_combiner      = "sum"
         self._start_time          = None
         self._end_time            = None
         self._is_setup            = False
-        self._seconds_to_bucket   = {} # Maps int unix time to _buckets index.
-        self._buckets             = []
+        self._start_secs          = None
+        self._end_secs            = None
+        self._secs_per_bucket     = None
+        self._buckets             = {} # Maps bucket index to bucket value.
 
         if DISABLE_DATA_REDUCER:
             self._data = [] # For testing.
@@ -249,21 +280,43 @@ class DataReducer:
     def set_value_combiner(self, value_combiner):
         """ Set the function to use to combine two or more data points.
 
-            'value_combiner' should be a Python callable object that takes a
-            list of values and returns the value to use for the bucket that
-            contains those values.  The following built-in functions can be
-            used to perform simple data reductions:
+            'value_combiner' should be one of the following strings, which
+            select one of the built-in value combiners:
+
+                "sum"
+                "min"
+                "max"
+                "mean"
+                "count"
 
-                sum
-                min
-                max
+            The built-in sum(), min() and max() functions can also be passed
+            directly, and are treated in the same way as the associated string.
 
-            If you need a more sophisticated value reducer, simply define your
-            own function and pass it instead.
+            Alternatively, 'value_combiner' can be any Python callable object
+            that takes a list of values and returns the value to use for the
+            bucket that contains those values.  The percentile() function,
+            above, can be used to create a value combiner which calculates a
+            given percentile.  Note that custom value combiners have to keep
+            every value in memory until the reduced data is calculated.
 
             If you do not set an explicit value combiner, the data reducer will
-            use the built-in sum() function.
+            sum the values in each bucket.
         """
+        if value_combiner == sum:
+            value_combiner = "sum"
+        elif value_combiner == min:
+            value_combiner = "min"
+        elif value_combiner == max:
+            value_combiner = "max"
+
+        if isinstance(value_combiner, basestring):
+            if value_combiner not in ["sum", "min", "max", "mean", "count"]:
+                raise RuntimeError("Unknown value combiner: " +
+                                   repr(value_combiner))
+        elif not callable(value_combiner):
+            raise RuntimeError("Value combiner must be a string or a " +
+                               "callable object")
+
         self._value_combiner = value_combiner
 
 
@@ -276,21 +329,71 @@ class DataReducer:
 
             We add the given data point to the report.
         """
+        self.add_many([(timestamp, value)])
+
+
+    def add_many(self, data_points):
+        """ Add a number of data points to the report at once.
+
+            'data_points' should be a sequence or iterator of (timestamp,
+            value) tuples, where 'timestamp' is a datetime.datetime object and
+            'value' is the value to associate with that point in time.  This
+            can be the result of calling values_list() on a Django QuerySet,
+            for example:
+
+                reducer.add_many(query.values_list("timestamp", "value"))
+
+            We add each of the given data points to the report.  Note that the
+            data points are processed one at a time, so they don't all have to
+            be held in memory at once.
+        """
         if DISABLE_DATA_REDUCER:
-            self._data.append((timestamp, timestamp, value))
-        else:
-            if not self._is_setup:
-                self._setup()
-                self._is_setup = True
+            for timestamp,value in data_points:
+                self._data.append((timestamp, timestamp, value))
+            return
 
-            seconds = datetime_to_seconds(timestamp)
+        if not self._is_setup:
+            self._setup()
+            self._is_setup = True
 
-            try:
-                bucket_num = self._seconds_to_bucket[seconds]
-            except KeyError:
+        start_secs      = self._start_secs
+        end_secs        = self._end_secs
+        secs_per_bucket = self._secs_per_bucket
+        buckets         = self._buckets
+        combiner        = self._value_combiner
+
+        for timestamp,value in data_points:
+            seconds = datetime_to_seconds(timestamp)
+            if seconds < start_secs or seconds > end_secs:
                 raise RuntimeError("timestamp outside report period!")
 
-            self._buckets[bucket_num]['values'].append(value)
+            bucket_num = (seconds - start_secs) // secs_per_bucket
+
+            if bucket_num not in buckets:
+                if combiner == "count":
+                    buckets[bucket_num] = 1
+                elif combiner == "mean":
+                    buckets[bucket_num] = [value, 1]
+                elif callable(combiner):
+                    buckets[bucket_num] = [value]
+                else:
+                    buckets[bucket_num] = value
+            elif combiner == "sum":
+                buckets[bucket_num] = buckets[bucket_num] + value
+            elif combiner == "min":
+                if value < buckets[bucket_num]:
+                    buckets[bucket_num] = value
+            elif combiner == "max":
+                if value > buckets[bucket_num]:
+                    buckets[bucket_num] = value
+            elif combiner == "count":
+                buckets[bucket_num] = buckets[bucket_num] + 1
+            elif combiner == "mean":
+                totals = buckets[bucket_num]
+                totals[0] = totals[0] + value
+                totals[1] = totals[1] + 1
+            else:
+                buckets[bucket_num].append(value)
 
 
     def get_reduced_data(self):
@@ -307,21 +410,33 @@ class DataReducer:
         if DISABLE_DATA_REDUCER:
             self._data.sort()
             return self._data
-        else:
-            results = []
-            for bucket in self._buckets:
-                if len(bucket['values']) == 0:
-                    continue # Skip empty buckets.
-                elif len(bucket['values']) == 1:
-                    results.append((bucket['start'],
-                                    bucket['end'],
-                                    bucket['values'][0]))
+
+        combiner = self._value_combiner
+
+        results = []
+        for bucket_num in sorted(self._buckets.keys()):
+            value = self._buckets[bucket_num]
+
+            if combiner == "mean":
+                tot_value,num_values = value
+                if num_values == 1:
+                    value = tot_value
                 else:
-                    combined_value = self._value_combiner(bucket['values'])
-                    results.append((bucket['start'],
-                                    bucket['end'],
-                                    combined_value))
-            return results
+                    value = float(tot_value) / num_values
+            elif callable(combiner):
+                if len(value) == 1:
+                    value = value[0]
+                else:
+                    value = combiner(value)
+
+            bucket_start_secs = self._start_secs \
+                              + bucket_num * self._secs_per_bucket
+            bucket_end_secs   = bucket_start_secs + self._secs_per_bucket - 1
+
+            results.append((dateHelpers.datetime_in_utc(bucket_start_secs),
+                            dateHelpers.datetime_in_utc(bucket_end_secs),
+                            value))
+        return results
 
     # =====================
     # == PRIVATE METHODS ==
@@ -330,8 +445,8 @@ class DataReducer:
     def _setup(self):
         """ Setup the data reducer.
 
-            This is called the first time the add() method is called.  We set
-            up the internal data structures used by the data reducer.
+            This is called the first time a data point is added.  We calculate
+            the number of seconds covered by each bucket.
 
             Note that if something is wrong (eg, no time period was specified),
             we raise a suitable RuntimeError.
@@ -341,37 +456,14 @@ class DataReducer:
 
         # Calculate the total number of seconds in the reporting time period.
 
-        start_secs   = datetime_to_seconds(self._start_time)
-        end_secs     = datetime_to_seconds(self._end_time)
-        tot_num_secs = end_secs - start_secs + 1
-
-        # Calculate how many buckets we need, and how many seconds are covered
-        # by each bucket.
-
-        num_buckets     = tot_num_secs # initially.
-        secs_per_bucket = 1
-
-        while num_buckets > self._max_num_data_points:
-            secs_per_bucket = secs_per_bucket + 1
-            num_buckets     = int(math.ceil(tot_num_secs / secs_per_bucket))
-
-        # Setup the mapping from seconds to bucket indexes.
-
-        for cur_secs in range(start_secs, end_secs+1):
-            bucket_index = int(float(cur_secs-start_secs) /
-                               float(secs_per_bucket))
-            self._seconds_to_bucket[cur_secs] = bucket_index
-
-        # Finally, setup the list of buckets.
-
-        for bucket_num in range(num_buckets):
-            bucket_start_secs = start_secs + bucket_num * secs_per_bucket
-            bucket_end_secs   = bucket_start_secs + secs_per_bucket - 1
-
-            bucket_start = dateHelpers.datetime_in_utc(bucket_start_secs)
-            bucket_end   = dateHelpers.datetime_in_utc(bucket_end_secs)
+        self._start_secs = datetime_to_seconds(self._start_time)
+        self._end_secs   = datetime_to_seconds(self._end_time)
+        tot_num_secs     = self._end_secs - self._start_secs + 1
 
-            self._buckets.append({'start'  : bucket_start,
-                                  'end'    : bucket_end,
-                                  'values' : []})
+        # Calculate how many seconds are covered by each bucket.  This is the
+        # smallest whole number of seconds which keeps the number of buckets
+        # within our maximum number of data points.
 
+        max_num_buckets = max(self._max_num_data_points, 1)
+        self._secs_per_bucket = max(1, int(math.ceil(float(tot_num_secs) /
+                                                     max_num_buckets)))
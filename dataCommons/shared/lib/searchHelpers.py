@@ -8,6 +8,7 @@ import logging
 from dataCommons.shared.models import *
 from django.db.models          import Q
 from dataCommons.shared.lib    import dateHelpers, annotationParser
+from dataCommons.shared.lib    import referenceRegistry
 
 #############################################################################
 
@@ -59,109 +60,57 @@ def add_heading_or_body_search(query, text):
 
 #############################################################################
 
-def build_search_query(criteria):
+def build_search_query(criteria, model=Posting):
     """ Build and return a QuerySet object based on the given search criteria.
 
         We construct a search query that will search against the given set of
         search criteria.
 
+        By default, the query searches the Posting table.  If 'model' is
+        supplied, the query searches that model instead; this is used to
+        search the PostingCount table, which shares the Posting table's field
+        names for the location, category, source, image and deleted status
+        criteria.
+
         Upon completion, we return a (success, result) tuple, where 'success'
         is True if and only if we could build a search query out of the given
         search criteria.  If 'success' is True, 'result' will be the QuerySet
         object we created.  Otherwise, 'result' will be a string explaining why
         we couldn't construct the query set.
     """
-    query = Posting.objects.all() # initially.
+    query = model.objects.all() # initially.
 
     # Append locations filters.
 
-    if "country" in criteria:
-        try:
-            country = Location.objects.get(code=criteria['country'],
-                                           level=Location.LEVEL_COUNTRY)
-        except Location.DoesNotExist:
-            return (False, "Unknown country: " + criteria['country'])
-        query = query.filter(location_country=country)
-
-    if "state" in criteria:
-        try:
-            state = Location.objects.get(code=criteria['state'],
-                                         level=Location.LEVEL_STATE)
-        except Location.DoesNotExist:
-            return (False, "Unknown state: " + criteria['state'])
-        query = query.filter(location_state=state)
-
-    if "metro" in criteria:
-        try:
-            metro = Location.objects.get(code=criteria['metro'],
-                                         level=Location.LEVEL_METRO)
-        except Location.DoesNotExist:
-            return (False, "Unknown metro: " + criteria['metro'])
-        query = query.filter(location_metro=metro)
-
-    if "region" in criteria:
-        try:
-            region = Location.objects.get(code=criteria['region'],
-                                          level=Location.LEVEL_REGION)
-        except Location.DoesNotExist:
-            return (False, "Unknown region: " + criteria['region'])
-        query = query.filter(location_region=region)
-
-    if "county" in criteria:
-        try:
-            county = Location.objects.get(code=criteria['county'],
-                                          level=Location.LEVEL_COUNTY)
-        except Location.DoesNotExist:
-            return (False, "Unknown county: " + criteria['county'])
-        query = query.filter(location_county=county)
-
-    if "city" in criteria:
-        try:
-            city = Location.objects.get(code=criteria['city'],
-                                        level=Location.LEVEL_CITY)
-        except Location.DoesNotExist:
-            return (False, "Unknown city: " + criteria['city'])
-        query = query.filter(location_city=city)
-
-    if "locality" in criteria:
-        try:
-            locality = Location.objects.get(code=criteria['locality'],
-                                            level=Location.LEVEL_LOCALITY)
-        except Location.DoesNotExist:
-            return (False, "Unknown locality: " + criteria['locality'])
-        query = query.filter(location_locality=locality)
-
-    if "zipcode" in criteria:
-        try:
-            zipcode = Location.objects.get(code=criteria['zipcode'],
-                                           level=Location.LEVEL_ZIPCODE)
-        except Location.DoesNotExist:
-            return (False, "Unknown zipcode: " + criteria['zipcode'])
-        query = query.filter(location_zipcode=zipcode)
+    for level in referenceRegistry.LOCATION_KINDS:
+        if level in criteria:
+            location_id = referenceRegistry.get_id(level, criteria[level])
+            if location_id == None:
+                return (False, "Unknown " + level + ": " + criteria[level])
+            query = query.filter(**{"location_" + level : location_id})
 
     # Append other filters.
 
     if "category_group" in criteria:
-        try:
-            group = CategoryGroup.objects.get(code=criteria['category_group'])
-        except CategoryGroup.DoesNotExist:
+        group_id = referenceRegistry.get_id("category_group",
+                                            criteria['category_group'])
+        if group_id == None:
             return (False,
                     "Unknown category group: " + criteria['category_group'])
-        query = query.filter(category_group=group)
+        query = query.filter(category_group=group_id)
 
     if "category" in criteria:
-        try:
-            category = Category.objects.get(code=criteria['category'])
-        except Category.DoesNotExist:
+        category_id = referenceRegistry.get_id("category",
+                                               criteria['category'])
+        if category_id == None:
             return (False, "Unknown category: " + criteria['category'])
-        query = query.filter(category=category)
+        query = query.filter(category=category_id)
 
     if "source" in criteria:
-        try:
-            source = Source.objects.get(code=criteria['source'])
-        except Source.DoesNotExist:
+        source_id = referenceRegistry.get_id("source", criteria['source'])
+        if source_id == None:
             return (False, "Unknown source: " + criteria['source'])
-        query = query.filter(source=source)
+        query = query.filter(source=source_id)
 
     if "external_id" in criteria:
         query = query.filter(external_id=criteria['external_id'])
@@ -7,6 +7,8 @@
 from django.core.management.base import BaseCommand, CommandError
 
 from dataCommons.shared.models import *
+from dataCommons.shared.lib    import dataCache, annotationInterner
+from dataCommons.shared.lib    import postingCounts
 
 #############################################################################
 
@@ -23,5 +25,11 @@ class Command(BaseCommand):
         ImageReference.objects.all().delete()
         PostingAnnotation.objects.all().delete()
         Posting.objects.all().delete()
+        postingCounts.clear()
         Annotation.objects.all().delete()
 
+        # Remove the cached annotation IDs, as these are no longer valid.
+
+        dataCache.flush()
+        annotationInterner.clear_cache()
+
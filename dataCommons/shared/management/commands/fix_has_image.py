@@ -3,11 +3,16 @@
     This module defines the "fix_has_image" management command used by the Data
     Commons system.  Running this command sets the "has_image" field for each
     posting to the appropriate value.
+
+    As the posting counts used by the Summarizer API are broken down by
+    "has_image", these are rebuilt within the same transaction so that they
+    always match the updated postings.
 """
 from django.core.management.base import BaseCommand, CommandError
 from django.db import connection, transaction
 
 from dataCommons.shared.models import *
+from dataCommons.shared.lib    import postingCounts
 
 #############################################################################
 
@@ -28,19 +33,25 @@ class Command(BaseCommand):
         cursor.execute("DROP INDEX shared_posting_has_image")
         transaction.commit_unless_managed()
 
-        self.stdout.write("Setting 'has_image' to False...\n")
+        with transaction.commit_on_success():
+            self.stdout.write("Setting 'has_image' to False...\n")
+
+            Posting.objects.all().update(has_image=False) # initially.
+
+            self.stdout.write("Gathering postings with images...\n")
 
-        Posting.objects.all().update(has_image=False) # initially.
+            all_image_refs       = ImageReference.objects.all()
+            postings_with_images = Posting.objects.filter(
+                                        imagereference__in=all_image_refs)
 
-        self.stdout.write("Gathering postings with images...\n")
+            self.stdout.write("Updating 'has_image' for postings with " +
+                              "images...\n")
 
-        all_image_refs       = ImageReference.objects.all()
-        postings_with_images = Posting.objects.filter(
-                                    imagereference__in=all_image_refs)
+            postings_with_images.update(has_image=True)
 
-        self.stdout.write("Updating 'has_image' for postings with images...\n")
+            self.stdout.write("Rebuilding posting counts...\n")
 
-        postings_with_images.update(has_image=True)
+            postingCounts.rebuild()
 
         self.stdout.write("Recreating 'has_index' index...\n")
 
@@ -2,11 +2,12 @@
 
     This module defines the "flush_cache" management command used by the Data
     Commons system.  Running this command flushes the internal Redis caches
-    used by the DataCache module.
+    used by the DataCache module, and tells every process to reload its
+    reference data.
 """
 from django.core.management.base import BaseCommand, CommandError
 
-from dataCommons.shared.lib import dataCache
+from dataCommons.shared.lib import dataCache, referenceRegistry
 
 #############################################################################
 
@@ -22,3 +23,8 @@ class Command(BaseCommand):
 
         dataCache.flush()
 
+        # The reference data version isn't removed by the flush, so bump it to
+        # make the running processes reload their reference data.
+
+        referenceRegistry.bump_version()
+
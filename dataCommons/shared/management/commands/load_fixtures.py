@@ -7,7 +7,7 @@
 from django.core.management.base import BaseCommand, CommandError
 from django.core.management      import call_command
 
-from dataCommons.shared.lib import dataCache
+from dataCommons.shared.lib import referenceRegistry
 
 #############################################################################
 
@@ -35,3 +35,7 @@ class Command(BaseCommand):
             self.stdout.write("Loading data from " + fixture + "\n")
             call_command("loaddata", fixture)
 
+        # Tell the running processes that the reference data has changed.
+
+        referenceRegistry.bump_version()
+
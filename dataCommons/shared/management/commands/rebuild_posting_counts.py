@@ -0,0 +1,29 @@
+""" dataCommons.shared.management.commands.rebuild_posting_counts
+
+    This module defines the "rebuild_posting_counts" management command used by
+    the Data Commons system.  Running this command recalculates the posting
+    counts used by the Summarizer API from the postings in the database.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from dataCommons.shared.lib import postingCounts
+
+#############################################################################
+
+class Command(BaseCommand):
+    """ Our "rebuild_posting_counts" management command.
+    """
+    args = 'none'
+    help = 'Recalculates the posting counts from the postings.'
+
+    def handle(self, *args, **kwargs):
+        if len(args) > 0:
+            raise CommandError("This command doesn't take any parameters.")
+
+        self.stdout.write("Rebuilding posting counts...\n")
+
+        with transaction.commit_on_success():
+            postingCounts.rebuild()
+
+        self.stdout.write("Done!\n")
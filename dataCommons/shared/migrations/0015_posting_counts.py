@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+""" 0015_posting_counts.py
+
+    This South migration creates the PostingCount table used to hold the
+    pre-aggregated posting counts, along with the unique index on the
+    attributes of each posting count.  Note that the unique index treats
+    NULL locations as equal, so it has to be created manually.
+
+    Once this migration has been applied, the "rebuild_posting_counts"
+    management command should be run to calculate the posting counts for the
+    existing postings.
+"""
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        """ Apply this database migration.
+        """
+        # Adding model 'PostingCount'
+        db.create_table('shared_postingcount', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('hour', self.gf('django.db.models.fields.DateTimeField')(db_index=True)),
+            ('category', self.gf('django.db.models.fields.related.ForeignKey')(related_name='count_category', to=orm['shared.Category'])),
+            ('category_group', self.gf('django.db.models.fields.related.ForeignKey')(related_name='count_cat_group', to=orm['shared.CategoryGroup'])),
+            ('source', self.gf('django.db.models.fields.related.ForeignKey')(related_name='count_source', to=orm['shared.Source'])),
+            ('location_country', self.gf('django.db.models.fields.related.ForeignKey')(null=True, related_name='count_country', to=orm['shared.Location'])),
+            ('location_state', self.gf('django.db.models.fields.related.ForeignKey')(null=True, related_name='count_state', to=orm['shared.Location'])),
+            ('location_metro', self.gf('django.db.models.fields.related.ForeignKey')(null=True, related_name='count_metro', to=orm['shared.Location'])),
+            ('location_region', self.gf('django.db.models.fields.related.ForeignKey')(null=True, related_name='count_region', to=orm['shared.Location'])),
+            ('location_county', self.gf('django.db.models.fields.related.ForeignKey')(null=True, related_name='count_county', to=orm['shared.Location'])),
+            ('location_city', self.gf('django.db.models.fields.related.ForeignKey')(null=True, related_name='count_city', to=orm['shared.Location'])),
+            ('location_locality', self.gf('django.db.models.fields.related.ForeignKey')(null=True, related_name='count_locality', to=orm['shared.Location'])),
+            ('location_zipcode', self.gf('django.db.models.fields.related.ForeignKey')(null=True, related_name='count_zipcode', to=orm['shared.Location'])),
+            ('status_deleted', self.gf('django.db.models.fields.BooleanField')(default=False)),
+            ('has_image', self.gf('django.db.models.fields.BooleanField')(default=False)),
+            ('count', self.gf('django.db.models.fields.IntegerField')()),
+        ))
+        db.send_create_signal('shared', ['PostingCount'])
+
+        db.execute("""
+CREATE UNIQUE INDEX shared_postingcount_key
+    ON shared_postingcount (hour, category_id, category_group_id, source_id,
+                            COALESCE(location_country_id, 0),
+                            COALESCE(location_state_id, 0),
+                            COALESCE(location_metro_id, 0),
+                            COALESCE(location_region_id, 0),
+                            COALESCE(location_county_id, 0),
+                            COALESCE(location_city_id, 0),
+                            COALESCE(location_locality_id, 0),
+                            COALESCE(location_zipcode_id, 0),
+                            status_deleted, has_image);""")
+
+
+    def backwards(self, orm):
+        """ Undo this database migration.
+        """
+        # Deleting model 'PostingCount'
+        db.delete_table('shared_postingcount')
+
+
+    models = {
+        'shared.annotation': {
+            'Meta': {'object_name': 'Annotation'},
+            'annotation': ('django.db.models.fields.TextField', [], {'unique': 'True', 'db_index': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        'shared.category': {
+            'Meta': {'object_name': 'Category'},
+            'code': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '4', 'db_index': 'True'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['shared.CategoryGroup']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'rank': ('django.db.models.fields.IntegerField', [], {'db_index': 'True'})
+        },
+        'shared.categorygroup': {
+            'Meta': {'object_name': 'CategoryGroup'},
+            'code': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '4', 'db_index': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        'shared.imagereference': {
+            'Meta': {'object_name': 'ImageReference'},
+            'full_height': ('django.db.models.fields.IntegerField', [], {'null': 'True'}),
+            'full_url': ('django.db.models.fields.TextField', [], {'null': 'True'}),
+            'full_width': ('django.db.models.fields.IntegerField', [], {'null': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'posting': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['shared.Posting']"}),
+            'thumbnail_height': ('django.db.models.fields.IntegerField', [], {'null': 'True'}),
+            'thumbnail_url': ('django.db.models.fields.TextField', [], {'null': 'True'}),
+            'thumbnail_width': ('django.db.models.fields.IntegerField', [], {'null': 'True'})
+        },
+        'shared.location': {
+            'Meta': {'object_name': 'Location'},
+            'bounds_max_latitude': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '7', 'decimal_places': '5'}),
+            'bounds_max_longitude': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '8', 'decimal_places': '5'}),
+            'bounds_min_latitude': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '7', 'decimal_places': '5'}),
+            'bounds_min_longitude': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '8', 'decimal_places': '5'}),
+            'code': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '12', 'db_index': 'True'}),
+            'full_name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'level': ('django.db.models.fields.IntegerField', [], {}),
+            'short_name': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        'shared.posting': {
+            'Meta': {'unique_together': "(('source', 'external_id'),)", 'object_name': 'Posting'},
+            'account_id': ('django.db.models.fields.TextField', [], {'null': 'True'}),
+            'body': ('django.db.models.fields.TextField', [], {'null': 'True'}),
+            'category': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'posting_category'", 'to': "orm['shared.Category']"}),
+            'category_group': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'posting_cat_group'", 'to': "orm['shared.CategoryGroup']"}),
+            'currency': ('django.db.models.fields.TextField', [], {'null': 'True', 'db_index': 'True'}),
+            'expires': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'external_id': ('django.db.models.fields.TextField', [], {}),
+            'external_url': ('django.db.models.fields.TextField', [], {'null': 'True'}),
+            'has_image': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'heading': ('django.db.models.fields.TextField', [], {}),
+            'html': ('django.db.models.fields.TextField', [], {'null': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'immortal': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'inserted': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now', 'db_index': 'True'}),
+            'language': ('django.db.models.fields.TextField', [], {'null': 'True'}),
+            'location_accuracy': ('django.db.models.fields.IntegerField', [], {'null': 'True'}),
+            'location_bounds': ('django.db.models.fields.TextField', [], {'null': 'True'}),
+            'location_city': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'posting_city'", 'null': 'True', 'to': "orm['shared.Location']"}),
+            'location_country': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'posting_country'", 'null': 'True', 'to': "orm['shared.Location']"}),
+            'location_county': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'posting_county'", 'null': 'True', 'to': "orm['shared.Location']"}),
+            'location_latitude': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '7', 'decimal_places': '5'}),
+            'location_locality': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'posting_locality'", 'null': 'True', 'to': "orm['shared.Location']"}),
+            'location_longitude': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '8', 'decimal_places': '5'}),
+            'location_metro': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'posting_metro'", 'null': 'True', 'to': "orm['shared.Location']"}),
+            'location_region': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'posting_region'", 'null': 'True', 'to': "orm['shared.Location']"}),
+            'location_state': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'posting_state'", 'null': 'True', 'to': "orm['shared.Location']"}),
+            'location_zipcode': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'posting_zipcode'", 'null': 'True', 'to': "orm['shared.Location']"}),
+            'price': ('django.db.models.fields.FloatField', [], {'null': 'True', 'db_index': 'True'}),
+            'source': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'posting_source'", 'to': "orm['shared.Source']"}),
+            'status_deleted': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'status_found': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'status_lost': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'status_offered': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'status_stolen': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'status_wanted': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'})
+        },
+        'shared.postingannotation': {
+            'Meta': {'object_name': 'PostingAnnotation'},
+            'annotation': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['shared.Annotation']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'posting': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['shared.Posting']"})
+        },
+        'shared.postingcount': {
+            'Meta': {'object_name': 'PostingCount'},
+            'category': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'count_category'", 'to': "orm['shared.Category']"}),
+            'category_group': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'count_cat_group'", 'to': "orm['shared.CategoryGroup']"}),
+            'count': ('django.db.models.fields.IntegerField', [], {}),
+            'has_image': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'hour': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'location_city': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'count_city'", 'null': 'True', 'to': "orm['shared.Location']"}),
+            'location_country': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'count_country'", 'null': 'True', 'to': "orm['shared.Location']"}),
+            'location_county': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'count_county'", 'null': 'True', 'to': "orm['shared.Location']"}),
+            'location_locality': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'count_locality'", 'null': 'True', 'to': "orm['shared.Location']"}),
+            'location_metro': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'count_metro'", 'null': 'True', 'to': "orm['shared.Location']"}),
+            'location_region': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'count_region'", 'null': 'True', 'to': "orm['shared.Location']"}),
+            'location_state': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'count_state'", 'null': 'True', 'to': "orm['shared.Location']"}),
+            'location_zipcode': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'count_zipcode'", 'null': 'True', 'to': "orm['shared.Location']"}),
+            'source': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'count_source'", 'to': "orm['shared.Source']"}),
+            'status_deleted': ('django.db.models.fields.BooleanField', [], {'default': 'False'})
+        },
+        'shared.source': {
+            'Meta': {'object_name': 'Source'},
+            'code': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '8', 'db_index': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        }
+    }
+
+    complete_apps = ['shared']
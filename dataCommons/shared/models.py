@@ -197,3 +197,48 @@ class ImageReference(models.Model):
     thumbnail_width  = models.IntegerField(null=True)
     thumbnail_height = models.IntegerField(null=True)
 
+
+#############################################################################
+
+class PostingCount(models.Model):
+    """ The number of postings with a given set of attributes in a given hour.
+
+        The posting counts are a pre-aggregated summary of the Posting table,
+        used by the Summarizer API so that common summaries don't have to scan
+        through every matching posting.  There is one PostingCount record for
+        each combination of hour, category, category group, source, location,
+        deleted status and image status which has at least one posting.
+
+        The posting counts are kept up to date as postings are added and
+        updated, by the shared.lib.postingCounts module.  Note that there is
+        a unique index on the combination of the 'hour' field and all the
+        attribute fields, which treats NULL locations as equal; this is
+        created by the "0015_posting_counts" database migration.
+    """
+    id                = models.AutoField(primary_key=True)
+    hour              = models.DateTimeField(db_index=True)
+    category          = models.ForeignKey(Category,
+                                          related_name="count_category")
+    category_group    = models.ForeignKey(CategoryGroup,
+                                          related_name="count_cat_group")
+    source            = models.ForeignKey(Source,
+                                          related_name="count_source")
+    location_country  = models.ForeignKey(Location, null=True,
+                                          related_name="count_country")
+    location_state    = models.ForeignKey(Location, null=True,
+                                          related_name="count_state")
+    location_metro    = models.ForeignKey(Location, null=True,
+                                          related_name="count_metro")
+    location_region   = models.ForeignKey(Location, null=True,
+                                          related_name="count_region")
+    location_county   = models.ForeignKey(Location, null=True,
+                                          related_name="count_county")
+    location_city     = models.ForeignKey(Location, null=True,
+                                          related_name="count_city")
+    location_locality = models.ForeignKey(Location, null=True,
+                                          related_name="count_locality")
+    location_zipcode  = models.ForeignKey(Location, null=True,
+                                          related_name="count_zipcode")
+    status_deleted    = models.BooleanField(default=False)
+    has_image         = models.BooleanField(default=False)
+    count             = models.IntegerField()
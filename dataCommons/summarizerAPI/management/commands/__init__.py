@@ -0,0 +1 @@
+# Empty package initialisation file.
@@ -0,0 +1,79 @@
+""" dataCommons.summarizerAPI.management.commands.warm_summary_cache
+
+    This module defines the "warm_summary_cache" management command used by
+    the Data Commons system.  Running this command calculates the most
+    popular summaries and stores them into the summary cache, so that they are
+    ready before they are next requested.
+"""
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db                   import transaction
+
+from dataCommons.summarizerAPI import summaryCache
+
+#############################################################################
+
+DEFAULT_NUM_SUMMARIES = 50
+
+#############################################################################
+
+class Command(BaseCommand):
+    """ Our "warm_summary_cache" management command.
+    """
+    args        = 'none'
+    help        = 'Calculates the most popular summaries ahead of time.'
+    option_list = BaseCommand.option_list + (
+        make_option("--num",
+                    type="int",
+                    dest="num_summaries",
+                    default=DEFAULT_NUM_SUMMARIES,
+                    help="Number of summaries to calculate.  Default: %d." %
+                         DEFAULT_NUM_SUMMARIES),
+        make_option("--stale",
+                    action="store_true",
+                    dest="stale_only",
+                    default=False,
+                    help="Only recalculate summaries which are missing or " +
+                         "out of date."),
+    )
+
+    @transaction.commit_manually
+    def handle(self, *args, **options):
+        if len(args) > 0:
+            raise CommandError("This command doesn't take any parameters.")
+
+        num_summaries = options.get("num_summaries") or DEFAULT_NUM_SUMMARIES
+        stale_only    = options.get("stale_only", False)
+
+        # Decay the popularity of the summaries before choosing which ones to
+        # calculate.  This also trims the list of popular summaries.
+
+        summaryCache.decay_popularity()
+
+        num_calculated = 0
+        num_failed     = 0
+
+        try:
+            for criteria,dimension in summaryCache.get_popular(num_summaries):
+                if stale_only:
+                    entry = summaryCache.get(criteria, dimension)
+                    if entry != None and summaryCache.is_fresh(entry):
+                        continue
+
+                success,results = summaryCache.refresh(criteria, dimension)
+                transaction.commit()
+
+                if success:
+                    num_calculated = num_calculated + 1
+                else:
+                    num_failed = num_failed + 1
+                    self.stdout.write("Unable to calculate %s summary " %
+                                      dimension + "for %s: %s\n" %
+                                      (repr(criteria), results))
+        finally:
+            transaction.commit()
+
+        self.stdout.write("%d summaries calculated, %d failed.\n" %
+                          (num_calculated, num_failed))
+
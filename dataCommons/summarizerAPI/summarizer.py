@@ -0,0 +1,723 @@
+""" dataCommons.summarizerAPI.summarizer
+
+    This module implements the logic for calculating a summary of the postings
+    which match a given set of search criteria.
+"""
+import logging
+
+from django.conf import settings
+
+from django.db import connection, transaction
+from django.db.models.fields import FieldDoesNotExist
+from django.db.utils import DatabaseError
+from django.utils.datastructures import SortedDict
+
+from dataCommons.shared.models          import *
+from dataCommons.shared.lib             import dateHelpers
+from dataCommons.shared.lib             import eventRecorder
+from dataCommons.shared.lib             import postingCounts
+from dataCommons.shared.lib             import referenceRegistry
+from dataCommons.shared.lib             import searchHelpers
+
+#############################################################################
+
+# The dimensions we can summarize the postings on:
+
+DIMENSIONS = ["category", "location", "source", "time"]
+
+# The intervals we can summarize the postings over time by, mapped to the
+# length of each interval in seconds:
+
+TIME_INTERVALS = {"minute" : 60,
+                  "hour"   : 60 * 60,
+                  "day"    : 24 * 60 * 60}
+
+DEFAULT_TIME_INTERVAL = "hour"
+
+# The maximum number of time periods a time summary can include:
+
+MAX_TIME_PERIODS = 10000
+
+#############################################################################
+
+logger = logging.getLogger(__name__)
+
+#############################################################################
+
+def calc_summary(criteria, dimension):
+    """ Calculate and return a summary of postings.
+
+        'criteria' is a dictionary containing the supplied filter criteria,
+        and 'dimension' is the dimension to summarize the postings on, as
+        listed in DIMENSIONS, above.  For a "time" summary, the criteria
+        should also include an "interval" entry giving the size of each time
+        period, as listed in TIME_INTERVALS, above.
+
+        Upon completion, we return a (success, results) tuple, where 'success'
+        is True if and only if the summary was successfully calculated.
+
+        If 'success' is True, 'results' will be a list of (type, code, number)
+        tuples, where 'type' is the type of summary item, 'code' is the 3taps
+        code for that summary item, and 'number' is the number of matching
+        postings.
+
+        If 'success' is False, 'results' will be a string describing why the
+        summary could not be calculated.
+
+        Note that this must be called from within a managed transaction.
+    """
+    # Before running the query, set a timeout so we don't hang if the query
+    # takes too long.
+
+    cursor = connection.cursor()
+    cursor.execute("SET STATEMENT_TIMEOUT=%s" % settings.QUERY_TIMEOUT)
+
+    # The interval isn't a filter criteria, so take it out of the criteria.
+
+    criteria = criteria.copy()
+    interval = criteria.pop("interval", DEFAULT_TIME_INTERVAL)
+
+    # Calculate the appropriate type of summary.
+
+    if dimension == "category" and "category_group" not in criteria:
+        return _calc_category_group_summary(criteria)
+    elif dimension == "category" and 'category_group' in criteria:
+        return _calc_category_summary(criteria)
+    elif dimension == "location":
+        return _calc_location_summary(criteria)
+    elif dimension == "source":
+        return _calc_source_summary(criteria)
+    elif dimension == "time":
+        return _calc_time_summary(criteria, interval)
+    else:
+        return (False, "Unable to determine summary type")
+
+#############################################################################
+
+def calc_summaries(criteria, dimensions):
+    """ Calculate and return summaries of postings across several dimensions.
+
+        'criteria' is a dictionary containing the supplied filter criteria,
+        and 'dimensions' is a list of the dimensions to summarize the postings
+        on, as listed in DIMENSIONS, above.
+
+        Rather than calculating each summary separately, we select the
+        matching postings once, as a common table expression, and then group
+        these postings separately for each summary within the same query.
+
+        Upon completion, we return a (success, results) tuple, where 'success'
+        is True if and only if the summaries were successfully calculated.  If
+        'success' is True, 'results' will be a dictionary mapping each
+        dimension to its summary, in the form returned by calc_summary().
+        Otherwise, 'results' will be a string describing why the summaries
+        could not be calculated.
+
+        Note that this must be called from within a managed transaction.
+    """
+    if len(dimensions) == 1:
+        success,results = calc_summary(criteria, dimensions[0])
+        if not success:
+            return (False, results)
+        return (True, {dimensions[0] : results})
+
+    summaries = {} # Maps dimension to summary.
+
+    # The time summary groups the postings in a different way to the other
+    # summaries, so we calculate it separately.
+
+    if "time" in dimensions:
+        success,results = calc_summary(criteria, "time")
+        if not success:
+            return (False, results)
+        summaries["time"] = results
+        dimensions = [dimension for dimension in dimensions
+                      if dimension != "time"]
+
+    criteria = criteria.copy()
+    criteria.pop("interval", None)
+
+    # Before running the query, set a timeout so we don't hang if the query
+    # takes too long.
+
+    cursor = connection.cursor()
+    cursor.execute("SET STATEMENT_TIMEOUT=%s" % settings.QUERY_TIMEOUT)
+
+    # Collect the fields we need to group the postings by.
+
+    groupings = {} # Maps dimension to list of (type, field) tuples.
+    fields    = [] # List of fields to group the postings by.
+
+    for dimension in dimensions:
+        grouping = _get_grouping(criteria, dimension)
+        if grouping == None:
+            return (False, "Unable to determine summary type")
+        groupings[dimension] = grouping
+        for item_type,field in grouping:
+            if field not in fields:
+                fields.append(field)
+
+    # Build the query to select the matching postings.
+
+    success,results = _build_counts_query(criteria, fields)
+    if not success:
+        return (False, results)
+    else:
+        sql,params = results
+
+    # Count the matching postings for each summary.  The postings are only
+    # selected once; each summary then groups them on its own (type, record
+    # ID) expressions, so every summary returns a small number of rows.
+
+    selects = []
+    for i,dimension in enumerate(dimensions):
+        type_expr,id_expr = _get_grouping_expressions(groupings[dimension],
+                                                      fields)
+        selects.append("SELECT %d, %s, %s, SUM(p.n) FROM p GROUP BY 2, 3"
+                       % (i, type_expr, id_expr))
+
+    success,results = _run_counts_query("WITH p AS (" + sql + ") " +
+                                        " UNION ALL ".join(selects),
+                                        params)
+    if not success:
+        return (False, results)
+
+    # Finally, convert the counts into summaries.
+
+    codes = {} # Maps code type to dictionary mapping record ID to code.
+
+    for dimension in dimensions:
+        summaries[dimension] = []
+
+    for dimension_num,item_type,record_id,count in results:
+        if item_type == None:
+            # These postings don't have a value for any of the fields.
+            continue
+
+        if item_type in referenceRegistry.LOCATION_KINDS:
+            code_type = "location"
+        else:
+            code_type = item_type
+        if code_type not in codes:
+            codes[code_type] = referenceRegistry.get_codes(code_type)
+
+        summaries[dimensions[dimension_num]].append(
+                        (item_type, codes[code_type].get(record_id), count))
+
+    return (True, summaries)
+
+#############################################################################
+#                                                                           #
+#                    P R I V A T E   D E F I N I T I O N S                  #
+#                                                                           #
+#############################################################################
+
+def _calc_category_group_summary(criteria):
+    """ Calculate and return a summary of postings by category group.
+
+        'criteria' is a dictionary containing the supplied filter criteria.
+
+        Upon completion, we return a (success, results) tuple, where 'success'
+        is True if and only if the summary was successfully calculated.
+
+        If 'success' is True, 'results' will be a list of (type, code, number)
+        tuples, where 'type' is the type of summary item, 'code' is the 3taps
+        code for that summary item, and 'number' is the number of matching
+        postings.
+
+        If 'success' is False, 'results' will be a string describing why the
+        summary could not be calculated.
+    """
+    success,results = _calc_counts(criteria, ["category_group"])
+    if not success:
+        return (False, results)
+
+    codes = referenceRegistry.get_codes("category_group")
+
+    summary = []
+    for category_group_id,count in results:
+        summary.append(("category_group", codes.get(category_group_id), count))
+    return (True, summary)
+
+#############################################################################
+
+def _calc_category_summary(criteria):
+    """ Calculate and return a summary of postings by category.
+
+        'criteria' is a dictionary containing the supplied filter criteria.
+
+        If 'success' is True, 'results' will be a list of (type, code, number)
+        tuples, where 'type' is the type of summary item, 'code' is the 3taps
+        code for that summary item, and 'number' is the number of matching
+        postings.
+
+        If 'success' is False, 'results' will be a string describing why the
+        summary could not be calculated.
+    """
+    success,results = _calc_counts(criteria, ["category"])
+    if not success:
+        return (False, results)
+
+    codes = referenceRegistry.get_codes("category")
+
+    summary = []
+    for category_id,count in results:
+        summary.append(("category", codes.get(category_id), count))
+    return (True, summary)
+
+#############################################################################
+
+def _calc_location_summary(criteria):
+    """ Calculate and return a summary of postings by location.
+
+        'criteria' is a dictionary containing the supplied filter criteria.
+
+        If 'success' is True, 'results' will be a list of (type, code, number)
+        tuples, where 'type' is the type of summary item, 'code' is the 3taps
+        code for that summary item, and 'number' is the number of matching
+        postings.
+
+        If 'success' is False, 'results' will be a string describing why the
+        summary could not be calculated.
+    """
+    # Postings which don't have a location at the level we want to summarize
+    # on are summarized using the next lower level at which they do have a
+    # location.  Rather than drilling down one level at a time, we calculate
+    # each posting's "effective level" and location in SQL, and group on these
+    # so that the whole summary is calculated in a single pass.
+
+    grouping = _get_grouping(criteria, "location")
+    fields   = [field for level,field in grouping]
+
+    success,results = _calc_counts(criteria, fields,
+                                   _get_grouping_expressions(grouping, fields))
+    if not success:
+        return (False, results)
+
+    location_codes = referenceRegistry.get_codes("location")
+
+    summary = []
+    for level,location_id,count in results:
+        if level == None:
+            # These postings don't have a location at any of our levels.
+            continue
+        summary.append((level, location_codes.get(location_id), count))
+    return (True, summary)
+
+#############################################################################
+
+def _calc_source_summary(criteria):
+    """ Calculate and return a summary of postings by data source.
+
+        'criteria' is a dictionary containing the supplied filter criteria.
+
+        If 'success' is True, 'results' will be a list of (type, code, number)
+        tuples, where 'type' is the type of summary item, 'code' is the 3taps
+        code for that summary item, and 'number' is the number of matching
+        postings.
+
+        If 'success' is False, 'results' will be a string describing why the
+        summary could not be calculated.
+    """
+    success,results = _calc_counts(criteria, ["source"])
+    if not success:
+        return (False, results)
+
+    codes = referenceRegistry.get_codes("source")
+
+    summary = []
+    for source_id,count in results:
+        summary.append(("source", codes.get(source_id), count))
+    return (True, summary)
+
+#############################################################################
+
+def _calc_time_summary(criteria, interval):
+    """ Calculate and return a summary of postings over time.
+
+        'criteria' is a dictionary containing the supplied filter criteria,
+        and 'interval' is the size of each time period to summarize the
+        postings by, as listed in TIME_INTERVALS, above.  The criteria must
+        include a timestamp range, which sets the time periods to include.
+
+        If 'success' is True, 'results' will be a list of (type, timestamp,
+        number) tuples, one for each time period in chronological order,
+        where 'type' is the interval, 'timestamp' is the start of the time
+        period as a unix time value, and 'number' is the number of matching
+        postings within that time period.  Time periods without any matching
+        postings are included with a 'number' of zero.
+
+        If 'success' is False, 'results' will be a string describing why the
+        summary could not be calculated.
+    """
+    if interval not in TIME_INTERVALS:
+        return (False, "Unknown interval: " + interval)
+
+    if "timestamp" not in criteria:
+        return (False, "A time summary requires a timestamp range")
+
+    min_timestamp,max_timestamp = _parse_timeframe(criteria['timestamp'])
+    if min_timestamp == None:
+        return (False, "Invalid timestamp criteria: " + criteria['timestamp'])
+
+    period_size  = TIME_INTERVALS[interval]
+    first_period = min_timestamp // period_size * period_size
+
+    if (max_timestamp - first_period) // period_size >= MAX_TIME_PERIODS:
+        return (False, "Too many time periods")
+
+    # Count the postings in each time period.  Hourly and daily periods can
+    # be calculated from the postings' hours, which allows the posting counts
+    # to be used.
+
+    if interval == "minute":
+        field = "timestamp"
+    else:
+        field = "hour"
+
+    success,results = _calc_counts(criteria, [field],
+                                   ["date_trunc('%s', p.d0)" % interval])
+    if not success:
+        return (False, results)
+
+    counts = {} # Maps start of time period to number of postings.
+    for period,count in results:
+        counts[dateHelpers.datetime_to_seconds(period)] = count
+
+    # Finally, build the summary, filling in the empty time periods.
+
+    summary = []
+    for period in range(first_period, max_timestamp + 1, period_size):
+        summary.append((interval, period, counts.get(period, 0)))
+    return (True, summary)
+
+#############################################################################
+
+def _get_location_levels(criteria):
+    """ Return the location levels to use for a location summary.
+
+        'criteria' is a dictionary containing the supplied filter criteria.
+
+        We return a list of location levels, starting with the level to
+        summarize the postings on and followed by each lower level.  The
+        level to summarize on is based on the lowest-level of the supplied
+        criteria.
+    """
+    if "locality" in criteria:
+        level = "zipcode"
+    elif "city" in criteria:
+        level = "locality"
+    elif "county" in criteria:
+        level = "city"
+    elif "region" in criteria:
+        level = "county"
+    elif "metro" in criteria:
+        level = "region"
+    elif "state" in criteria:
+        level = "metro"
+    elif "country" in criteria:
+        level = "state"
+    else:
+        level = "country"
+
+    levels = referenceRegistry.LOCATION_KINDS
+    return levels[levels.index(level):]
+
+#############################################################################
+
+def _get_grouping(criteria, dimension):
+    """ Return the fields needed to summarize the postings on a dimension.
+
+        'criteria' is a dictionary containing the supplied filter criteria,
+        and 'dimension' is the dimension to summarize the postings on.
+
+        We return a list of (type, field) tuples, where 'type' is the type of
+        summary item and 'field' is the Posting field holding the record ID
+        for that type of summary item.  Postings are summarized on the first
+        of these fields which has a value.  If the dimension is unknown, we
+        return None.
+    """
+    if dimension == "category" and "category_group" not in criteria:
+        return [("category_group", "category_group")]
+    elif dimension == "category" and "category_group" in criteria:
+        return [("category", "category")]
+    elif dimension == "location":
+        return [(level, "location_" + level)
+                for level in _get_location_levels(criteria)]
+    elif dimension == "source":
+        return [("source", "source")]
+    else:
+        return None
+
+#############################################################################
+
+def _get_grouping_expressions(grouping, fields):
+    """ Return the SQL expressions used to group postings for a summary.
+
+        'grouping' is a list of (type, field) tuples, as returned by
+        _get_grouping(), and 'fields' is the list of fields selected for each
+        posting, as passed to _calc_counts().
+
+        We return a (type_expr, id_expr) tuple, where 'type_expr' is an SQL
+        expression giving the type of summary item a posting is counted
+        against, and 'id_expr' is an SQL expression giving the record ID for
+        that summary item.  The posting is counted against the first field in
+        the grouping which has a value; for location summaries, this is the
+        posting's "effective level" and location.  If none of the fields has a
+        value, both expressions will be NULL.
+    """
+    columns = ["p.d%d" % fields.index(field) for item_type,field in grouping]
+
+    type_expr = "CASE"
+    for (item_type,field),column in zip(grouping, columns):
+        type_expr = type_expr + \
+                " WHEN %s IS NOT NULL THEN '%s'" % (column, item_type)
+    type_expr = type_expr + " END"
+
+    id_expr = "COALESCE(" + ", ".join(columns) + ")"
+
+    return (type_expr, id_expr)
+
+#############################################################################
+
+def _calc_counts(criteria, fields, expressions=None):
+    """ Count the postings which match the given criteria.
+
+        'criteria' is a dictionary containing the supplied filter criteria,
+        and 'fields' is a list of Posting field names to group the postings
+        by.  As well as the Posting fields, the special field name "hour" can
+        be used to group the postings by the hour in which they were posted.
+        The value of the i'th field is available to the SQL expressions below
+        as "p.d<i>".
+
+        'expressions' is a list of SQL expressions to calculate and group the
+        postings on.  If this is not supplied, the postings are grouped on the
+        values of the fields themselves.
+
+        Upon completion, we return a (success, results) tuple, where 'success'
+        is True if and only if the postings were successfully counted.  If
+        'success' is True, 'results' will be a list of tuples containing the
+        value of each expression followed by the number of matching postings.
+        Otherwise, 'results' will be a string describing why the postings
+        could not be counted.
+
+        Where possible, the counts are taken from the PostingCount table
+        rather than by scanning through the matching postings.
+    """
+    if expressions == None:
+        expressions = ["p.d%d" % i for i in range(len(fields))]
+
+    success,results = _build_counts_query(criteria, fields)
+    if not success:
+        return (False, results)
+    else:
+        sql,params = results
+
+    return _run_counts_query("SELECT " + ", ".join(expressions) + ", " +
+                             "SUM(p.n) FROM (" + sql + ") AS p " +
+                             "GROUP BY " + ", ".join([str(i+1) for i in
+                                                range(len(expressions))]),
+                             params)
+
+#############################################################################
+
+def _build_counts_query(criteria, fields):
+    """ Build the SQL statement used to select the postings to count.
+
+        'criteria' is a dictionary containing the supplied filter criteria,
+        and 'fields' is a list of the fields to select, as passed to
+        _calc_counts().
+
+        Upon completion, we return a (success, results) tuple.  If 'success'
+        is True, 'results' will be an (sql, params) tuple holding an SQL
+        statement which returns a "d<i>" column for the i'th field, and an "n"
+        column holding the number of postings each row represents.  Otherwise,
+        'results' will be a string describing why the statement could not be
+        built.
+    """
+    success,results = _build_queries(criteria, fields)
+    if not success:
+        return (False, results)
+    else:
+        queries = results
+
+    # Combine the queries into a single SQL statement.  Each query selects
+    # the desired fields, along with the number of postings each row
+    # represents.
+
+    branches = []
+    params   = []
+    for query,count in queries:
+        select = SortedDict()
+        for i,field in enumerate(fields):
+            select["d%d" % i] = _get_column(query.model, field)
+        select["n"] = count
+
+        query = query.order_by().extra(select=select)
+        query = query.values_list(*select.keys())
+
+        sql,query_params = query.query.sql_with_params()
+        branches.append("(" + sql + ")")
+        params.extend(query_params)
+
+    return (True, (" UNION ALL ".join(branches), params))
+
+#############################################################################
+
+def _run_counts_query(sql, params):
+    """ Run an SQL statement which counts postings.
+
+        The last column returned by the statement should be the number of
+        postings.  Upon completion, we return a (success, results) tuple.  If
+        'success' is True, 'results' will be a list of the returned rows, with
+        the number of postings converted to an integer.  Otherwise, 'results'
+        will be a string describing why the statement failed.
+    """
+    try:
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    except DatabaseError,e:
+        transaction.rollback() # Let the database keep working.
+        if "statement timeout" in str(e):
+            # The query timed out.  Tell the user the bad news.
+            eventRecorder.record("SUMMARIZER_API", "QUERY_TIMED_OUT",
+                                 text=sql)
+            logger.debug("DATABASE TIMEOUT, query=" + sql)
+            transaction.commit()
+            return (False, "Database timeout")
+        else:
+            raise
+
+    results = []
+    for row in rows:
+        results.append(tuple(row[:-1]) + (int(row[-1]),))
+    return (True, results)
+
+#############################################################################
+
+def _build_queries(criteria, fields):
+    """ Build the queries used to count the postings matching the criteria.
+
+        'criteria' is a dictionary containing the supplied filter criteria,
+        and 'fields' is the list of fields the postings will be grouped by.
+
+        Upon completion, we return a (success, results) tuple, where 'success'
+        is True if and only if the queries could be built.  If 'success' is
+        True, 'results' will be a list of (query, count) tuples, where 'query'
+        is a QuerySet against either the Posting or the PostingCount table,
+        and 'count' is an SQL expression giving the number of postings each
+        row in that query represents.  Otherwise, 'results' will be a string
+        describing why the queries could not be built.
+
+        If the posting counts can answer the criteria and hold all the given
+        fields, the whole hours within the requested timeframe are counted
+        using the PostingCount table, and only the partial hours at either
+        end of the timeframe are counted using the Posting table.
+    """
+    use_counts = postingCounts.can_answer(criteria)
+    for field in fields:
+        if _get_column(PostingCount, field) == None:
+            use_counts = False
+
+    if not use_counts:
+        success,results = searchHelpers.build_search_query(criteria)
+        if not success:
+            return (False, results)
+        return (True, [(results, "1")])
+
+    count_criteria   = criteria.copy()
+    posting_criteria = [] # List of criteria for the partial hours.
+    first_hour       = None
+    end_hour         = None
+
+    if "timestamp" in criteria:
+        min_timestamp,max_timestamp = _parse_timeframe(criteria['timestamp'])
+        if min_timestamp == None:
+            # Let the Posting query report the invalid timestamp.
+            success,results = searchHelpers.build_search_query(criteria)
+            if not success:
+                return (False, results)
+            return (True, [(results, "1")])
+
+        first_hour = (min_timestamp + 3599) // 3600 * 3600
+        end_hour   = (max_timestamp + 1) // 3600 * 3600
+
+        if first_hour >= end_hour:
+            # The timeframe doesn't include any whole hours.
+            success,results = searchHelpers.build_search_query(criteria)
+            if not success:
+                return (False, results)
+            return (True, [(results, "1")])
+
+        del count_criteria['timestamp']
+
+        if min_timestamp < first_hour:
+            partial = criteria.copy()
+            partial['timestamp'] = "%d..%d" % (min_timestamp, first_hour - 1)
+            posting_criteria.append(partial)
+
+        if end_hour <= max_timestamp:
+            partial = criteria.copy()
+            partial['timestamp'] = "%d..%d" % (end_hour, max_timestamp)
+            posting_criteria.append(partial)
+
+    success,results = searchHelpers.build_search_query(count_criteria,
+                                                       model=PostingCount)
+    if not success:
+        return (False, results)
+    else:
+        query = results
+
+    if first_hour != None:
+        query = query.filter(hour__gte=dateHelpers.datetime_in_utc(first_hour),
+                             hour__lt=dateHelpers.datetime_in_utc(end_hour))
+
+    queries = [(query, '"shared_postingcount"."count"')]
+
+    for partial in posting_criteria:
+        success,results = searchHelpers.build_search_query(partial)
+        if not success:
+            return (False, results)
+        queries.append((results, "1"))
+
+    return (True, queries)
+
+#############################################################################
+
+def _get_column(model, field):
+    """ Return the SQL expression used to select a field from a model's table.
+
+        'model' is either the Posting or the PostingCount model, and 'field'
+        is the name of the field to select.  The special field name "hour"
+        selects the hour in which the posting was made.
+
+        If the given model doesn't have the given field, we return None.
+    """
+    table = model._meta.db_table
+    if field == "hour" and model == Posting:
+        return "date_trunc('hour', \"%s\".\"timestamp\")" % table
+
+    try:
+        column = model._meta.get_field(field).column
+    except FieldDoesNotExist:
+        return None
+    return '"%s"."%s"' % (table, column)
+
+#############################################################################
+
+def _parse_timeframe(timeframe):
+    """ Parse a "timestamp" search criteria value.
+
+        We return a (min_timestamp, max_timestamp) tuple, where each value is
+        a number of seconds since the epoch.  If the timeframe is invalid, we
+        return (None, None).
+    """
+    if ".." not in timeframe:
+        return (None, None)
+
+    s1,s2 = timeframe.split("..", 1)
+    try:
+        return (int(s1), int(s2))
+    except ValueError:
+        return (None, None)
+
@@ -0,0 +1,264 @@
+""" dataCommons.summarizerAPI.summaryCache
+
+    This module implements a cache of calculated summaries, so that the same
+    summary doesn't have to be recalculated each time it is requested.
+
+    Each summary is cached under a key made from the (canonicalized) search
+    criteria and the summary dimension, and is stored in the data cache for up
+    to SUMMARY_CACHE_TTL seconds.  Along with the summary itself, we record the
+    ingest watermark at the time the summary was calculated.  If the watermark
+    has since moved on, the summary may be out of date; stale summaries which
+    are less than SUMMARY_CACHE_STALE_TIME seconds old can still be used
+    while a fresh copy of the summary is calculated in the background.
+
+    As postings arrive continuously, the watermark moves on almost all the
+    time.  To stop popular summaries from being recalculated back to back, a
+    summary is treated as fresh for SUMMARY_CACHE_MIN_AGE seconds after it was
+    calculated, and only one background refresh of a summary is started
+    within REFRESH_LOCK_TIME seconds.
+
+    We also keep track of how often each summary is requested, so that the
+    most popular summaries can be calculated ahead of time by the
+    "warm_summary_cache" management command.  The request counts decay over
+    time, so that the summaries which are popular now replace the ones which
+    were popular in the past.
+"""
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+
+import simplejson as json
+
+from dataCommons.shared.lib    import dataCache, ingestWatermark
+from dataCommons.summarizerAPI import summarizer
+
+#############################################################################
+
+# The data cache key used to store the popularity of each summary:
+
+POPULARITY_KEY = "summary_popularity"
+
+# The maximum number of summaries to keep track of the popularity for.  Note
+# that more summaries than this may be tracked until decay_popularity() is
+# next called:
+
+POPULARITY_SIZE = 1000
+
+# The number of seconds it takes for a summary's request count to decay to
+# half its value, and the data cache key used to store the time at which the
+# request counts were last decayed:
+
+POPULARITY_HALF_LIFE = 24 * 60 * 60
+POPULARITY_DECAY_KEY = "summary_popularity_decayed_at"
+
+# The criteria whose values are 3taps codes, and are therefore not case
+# sensitive:
+
+CODE_CRITERIA = ["category_group", "category", "country", "state", "metro",
+                 "region", "county", "city", "locality", "zipcode", "source"]
+
+# The minimum number of seconds between background refreshes of a summary.
+# Only one refresh of a given summary will be started within this time.
+
+REFRESH_LOCK_TIME = 60
+
+#############################################################################
+
+logger = logging.getLogger(__name__)
+
+#############################################################################
+
+def canonicalize(criteria):
+    """ Return a canonical version of the given search criteria.
+
+        'criteria' is a dictionary containing the supplied filter criteria.  We
+        return a copy of the criteria with surrounding whitespace removed from
+        each value, and with the 3taps codes converted to uppercase, so that
+        equivalent searches share the same cache entry.
+    """
+    canonical = {}
+    for name,value in criteria.items():
+        value = value.strip()
+        if name in CODE_CRITERIA:
+            value = value.upper()
+        canonical[name] = value
+    return canonical
+
+#############################################################################
+
+def get(criteria, dimension):
+    """ Return the cached summary for the given criteria and dimension.
+
+        If there is no cached summary, we return None.  Otherwise, we return a
+        dictionary with the following entries:
+
+            'summary'
+
+                The cached summary, as returned by summarizer.calc_summary().
+
+            'watermark'
+
+                The ingest watermark at the time the summary was calculated.
+
+            'calculated_at'
+
+                The time at which the summary was calculated, as a number of
+                seconds since the epoch.
+    """
+    return dataCache.get(_make_key(criteria, dimension))
+
+#############################################################################
+
+def is_fresh(entry):
+    """ Return True if the given cached summary is up to date.
+
+        'entry' is a cached summary, as returned by get().  The summary is up
+        to date if no postings have been stored since it was calculated, or if
+        it was calculated less than SUMMARY_CACHE_MIN_AGE seconds ago.
+    """
+    age = time.time() - entry['calculated_at']
+    if age < settings.SUMMARY_CACHE_MIN_AGE:
+        return True
+    return entry['watermark'] == ingestWatermark.get()
+
+#############################################################################
+
+def is_usable(entry):
+    """ Return True if the given out-of-date summary can still be used.
+
+        'entry' is a cached summary, as returned by get().  Out-of-date
+        summaries can be used while they are less than
+        SUMMARY_CACHE_STALE_TIME seconds old.
+    """
+    age = time.time() - entry['calculated_at']
+    return age < settings.SUMMARY_CACHE_STALE_TIME
+
+#############################################################################
+
+def start_refresh(criteria, dimension):
+    """ Claim the right to refresh the given summary in the background.
+
+        We return True if the caller should start a background refresh of the
+        given summary, or False if a refresh has been started within the last
+        REFRESH_LOCK_TIME seconds.  Note that the lock isn't released when the
+        refresh finishes; it simply expires, so that the summary isn't
+        refreshed again straight away.
+    """
+    return dataCache.add(_make_lock_key(criteria, dimension), True,
+                         ttl=REFRESH_LOCK_TIME)
+
+#############################################################################
+
+def refresh(criteria, dimension):
+    """ Calculate the given summary, and store it into the cache.
+
+        We return the (success, results) tuple returned by
+        summarizer.calc_summary().  The summary is only cached if it was
+        calculated successfully; a failure to cache the summary is logged
+        rather than raised.
+
+        Note that this must be called from within a managed transaction.
+    """
+    success,results = refresh_many(criteria, [dimension])
+    if success:
+        return (True, results[dimension])
+    else:
+        return (False, results)
+
+#############################################################################
+
+def refresh_many(criteria, dimensions):
+    """ Calculate several summaries at once, and store them into the cache.
+
+        The summaries for the given list of dimensions are calculated
+        together using summarizer.calc_summaries(), and we return the
+        (success, results) tuple it returns.  As with refresh(), the
+        summaries are only cached if they were calculated successfully.
+
+        Note that this must be called from within a managed transaction.
+    """
+    watermark = ingestWatermark.get()
+
+    success,results = summarizer.calc_summaries(criteria, dimensions)
+
+    if success:
+        try:
+            for dimension in dimensions:
+                dataCache.set(_make_key(criteria, dimension),
+                              {'summary'       : results[dimension],
+                               'watermark'     : watermark,
+                               'calculated_at' : time.time()},
+                              ttl=settings.SUMMARY_CACHE_TTL)
+        except:
+            logger.exception("Unable to cache summary")
+
+    return (success, results)
+
+#############################################################################
+
+def record_request(criteria, dimension):
+    """ Record the fact that the given summary has been requested.
+    """
+    member = json.dumps({'criteria'  : canonicalize(criteria),
+                         'dimension' : dimension}, sort_keys=True)
+    dataCache.incr_score(POPULARITY_KEY, member)
+
+#############################################################################
+
+def decay_popularity():
+    """ Decay the request counts for the summaries, and trim the list.
+
+        Each summary's request count is halved every POPULARITY_HALF_LIFE
+        seconds, and only the POPULARITY_SIZE most popular summaries are kept.
+        This should be called periodically; the "warm_summary_cache"
+        management command does this each time it is run.
+    """
+    now        = int(time.time())
+    decayed_at = dataCache.get_counter(POPULARITY_DECAY_KEY)
+    dataCache.set_counter(POPULARITY_DECAY_KEY, now)
+
+    if decayed_at == None:
+        factor = 1
+    else:
+        factor = 0.5 ** (float(now - decayed_at) / POPULARITY_HALF_LIFE)
+
+    dataCache.decay_scores(POPULARITY_KEY, factor,
+                           max_members=POPULARITY_SIZE)
+
+#############################################################################
+
+def get_popular(num_summaries):
+    """ Return the most popular summaries.
+
+        We return a list of up to 'num_summaries' (criteria, dimension) tuples
+        for the most frequently requested summaries, most popular first.
+    """
+    popular = []
+    for member,score in dataCache.get_top_scores(POPULARITY_KEY,
+                                                 num_summaries):
+        summary = json.loads(member)
+        popular.append((summary['criteria'], summary['dimension']))
+    return popular
+
+#############################################################################
+#                                                                           #
+#                    P R I V A T E   D E F I N I T I O N S                  #
+#                                                                           #
+#############################################################################
+
+def _make_key(criteria, dimension):
+    """ Return the data cache key to use for the given summary.
+    """
+    canonical = json.dumps({'criteria'  : canonicalize(criteria),
+                            'dimension' : dimension}, sort_keys=True)
+    return "summary." + hashlib.md5(canonical).hexdigest()
+
+#############################################################################
+
+def _make_lock_key(criteria, dimension):
+    """ Return the data cache key used to lock a refresh of a summary.
+    """
+    return _make_key(criteria, dimension) + ".refreshing"
+
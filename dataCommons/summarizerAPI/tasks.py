@@ -0,0 +1,35 @@
+""" dataCommons.summarizerAPI.tasks
+
+    This module implements the background tasks run by the Celery task queuing
+    system.
+"""
+import logging
+
+from celery import task
+
+from django.db import transaction
+
+from dataCommons.shared.lib.decorators import print_exceptions_to_stdout
+
+from dataCommons.summarizerAPI import summaryCache
+
+#############################################################################
+
+logger = logging.getLogger(__name__)
+
+#############################################################################
+
+@task()
+@print_exceptions_to_stdout
+@transaction.commit_manually
+def refresh_summary(criteria, dimension):
+    """ Recalculate the given summary, and store it into the summary cache.
+
+        This is used to bring an out-of-date cached summary up to date without
+        making the caller wait for the summary to be recalculated.
+    """
+    try:
+        summaryCache.refresh(criteria, dimension)
+    finally:
+        transaction.commit()
+
@@ -11,19 +11,15 @@ from django.conf import settings
 from django.http import HttpResponse, HttpResponseNotAllowed
 from django.http import HttpResponseBadRequest
 
-from django.db.models import Count
-
 from django.views.decorators.csrf import csrf_exempt
 
-from django.db import connection, transaction
-from django.db.utils import DatabaseError
+from django.db import transaction
 
 import simplejson as json
 
-from dataCommons.shared.models          import *
 from dataCommons.shared.lib.decorators  import *
 from dataCommons.shared.lib             import eventRecorder
-from dataCommons.shared.lib             import searchHelpers
+from dataCommons.summarizerAPI          import summarizer, summaryCache, tasks
 
 #############################################################################
 
@@ -64,33 +60,39 @@ def summarize(request):
     # Process our other parameters.
 
     if "dimension" in request.GET:
-        dimension = request.GET['dimension']
-        if dimension not in ["category", "location", "source"]:
-            return HttpResponseBadRequest("Unknown dimension: " + dimension)
+        dimensions = []
+        for dimension in request.GET['dimension'].split(","):
+            dimension = dimension.strip()
+            if dimension not in summarizer.DIMENSIONS:
+                return HttpResponseBadRequest("Unknown dimension: " +
+                                              dimension)
+            if dimension not in dimensions:
+                dimensions.append(dimension)
     else:
         return HttpResponseBadRequest("Missing required 'dimension' parameter")
 
-    # Before running the query, set a timeout so we don't hang if the query
-    # takes too long.
+    # Time summaries are calculated using the given interval.  This is passed
+    # to the summarizer along with the criteria, so that summaries using
+    # different intervals are cached separately.
 
-    cursor = connection.cursor()
-    cursor.execute("SET STATEMENT_TIMEOUT=%s" % settings.QUERY_TIMEOUT)
+    if "time" in dimensions:
+        interval = request.GET.get("interval",
+                                   summarizer.DEFAULT_TIME_INTERVAL)
+        if interval not in summarizer.TIME_INTERVALS:
+            return HttpResponseBadRequest("Unknown interval: " + interval)
+        criteria['interval'] = interval
 
-    # Calculate the appropriate type of summary.
+    # Calculate the summaries, using the summary cache if we can.
 
-    if dimension == "category" and "category_group" not in criteria:
-        success,results = _calc_category_group_summary(criteria)
-    elif dimension == "category" and 'category_group' in criteria:
-        success,results = _calc_category_summary(criteria)
-    elif dimension == "location":
-        success,results = _calc_location_summary(criteria)
-    elif dimension == "source":
-        success,results = _calc_source_summary(criteria)
+    if settings.ENABLE_SUMMARY_CACHE:
+        success,results = _get_summaries(criteria, dimensions)
     else:
-        return HttpResponse(json.dumps({'success' : False,
-                                        'error'   : "Unable to determine " +
-                                                    "summary type"}),
-                            mimetype="application/json")
+        success,results = summarizer.calc_summaries(criteria, dimensions)
+
+    # If only one dimension was requested, return its summary directly.
+
+    if success and "," not in request.GET['dimension']:
+        results = results[dimensions[0]]
 
     # Record an event telling us how long the summary request took.
 
@@ -117,275 +119,49 @@ def summarize(request):
 #                                                                           #
 #############################################################################
 
-def _calc_category_group_summary(criteria):
-    """ Calculate and return a summary of postings by category group.
-
-        'criteria' is a dictionary containing the supplied filter criteria.
-
-        Upon completion, we return a (success, results) tuple, where 'success'
-        is True if and only if the summary was successfully calculated.
-
-        If 'success' is True, 'results' will be a list of (type, code, number)
-        tuples, where 'type' is the type of summary item, 'code' is the 3taps
-        code for that summary item, and 'number' is the number of matching
-        postings.
-
-        If 'success' is False, 'results' will be a string describing why the
-        summary could not be calculated.
-    """
-    query = None # initially.
-
-    try:
-        success,results = searchHelpers.build_search_query(criteria)
-        if not success:
-            return (False, results)
-        else:
-            query = results
-
-        query = query.values("category_group__code")
-
-        results = []
-        for row in query.annotate(count=Count("id")):
-            results.append(("category_group",
-                            row['category_group__code'],
-                            row['count']))
-    except DatabaseError,e:
-        transaction.rollback() # Let the database keep working.
-        if "statement timeout" in str(e):
-            # The query timed out.  Tell the user the bad news.
-            if query != None:
-                sql = str(query.query)
-                eventRecorder.record("SUMMARIZER_API", "QUERY_TIMED_OUT",
-                                     text=sql)
-                logger.debug("DATABASE TIMEOUT, query=" + sql)
-                transaction.commit()
-            return (False, "Database timeout")
-        else:
-            raise
-
-    return (True, results)
-
-#############################################################################
-
-def _calc_category_summary(criteria):
-    """ Calculate and return a summary of postings by category.
+def _get_summaries(criteria, dimensions):
+    """ Return summaries of postings, using the summary cache if possible.
 
-        'criteria' is a dictionary containing the supplied filter criteria.
+        'criteria' is a dictionary containing the supplied filter criteria,
+        and 'dimensions' is a list of the dimensions to summarize the postings
+        on.
 
-        If 'success' is True, 'results' will be a list of (type, code, number)
-        tuples, where 'type' is the type of summary item, 'code' is the 3taps
-        code for that summary item, and 'number' is the number of matching
-        postings.
+        If the summary cache has an up-to-date copy of a summary, we use it.
+        If the cached summary is out of date but still usable, we use it and
+        refresh the cached summary in the background.  The remaining summaries
+        are calculated together and added to the cache.
 
-        If 'success' is False, 'results' will be a string describing why the
-        summary could not be calculated.
+        We return a (success, results) tuple, as returned by
+        summarizer.calc_summaries().
     """
-    query = None # initially.
+    summaries = {} # Maps dimension to summary.
+    missing   = [] # List of dimensions which have to be calculated.
 
     try:
-        success,results = searchHelpers.build_search_query(criteria)
+        for dimension in dimensions:
+            summaryCache.record_request(criteria, dimension)
+            entry = summaryCache.get(criteria, dimension)
+            if entry != None:
+                if summaryCache.is_fresh(entry):
+                    summaries[dimension] = entry['summary']
+                    continue
+                elif summaryCache.is_usable(entry):
+                    if summaryCache.start_refresh(criteria, dimension):
+                        tasks.refresh_summary.delay(criteria, dimension)
+                    summaries[dimension] = entry['summary']
+                    continue
+            missing.append(dimension)
+    except:
+        # If the summary cache isn't working, calculate the summaries directly
+        # rather than failing the request.
+        logger.exception("Unable to use the summary cache")
+        return summarizer.calc_summaries(criteria, dimensions)
+
+    if len(missing) > 0:
+        success,results = summaryCache.refresh_many(criteria, missing)
         if not success:
             return (False, results)
-        else:
-            query = results
-
-        query = query.values("category__code")
-
-        results = []
-        for row in query.annotate(count=Count("id")):
-            results.append(("category",
-                            row['category__code'],
-                            row['count']))
-    except DatabaseError,e:
-        transaction.rollback() # Let the database keep working.
-        if "statement timeout" in str(e):
-            # The query timed out.  Tell the user the bad news.
-            if query != None:
-                sql = str(query.query)
-                eventRecorder.record("SUMMARIZER_API", "QUERY_TIMED_OUT",
-                                     text=sql)
-                logger.debug("DATABASE TIMEOUT, query=" + sql)
-                transaction.commit()
-            return (False, "Database timeout")
-        else:
-            raise
-
-    return (True, results)
+        summaries.update(results)
 
-#############################################################################
-
-def _calc_location_summary(criteria):
-    """ Calculate and return a summary of postings by location.
-
-        'criteria' is a dictionary containing the supplied filter criteria.
-
-        If 'success' is True, 'results' will be a list of (type, code, number)
-        tuples, where 'type' is the type of summary item, 'code' is the 3taps
-        code for that summary item, and 'number' is the number of matching
-        postings.
-
-        If 'success' is False, 'results' will be a string describing why the
-        summary could not be calculated.
-    """
-    # See what level of location we want to summarize on.  This is based on the
-    # lowest-level of the supplied criteria.
-
-    if "locality" in criteria:
-        level = "zipcode"
-    elif "city" in criteria:
-        level = "locality"
-    elif "county" in criteria:
-        level = "city"
-    elif "region" in criteria:
-        level = "county"
-    elif "metro" in criteria:
-        level = "region"
-    elif "state" in criteria:
-        level = "metro"
-    elif "country" in criteria:
-        level = "state"
-    else:
-        level = "country"
-
-    # Repeatedly process locations at this level, and drill down if we need to
-    # to get lower-level locations.
-
-    filter_results = []
-    null_fields    = []
-
-    while True:
-
-        # Start by making a database query for the matching postings at this
-        # level.
-
-        query = None # initially.
-
-        try:
-            success,results = searchHelpers.build_search_query(criteria)
-
-            if not success:
-                return (False, results)
-            else:
-                query = results
-
-            kwargs = {}
-            for field in null_fields:
-                kwargs[field] = None
-            query = query.filter(**kwargs)
-
-            grouping_field = "location_" + level + "__code"
-
-            query = query.values(grouping_field)
-
-            # Process the search results at this level.  Note that we might
-            # encounter a row where the location code is NULL -- if this
-            # happens, we'll have to drill down to a lower level.
-
-            drill_down = False # initially.
-            for row in query.annotate(count=Count("id")):
-                if row[grouping_field] == None:
-                    # We have some postings which don't match this level -> we
-                    # have to drill down further.
-                    drill_down = True
-                else:
-                    # Add this row to the summary results.
-                    filter_results.append((level,
-                                           row[grouping_field],
-                                           row['count']))
-        except DatabaseError,e:
-            transaction.rollback() # Let the database keep working.
-            if "statement timeout" in str(e):
-                # The query timed out.  Tell the user the bad news.
-                if query != None:
-                    sql = str(query.query)
-                    eventRecorder.record("SUMMARIZER_API", "QUERY_TIMED_OUT",
-                                         text=sql)
-                    logger.debug("DATABASE TIMEOUT, query=" + sql)
-                    transaction.commit()
-                return (False, "Database timeout")
-            else:
-                raise
-
-        # If we have to drill down, do so now.
-
-        if drill_down:
-
-            # Add this level's location to the list of "null fields".  These
-            # are fields which must have the value NULL in subsequent searches
-            # as we continue to drill down.
-
-            null_fields.append("location_" + level)
-
-            # Continue searching at the next lower level.
-
-            if level == "country":
-                level = "state"
-            elif level == "state":
-                level = "metro"
-            elif level == "metro":
-                level = "region"
-            elif level == "region":
-                level = "county"
-            elif level == "county":
-                level = "city"
-            elif level == "city":
-                level = "locality"
-            elif level == "locality":
-                level = "zipcode"
-            elif level == "zipcode":
-                # We've reached the bottom -> give up.
-                break
-
-            continue
-        else:
-            break
-
-    return (True, filter_results)
-
-#############################################################################
-
-def _calc_source_summary(criteria):
-    """ Calculate and return a summary of postings by data source.
-
-        'criteria' is a dictionary containing the supplied filter criteria.
-
-        If 'success' is True, 'results' will be a list of (type, code, number)
-        tuples, where 'type' is the type of summary item, 'code' is the 3taps
-        code for that summary item, and 'number' is the number of matching
-        postings.
-
-        If 'success' is False, 'results' will be a string describing why the
-        summary could not be calculated.
-    """
-    query = None # initially.
-
-    try:
-        success,results = searchHelpers.build_search_query(criteria)
-        if not success:
-            return (False, results)
-        else:
-            query = results
-
-        query = query.values("source__code")
-
-        results = []
-        for row in query.annotate(count=Count("id")):
-            results.append(("source",
-                            row['source__code'],
-                            row['count']))
-    except DatabaseError,e:
-        transaction.rollback() # Let the database keep working.
-        if "statement timeout" in str(e):
-            # The query timed out.  Tell the user the bad news.
-            if query != None:
-                sql = str(query.query)
-                eventRecorder.record("SUMMARIZER_API", "QUERY_TIMED_OUT",
-                                     text=sql)
-                logger.debug("DATABASE TIMEOUT, query=" + sql)
-                transaction.commit()
-            return (False, "Database timeout")
-        else:
-            raise
-
-    return (True, results)
+    return (True, summaries)
 